@@ -0,0 +1,296 @@
+# Copyright 2024 Thales Silicon Security
+#
+# Licensed under the Solderpad Hardware Licence, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# SPDX-License-Identifier: Apache-2.0 WITH SHL-2.0
+# You may obtain a copy of the License at https://solderpad.org/licenses/
+#
+# Original Author: Côme ALLART - Thales
+
+"""
+Whole-trace statistics computed without simulation, with numpy
+
+The trace is read by chunks of instruction words. Each distinct word is
+decoded once with `isa.decode`, then the statistics are computed on arrays:
+instruction mix, compressed ratio, branch taken rate, distance to the
+producer of each instruction (RAW dependency distance), and a first-order
+IPC estimate.
+
+Binary traces (see `bintrace.py`) are mapped directly, which is the fast
+way to analyze very long traces.
+"""
+
+import argparse
+import itertools
+import sys
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from bintrace import BinaryTrace, is_binary_trace, HEADER, RECORD
+from isa import Instr, decode
+from model import Instruction, parse_trace
+
+# Flags of an instruction word
+LOAD, STORE, BRANCH, JUMP, REGJUMP, MULDIV, COMPRESSED, RET = \
+    (1 << i for i in range(8))
+
+KINDS = [
+    ("load", LOAD),
+    ("store", STORE),
+    ("branch", BRANCH),
+    ("jump", JUMP),
+    ("regjump", REGJUMP),
+    ("muldiv", MULDIV),
+]
+
+# Registers tracked for dependencies (x1 to x31, room for FP registers)
+N_REGS = 64
+
+# Distances above are counted together
+MAX_DISTANCE = 32
+
+def record_dtype():
+    "numpy type of the records of a binary trace, see bintrace.RECORD"
+    dtype = np.dtype([
+        ("address", "<u8"),
+        ("cycle", "<i8"),
+        ("code", "<u4"),
+        ("mnemo", "<u4"),
+        ("mem_addr", "<u8"),
+        ("flags", "<u4"),
+        ("layout", "<u4"),
+    ])
+    assert dtype.itemsize == RECORD.size
+    return dtype
+
+def chunks(path, size=1 << 22):
+    "Generate (addresses, instruction words) arrays of a trace"
+    if is_binary_trace(path):
+        trace = BinaryTrace(path)
+        records = np.frombuffer(trace.map, dtype=record_dtype(),
+            count=len(trace), offset=HEADER.size)
+        for start in range(0, len(records), size):
+            chunk = records[start:start + size]
+            yield chunk["address"], chunk["code"]
+        return
+    fields = parse_trace(path)
+    while True:
+        rows = list(itertools.islice(fields, size))
+        if not rows:
+            return
+        yield (
+            np.array([int(row[1], 16) for row in rows], dtype=np.uint64),
+            np.array([int(row[2], 16) for row in rows], dtype=np.uint32))
+
+def decode_table(words, xlen=32):
+    "Flags, size and registers (rd, rs1, rs2, rs3) of instruction words"
+    flags = np.zeros(len(words), dtype=np.uint8)
+    size = np.zeros(len(words), dtype=np.int64)
+    regs = np.full((4, len(words)), -1, dtype=np.int16)
+    for i, word in enumerate(words.tolist()):
+        d = decode(word, xlen)
+        flags[i] = (LOAD * d.is_load | STORE * d.is_store
+            | BRANCH * d.is_branch | JUMP * d.is_jump
+            | REGJUMP * d.is_regjump | MULDIV * bool(d.is_muldiv)
+            | COMPRESSED * d.is_compressed
+            | RET * (d.is_regjump and Instruction.is_ret(Instr(word, xlen))))
+        size[i] = d.size
+        for row, reg in enumerate([d.rd, d.rs1, d.rs2, d.rs3]):
+            if reg is not None and 0 < reg < N_REGS:
+                regs[row, i] = reg
+    return flags, size, regs
+
+class Analysis:
+    """
+    Statistics accumulated chunk by chunk
+    The last instruction of a chunk, the last writer of each register and
+    the last outcome of each branch are carried to the next chunk.
+    """
+
+    def __init__(self, xlen=32):
+        self.xlen = xlen
+        self.n_instr = 0
+        self.kinds = {name: 0 for name, _ in KINDS}
+        self.n_compressed = 0
+        self.n_taken = 0
+        self.n_mispredicted = 0
+        self.n_jumps_missed = 0
+        self.n_taken_jumps = 0
+        self.load_use = 0
+        self.muldiv_use = 0
+        self.distances = np.zeros(MAX_DISTANCE + 2, dtype=np.int64)
+        # Position and flags of the last writer of each register
+        self.writer = np.full(N_REGS, -1, dtype=np.int64)
+        self.writer_flags = np.zeros(N_REGS, dtype=np.uint8)
+        self.last_outcome = {}
+        self.pending = None # (address, flags, size) of the last instruction
+
+    def add(self, address, code):
+        "Account for a chunk of instructions"
+        words, inverse = np.unique(code, return_inverse=True)
+        table_flags, table_size, table_regs = decode_table(words, self.xlen)
+        inverse = inverse.reshape(-1)
+        flags = table_flags[inverse]
+        size = table_size[inverse]
+        regs = table_regs[:, inverse]
+        first = self.n_instr
+        self.n_instr += len(code)
+
+        for name, flag in KINDS:
+            self.kinds[name] += int(np.count_nonzero(flags & flag))
+        self.n_compressed += int(np.count_nonzero(flags & COMPRESSED))
+        self.control_flow(address, flags, size)
+        self.dependencies(first, flags, regs)
+
+    def control_flow(self, address, flags, size):
+        "Taken branches and predictions of each instruction but the last"
+        address = address.astype(np.int64)
+        if self.pending is not None:
+            last_address, last_flags, last_size = self.pending
+            address = np.concatenate([[last_address], address])
+            flags = np.concatenate([[last_flags], flags])
+            size = np.concatenate([[last_size], size])
+        self.pending = (address[-1], flags[-1], size[-1])
+        taken = address[1:] != address[:-1] + size[:-1]
+        flags = flags[:-1]
+        branch = (flags & BRANCH) != 0
+        self.n_taken += int(np.count_nonzero(taken & branch))
+        jumps = (flags & (JUMP | REGJUMP)) != 0
+        self.n_taken_jumps += int(np.count_nonzero(jumps))
+        # Indirect jumps other than returns are not predicted
+        indirect = ((flags & REGJUMP) != 0) & ((flags & RET) == 0)
+        self.n_jumps_missed += int(np.count_nonzero(indirect))
+        self.n_mispredicted += self.last_outcome_misses(
+            address[:-1][branch], taken[branch])
+
+    def last_outcome_misses(self, pcs, taken):
+        """
+        Mispredictions of a predictor repeating the last outcome of a branch
+        An unseen branch is predicted taken, as backward branches mostly are.
+        """
+        if len(pcs) == 0:
+            return 0
+        order = np.argsort(pcs, kind="stable")
+        pcs = pcs[order]
+        taken = taken[order]
+        previous = np.empty(len(pcs), dtype=bool)
+        previous[1:] = taken[:-1]
+        new_pc = np.empty(len(pcs), dtype=bool)
+        new_pc[0] = True
+        new_pc[1:] = pcs[1:] != pcs[:-1]
+        for pos in np.flatnonzero(new_pc).tolist():
+            previous[pos] = self.last_outcome.get(int(pcs[pos]), True)
+        last = np.append(np.flatnonzero(new_pc)[1:] - 1, len(pcs) - 1)
+        self.last_outcome.update(zip(pcs[last].tolist(), taken[last].tolist()))
+        return int(np.count_nonzero(previous != taken))
+
+    def dependencies(self, first, flags, regs):
+        "Distance from each instruction to its closest producer"
+        n = regs.shape[1]
+        positions = np.arange(first, first + n, dtype=np.int64)
+        # Writers sorted by register then position, keyed by
+        # register * 2**40 + position, the ones carried from the previous
+        # chunks first
+        carried = np.flatnonzero(self.writer >= 0)
+        written = np.flatnonzero(regs[0] > 0)
+        writer_regs = np.concatenate([carried, regs[0][written]])
+        writer_pos = np.concatenate([self.writer[carried], positions[written]])
+        writer_flags = np.concatenate([self.writer_flags[carried], flags[written]])
+        order = np.argsort(writer_regs, kind="stable")
+        keys = (writer_regs[order].astype(np.int64) << 40) + writer_pos[order]
+        writer_flags = writer_flags[order]
+        closest = np.full(n, -1, dtype=np.int64)
+        producer_flags = np.zeros(n, dtype=np.uint8)
+        for source in regs[1:]:
+            reader_keys = (source.astype(np.int64) << 40) + positions
+            # Last writer strictly before the reader, of the same register
+            last = np.searchsorted(keys, reader_keys, side="left") - 1
+            found = keys[np.maximum(last, 0)]
+            valid = (source > 0) & (last >= 0) \
+                & ((found >> 40) == source.astype(np.int64))
+            producer = np.where(valid, found & ((1 << 40) - 1), -1)
+            better = producer > closest
+            closest[better] = producer[better]
+            producer_flags[better] = writer_flags[np.maximum(last, 0)][better]
+        if len(keys):
+            # Last writer of each register
+            ends = np.append(np.flatnonzero(np.diff(keys >> 40)), len(keys) - 1)
+            self.writer[keys[ends] >> 40] = keys[ends] & ((1 << 40) - 1)
+            self.writer_flags[keys[ends] >> 40] = writer_flags[ends]
+        has_producer = closest >= 0
+        distance = positions[has_producer] - closest[has_producer]
+        self.distances[:MAX_DISTANCE + 1] += np.bincount(
+            np.minimum(distance, MAX_DISTANCE + 1),
+            minlength=MAX_DISTANCE + 2)[1:]
+        self.distances[MAX_DISTANCE + 1] += int(np.count_nonzero(~has_producer))
+        adjacent = has_producer & (positions - closest == 1)
+        self.load_use += int(np.count_nonzero(
+            adjacent & ((producer_flags & LOAD) != 0)))
+        self.muldiv_use += int(np.count_nonzero(
+            adjacent & ((producer_flags & MULDIV) != 0)))
+
+    def estimate_ipc(self, issue=2, mispredict_penalty=5, taken_penalty=1):
+        """
+        First-order IPC: the issue width, minus the cycles lost on
+        mispredicted branches and jumps, taken branches and jumps, and
+        instructions using the result of the previous load or mul
+        """
+        taken = self.n_taken - min(self.n_taken, self.n_mispredicted) \
+            + self.n_taken_jumps - self.n_jumps_missed
+        cycles = self.n_instr / issue \
+            + (self.n_mispredicted + self.n_jumps_missed) * mispredict_penalty \
+            + taken * taken_penalty \
+            + self.load_use + self.muldiv_use
+        return self.n_instr / cycles
+
+    def print(self, **estimate):
+        "Print the statistics"
+        n = max(self.n_instr, 1)
+        n_branches = max(self.kinds["branch"], 1)
+        print(f"instructions      = {self.n_instr}")
+        for name, count in self.kinds.items():
+            print(f"{name:<17} = {100 * count / n:6.2f}%")
+        print(f"compressed        = {100 * self.n_compressed / n:6.2f}%")
+        print(f"branches taken    = {100 * self.n_taken / n_branches:6.2f}%")
+        print(f"last-outcome miss = {100 * self.n_mispredicted / n_branches:6.2f}%")
+        print(f"load-use          = {100 * self.load_use / n:6.2f}%")
+        print(f"estimated IPC     = {self.estimate_ipc(**estimate):.3f}")
+        print()
+        print("RAW dependency distance")
+        with_producer = max(int(self.distances[:MAX_DISTANCE + 1].sum()), 1)
+        for distance in range(1, MAX_DISTANCE + 2):
+            count = int(self.distances[distance - 1])
+            label = f"{distance}" if distance <= MAX_DISTANCE else f">{MAX_DISTANCE}"
+            print(f"{label:>4} {count:>12} {100 * count / with_producer:6.2f}%")
+        print(f"none {int(self.distances[MAX_DISTANCE + 1]):>12}")
+
+def analyze(path, xlen=32):
+    "Analyze a trace file"
+    analysis = Analysis(xlen)
+    for address, code in chunks(path):
+        analysis.add(address, code)
+    return analysis
+
+def main(argv):
+    "Entry point"
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input_file", help="RVFI trace or binary trace")
+    parser.add_argument("--issue", type=int, default=2)
+    parser.add_argument("--mispredict-penalty", type=int, default=5)
+    parser.add_argument("--taken-penalty", type=int, default=1)
+    parser.add_argument("--xlen", type=int, choices=[32, 64], default=32,
+        help="decode the trace as RV32 or RV64 (default: %(default)s)")
+    args = parser.parse_args(argv)
+    if np is None:
+        sys.exit("analyze.py needs numpy")
+    analysis = analyze(args.input_file, args.xlen)
+    analysis.print(issue=args.issue,
+        mispredict_penalty=args.mispredict_penalty,
+        taken_penalty=args.taken_penalty)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
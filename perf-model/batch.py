@@ -0,0 +1,187 @@
+# Copyright 2024 Thales Silicon Security
+#
+# Licensed under the Solderpad Hardware Licence, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# SPDX-License-Identifier: Apache-2.0 WITH SHL-2.0
+# You may obtain a copy of the License at https://solderpad.org/licenses/
+#
+# Original Author: Côme ALLART - Thales
+
+"""
+Runs the performance model on many traces, in parallel
+
+Traces are found with glob patterns (`**` is recursive), for instance all
+the logs of a regression: 'verif/sim/out_*/veri-testharness/*.log'.
+Each trace is streamed by a new worker process. With a memory budget, the
+number of workers is limited so that each one gets at least 256 MiB, and
+the address space of each worker is limited to its share: a trace which
+does not fit fails alone.
+
+The result is one row per trace (cycles, IPC, CoreMark/MHz, events per
+instruction) and a summary row: geometric mean of the cycles, IPC and
+CoreMark/MHz, arithmetic mean of the event rates.
+"""
+
+import argparse
+import glob
+import math
+import os
+import sys
+
+from multiprocessing import Pool
+
+from bintrace import BinaryTrace, is_binary_trace
+from model import parse_trace
+from sweep import PARAMETERS, parse_bool, run_configuration, write_results
+
+# Minimum memory of a worker, for the budget
+MIN_WORKER_MEMORY = 256 << 20
+
+def find_traces(patterns):
+    "Trace files matching glob patterns, sorted and without duplicates"
+    paths = set()
+    for pattern in patterns:
+        paths.update(p for p in glob.glob(pattern, recursive=True)
+            if os.path.isfile(p))
+    return sorted(paths)
+
+def benchmark_names(paths):
+    "Short unique names of traces: their path from their common directory"
+    if len(paths) == 1:
+        return [os.path.basename(paths[0])]
+    common = os.path.commonpath([os.path.abspath(p) for p in paths])
+    return [os.path.relpath(os.path.abspath(p), common) for p in paths]
+
+def _init_worker(memory_limit):
+    if memory_limit is None:
+        return
+    try:
+        import resource # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return
+    resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+
+def run_trace(task):
+    "Run the model on one trace, returns a result row"
+    name, path, params, timed, xlen = task
+    row = {"benchmark": name}
+    try:
+        records = BinaryTrace(path) if is_binary_trace(path) \
+            else parse_trace(path)
+        result = run_configuration(params, records, timed, xlen)
+    except MemoryError:
+        row["error"] = "out of memory"
+        return row
+    except Exception as e: # pylint: disable=broad-exception-caught
+        row["error"] = f"{type(e).__name__}: {e}"
+        return row
+    for param in params:
+        del result[param]
+    row.update(result)
+    return row
+
+def workers(jobs=None, memory_budget=None):
+    "Number of workers and memory limit of each one, None if unlimited"
+    jobs = jobs or os.cpu_count() or 1
+    if memory_budget is None:
+        return jobs, None
+    jobs = max(1, min(jobs, memory_budget // MIN_WORKER_MEMORY))
+    return jobs, memory_budget // jobs
+
+def batch(paths, params=None, jobs=None, memory_budget=None, timed=False,
+        xlen=32):
+    """
+    Run the model on each trace, with one process per trace
+    Returns one result row per trace, in the order of `paths`. The traces
+    are decoded as RV32 or RV64 according to `xlen`.
+    """
+    params = params or {}
+    jobs, memory_limit = workers(jobs, memory_budget)
+    tasks = [(name, path, params, timed, xlen)
+        for name, path in zip(benchmark_names(paths), paths)]
+    with Pool(jobs, _init_worker, (memory_limit,), maxtasksperchild=1) as pool:
+        return pool.map(run_trace, tasks, chunksize=1)
+
+def _geomean(values):
+    values = [v for v in values if v > 0]
+    if not values:
+        return 0
+    return math.exp(sum(math.log(v) for v in values) / len(values))
+
+def summary(rows):
+    "Summary row of the successful rows"
+    rows = [row for row in rows if "error" not in row]
+    if not rows:
+        return None
+    total = {"benchmark": f"geomean ({len(rows)})"}
+    total["cycles"] = _geomean([row["cycles"] for row in rows])
+    total["instructions"] = _geomean([row["instructions"] for row in rows])
+    total["IPC"] = _geomean([row["IPC"] for row in rows])
+    total["CoreMark/MHz"] = _geomean([row["CoreMark/MHz"] for row in rows])
+    for column in rows[0]:
+        if column.endswith("/instr"):
+            total[column] = sum(row[column] for row in rows) / len(rows)
+    return total
+
+def print_table(rows, total=None):
+    "Print the result rows and the summary row"
+    ok = [row for row in rows if "error" not in row]
+    # Event rates which are not always 0% or 100%, such as issue or commit
+    events = [column for column in (ok[0] if ok else {})
+        if column.endswith("/instr")
+        and any(row[column] not in (0, 1) for row in ok)]
+    width = max([9] + [len(row["benchmark"]) for row in rows])
+    header = f"{'benchmark':<{width}} {'cycles':>12} {'IPC':>6} {'CM/MHz':>8}"
+    header += "".join(f" {column[:-6]:>7}" for column in events)
+    print(header)
+    for row in rows + ([total] if total else []):
+        if row is total:
+            print("-" * len(header))
+        if "error" in row:
+            print(f"{row['benchmark']:<{width}} {row['error']}")
+            continue
+        line = f"{row['benchmark']:<{width}} {row['cycles']:>12.0f}" \
+            f" {row['IPC']:>6.3f} {row['CoreMark/MHz']:>8.3f}"
+        line += "".join(f" {100 * row[column]:>6.2f}%" for column in events)
+        print(line)
+
+def main(argv):
+    "Entry point"
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("patterns", nargs="+",
+        help="glob patterns of RVFI traces or binary traces")
+    parser.add_argument("-o", "--output",
+        help="result table, CSV or JSON (.json)")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+        help="number of worker processes (default: number of CPUs)")
+    parser.add_argument("--memory", type=int, default=None, metavar="MIB",
+        help="memory budget of all the workers, in MiB")
+    parser.add_argument("--timed", action="store_true",
+        help="only measure the timed part of the traces")
+    parser.add_argument("--xlen", type=int, choices=[32, 64], default=32,
+        help="decode the traces as RV32 or RV64 (default: %(default)s)")
+    for name, kind in PARAMETERS.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", dest=name,
+            type=parse_bool if kind is bool else kind,
+            metavar="VALUE", help=f"Model {name}")
+    args = parser.parse_args(argv)
+
+    paths = find_traces(args.patterns)
+    if not paths:
+        sys.exit("no trace found")
+    params = {name: getattr(args, name) for name in PARAMETERS
+        if getattr(args, name) is not None}
+    memory = None if args.memory is None else args.memory << 20
+    rows = batch(paths, params, args.jobs, memory, args.timed, args.xlen)
+    total = summary(rows)
+    print_table(rows, total)
+    if args.output:
+        table = rows + ([total] if total else [])
+        columns = {column: "" for row in table for column in row}
+        write_results(args.output, [{**columns, **row} for row in table])
+    if any("error" in row for row in rows):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
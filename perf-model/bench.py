@@ -0,0 +1,308 @@
+# Copyright 2024 Thales Silicon Security
+#
+# Licensed under the Solderpad Hardware Licence, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# SPDX-License-Identifier: Apache-2.0 WITH SHL-2.0
+# You may obtain a copy of the License at https://solderpad.org/licenses/
+#
+# Original Author: Côme ALLART - Thales
+
+"""
+Measures the simulation speed of the performance model on synthetic traces
+
+Each instruction mix (see MIXES) is generated into a trace, then
+`Model.load_file`, `Model.run` and `write_trace` are timed separately, in a
+new process per mix so that its peak RSS is measured alone. The best time of
+the repetitions is kept.
+
+Results are written as JSON. `compare` flags the times and peak RSS of a
+result file which are above a baseline by more than a threshold, and exits
+with status 1 if any is.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import random
+import tempfile
+import time
+
+from multiprocessing import Pool
+
+from model import Model, write_trace
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+def encode_r(funct7, rs2, rs1, funct3, rd, opcode):
+    "Encode an R-type instruction"
+    return (funct7 << 25) | (rs2 << 20) | (rs1 << 15) | (funct3 << 12) \
+        | (rd << 7) | opcode
+
+def encode_i(imm, rs1, funct3, rd, opcode):
+    "Encode an I-type instruction"
+    return ((imm & 0xfff) << 20) | (rs1 << 15) | (funct3 << 12) \
+        | (rd << 7) | opcode
+
+def encode_s(imm, rs2, rs1, funct3, opcode):
+    "Encode an S-type instruction"
+    imm &= 0xfff
+    return ((imm >> 5) << 25) | (rs2 << 20) | (rs1 << 15) | (funct3 << 12) \
+        | ((imm & 31) << 7) | opcode
+
+def encode_b(imm, rs2, rs1, funct3, opcode=0x63):
+    "Encode a B-type instruction"
+    imm &= 0x1fff
+    return ((imm >> 12) << 31) | (((imm >> 5) & 0x3f) << 25) | (rs2 << 20) \
+        | (rs1 << 15) | (funct3 << 12) | (((imm >> 1) & 15) << 8) \
+        | (((imm >> 11) & 1) << 7) | opcode
+
+def encode_ci(funct3, imm, rd, op=1):
+    "Encode a compressed instruction with a 6-bit immediate (C.ADDI)"
+    imm &= 0x3f
+    return (funct3 << 13) | ((imm >> 5) << 12) | (rd << 7) | ((imm & 31) << 2) \
+        | op
+
+def encode_cr(funct4, rd, rs2, op=2):
+    "Encode a compressed register instruction (C.ADD)"
+    return (funct4 << 12) | (rd << 7) | (rs2 << 2) | op
+
+def encode_cl(funct3, rs1, rd, op=0):
+    "Encode a compressed load or store with a null offset (C.LW, C.SW)"
+    return (funct3 << 13) | ((rs1 - 8) << 7) | ((rd - 8) << 2) | op
+
+def encode_cb(funct3, rs1, offset, op=1):
+    "Encode a compressed branch with a small positive offset (C.BEQZ)"
+    return (funct3 << 13) | ((rs1 - 8) << 7) | (((offset >> 1) & 3) << 3) | op
+
+# Instruction mixes: weight of each kind of instruction
+MIXES = {
+    "mixed": {"addi": 50, "add": 15, "mul": 5, "lw": 10, "sw": 8, "beq": 12},
+    "alu": {"addi": 60, "add": 35, "mul": 5},
+    "branchy": {"addi": 40, "add": 10, "beq": 50},
+    "loadstore": {"addi": 30, "lw": 40, "sw": 30},
+    "compressed": {"c.addi": 40, "c.add": 20, "c.lw": 15, "c.sw": 10,
+        "c.beqz": 10, "addi": 5},
+}
+
+def synthetic_trace(n_instr, seed=0, mix="mixed"):
+    """
+    Generate the lines of an RVFI trace with a mix of instructions from
+    MIXES, working on a few registers (x8 to x15, usable by compressed
+    instructions)
+    Loads and stores access a 64 KiB working set. Branches are taken 60%
+    of the time.
+    """
+    rand = random.Random(seed)
+    kinds = list(MIXES[mix])
+    weights = list(MIXES[mix].values())
+    regs = range(8, 16)
+    pc = 0x80000000
+    for cycle, kind in enumerate(rand.choices(kinds, weights, k=n_instr)):
+        rd, rs1, rs2 = (rand.choice(regs) for _ in range(3))
+        taken = rand.random() < 0.6
+        size = 2 if kind.startswith("c.") else 4
+        next_pc = pc + size
+        mem = None
+        mem_addr = 0x80100000 + 4 * rand.randrange(1 << 14)
+        if kind == "addi":
+            code = encode_i(1, rs1, 0, rd, 0x13)
+            mnemo = f"addi x{rd}, x{rs1}, 1"
+        elif kind == "add":
+            code = encode_r(0, rs2, rs1, 0, rd, 0x33)
+            mnemo = f"add x{rd}, x{rs1}, x{rs2}"
+        elif kind == "mul":
+            code = encode_r(1, rs2, rs1, 0, rd, 0x33)
+            mnemo = f"mul x{rd}, x{rs1}, x{rs2}"
+        elif kind == "lw":
+            code = encode_i(0, rs1, 2, rd, 0x03)
+            mnemo = f"lw x{rd}, 0(x{rs1})"
+        elif kind == "sw":
+            code = encode_s(0, rs2, rs1, 2, 0x23)
+            mnemo = f"sw x{rs2}, 0(x{rs1})"
+        elif kind == "beq":
+            code = encode_b(8, rs2, rs1, 0)
+            mnemo = f"beq x{rs1}, x{rs2}, pc + 8"
+            if taken:
+                next_pc = pc + 8
+        elif kind == "c.addi":
+            code = encode_ci(0, 1, rd)
+            mnemo = f"c.addi x{rd}, 1"
+        elif kind == "c.add":
+            code = encode_cr(9, rd, rs2)
+            mnemo = f"c.add x{rd}, x{rs2}"
+        elif kind == "c.lw":
+            code = encode_cl(2, rs1, rd)
+            mnemo = f"c.lw x{rd}, 0(x{rs1})"
+        elif kind == "c.sw":
+            code = encode_cl(6, rs1, rs2)
+            mnemo = f"c.sw x{rs2}, 0(x{rs1})"
+        else:
+            code = encode_cb(6, rs1, 4)
+            mnemo = f"c.beqz x{rs1}, pc + 4"
+            if taken:
+                next_pc = pc + 4
+        if kind in ["lw", "c.lw"]:
+            mem = f"x{rd} 0x00000000 mem 0x{mem_addr:016x}"
+        elif kind in ["sw", "c.sw"]:
+            mem = f"mem 0x{mem_addr:016x} 0x00000000"
+        yield f"core   0: 0x{pc:016x} (0x{code:08x}) @ {cycle} {mnemo}\n"
+        if mem is not None:
+            yield f"3 0x{pc:016x} (0x{code:08x}) {mem}\n"
+        pc = next_pc
+
+def write_synthetic_trace(path, n_instr, seed=0, mix="mixed"):
+    "Write a synthetic trace to a file"
+    with open(path, "w", encoding="utf8") as f:
+        f.writelines(synthetic_trace(n_instr, seed, mix))
+
+def peak_rss():
+    "Peak resident set size of the process in bytes, None if unknown"
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return rss if sys.platform == "darwin" else rss * 1024
+
+def bench_case(path, **params):
+    """
+    Time the stages of a simulation of a trace file
+    Returns a dict of the number of cycles and the durations in seconds.
+    """
+    model = Model(**params)
+    start = time.perf_counter()
+    model.load_file(path)
+    loaded = time.perf_counter()
+    cycles = model.run()
+    ran = time.perf_counter()
+    with tempfile.TemporaryDirectory() as tmp:
+        write_trace(os.path.join(tmp, "annotated.log"), model.retired)
+    written = time.perf_counter()
+    return {
+        "cycles": cycles,
+        "load_file": loaded - start,
+        "run": ran - loaded,
+        "write_trace": written - ran,
+    }
+
+def _bench_task(task):
+    path, params = task
+    result = bench_case(path, **params)
+    result["peak_rss"] = peak_rss()
+    return result
+
+def bench_mix(mix, n_instr, repeat=3, seed=0, **params):
+    "Benchmark a mix, each repetition in a new process, keeps the best times"
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, f"{mix}.log")
+        write_synthetic_trace(path, n_instr, seed, mix)
+        runs = []
+        for _ in range(repeat):
+            with Pool(1) as pool:
+                runs.append(pool.apply(_bench_task, ((path, params),)))
+    result = {"instructions": n_instr, "cycles": runs[0]["cycles"]}
+    for stage in STAGES:
+        result[stage] = min(run[stage] for run in runs)
+    rss = [run["peak_rss"] for run in runs if run["peak_rss"] is not None]
+    result["peak_rss"] = max(rss) if rss else None
+    result["instr/s"] = n_instr / result["run"]
+    return result
+
+# Timed stages of a simulation
+STAGES = ["load_file", "run", "write_trace"]
+
+# Results compared by `compare`, lower is better
+METRICS = STAGES + ["peak_rss"]
+
+def bench(mixes, n_instr, repeat=3, **params):
+    "Benchmark mixes, returns the result document"
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "params": params,
+        "results": {mix: bench_mix(mix, n_instr, repeat, **params)
+            for mix in mixes},
+    }
+
+def compare(baseline, current, threshold=0.1):
+    """
+    Compare two result documents
+    Returns a list of (mix, metric, baseline, current, ratio, slower),
+    slower being True when the ratio is above 1 + threshold.
+    """
+    rows = []
+    for mix, result in current["results"].items():
+        base = baseline["results"].get(mix)
+        if base is None or base["instructions"] != result["instructions"]:
+            continue
+        for metric in METRICS:
+            if not base.get(metric) or result.get(metric) is None:
+                continue
+            ratio = result[metric] / base[metric]
+            rows.append((mix, metric, base[metric], result[metric], ratio,
+                ratio > 1 + threshold))
+    return rows
+
+def print_results(document):
+    "Print a result document"
+    print(f"{'mix':<12} {'instr':>9} {'load_file':>10} {'run':>8}"
+        f" {'write':>8} {'instr/s':>9} {'peak RSS':>9}")
+    for mix, r in document["results"].items():
+        rss = "-" if r["peak_rss"] is None else f"{r['peak_rss'] >> 20} MiB"
+        print(f"{mix:<12} {r['instructions']:>9} {r['load_file']:>9.2f}s"
+            f" {r['run']:>7.2f}s {r['write_trace']:>7.2f}s"
+            f" {r['instr/s']:>9.0f} {rss:>9}")
+
+def main(argv):
+    "Entry point"
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument("-n", "--instructions", type=int, default=200000,
+        help="number of instructions of each trace (default: %(default)s)")
+    run_parser.add_argument("--mix", nargs="+", choices=list(MIXES),
+        default=list(MIXES), help="instruction mixes (default: all)")
+    run_parser.add_argument("--repeat", type=int, default=3,
+        help="number of runs of each mix, the best is kept")
+    run_parser.add_argument("-o", "--output",
+        help="JSON result file, to use as a baseline")
+    run_parser.add_argument("--issue", type=int, default=2)
+    run_parser.add_argument("--commit", type=int, default=2)
+
+    compare_parser = commands.add_parser("compare",
+        help="compare results with a baseline")
+    compare_parser.add_argument("baseline", help="JSON baseline")
+    compare_parser.add_argument("current", help="JSON results")
+    compare_parser.add_argument("--threshold", type=float, default=10,
+        help="tolerated slowdown in percent (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        document = bench(args.mix, args.instructions, args.repeat,
+            issue=args.issue, commit=args.commit)
+        print_results(document)
+        if args.output:
+            with open(args.output, "w", encoding="utf8") as f:
+                json.dump(document, f, indent=2)
+        return
+
+    with open(args.baseline, encoding="utf8") as f:
+        baseline = json.load(f)
+    with open(args.current, encoding="utf8") as f:
+        current = json.load(f)
+    rows = compare(baseline, current, args.threshold / 100)
+    for mix, metric, base, value, ratio, slower in rows:
+        flag = "  SLOWER" if slower else ""
+        print(f"{mix:<12} {metric:<12} {base:>12.4g} {value:>12.4g}"
+            f" {100 * (ratio - 1):>+7.1f}%{flag}")
+    if any(row[5] for row in rows):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,165 @@
+# Copyright 2024 Thales Silicon Security
+#
+# Licensed under the Solderpad Hardware Licence, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# SPDX-License-Identifier: Apache-2.0 WITH SHL-2.0
+# You may obtain a copy of the License at https://solderpad.org/licenses/
+#
+# Original Author: Côme ALLART - Thales
+
+"""
+Binary pre-decoded trace format
+
+The file starts with a header: magic, number of records, offset of the
+string table. Then come fixed-width records, one per instruction:
+address, RTL cycle (-1 if not in the trace), instruction word, index of
+the mnemonic in the string table, memory address (all ones if there is
+none), index of the RVFI flags and index of the line layout.
+
+The string table is the list of distinct mnemonics, flags and layouts,
+separated with newlines. A layout is an original trace line with the
+digits of its cycle replaced by a NUL character, so that the line is
+rebuilt exactly as it was in the text trace.
+"""
+
+import mmap
+import struct
+import sys
+
+from functools import cached_property
+
+from isa import Instr
+from model import Instruction, scan_trace
+
+MAGIC = b"CVA6TRC3"
+HEADER = struct.Struct("<8sQQ")
+RECORD = struct.Struct("<QqIIQII")
+NO_CYCLE = -1
+NO_MEM = (1 << 64) - 1
+CYCLE_MARK = "\0"
+
+def is_binary_trace(path):
+    "Is the file a binary trace?"
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+def line_layout(line, cycle):
+    "Layout of a stripped trace line, its cycle replaced by CYCLE_MARK"
+    if cycle is None:
+        return line
+    at = line.find("@", line.find(")"))
+    rest = line[at + 1:]
+    start = at + 1 + len(rest) - len(rest.lstrip())
+    end = start + len(str(cycle))
+    return line[:start] + CYCLE_MARK + line[end:]
+
+def format_line(layout, cycle):
+    "Build the original trace line from its layout and cycle"
+    if cycle == NO_CYCLE:
+        return layout
+    return layout.replace(CYCLE_MARK, str(cycle), 1)
+
+class RecordInstruction(Instruction):
+    """Instruction read from a binary record, the trace line is built lazily"""
+
+    def __init__(self, address, code, cycle, mnemo, mem_addr, flags="",
+            layout=None, xlen=32):
+        Instr.__init__(self, code, xlen) # pylint: disable=non-parent-init-called
+        self.address = address
+        self.cycle = cycle
+        self.mnemo = mnemo
+        self.mem_addr = mem_addr
+        self.flags = flags
+        self.layout = layout
+        self.init_events()
+
+    @cached_property
+    def line(self):
+        "RVFI trace line of the instruction, as in the text trace"
+        return format_line(self.layout, self.cycle)
+
+    @property
+    def hex_code(self):
+        "Instruction word as written in the trace"
+        return f"0x{self.bin:08x}"
+
+class BinaryTrace:
+    """
+    Memory-mapped binary trace
+    Pickling it only pickles the path, the file is mapped again on load
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, table_offset = HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a binary trace")
+        table = self.map[table_offset:].decode("utf8")
+        self.strings = table.split("\n") if table else []
+
+    def __getstate__(self):
+        return self.path
+
+    def __setstate__(self, state):
+        self.__init__(state)
+
+    def __len__(self):
+        return self.count
+
+    def records(self, start=0):
+        """
+        Generate (address, code, cycle, mnemo, mem_addr, flags, layout) from
+        the record `start`
+        """
+        begin = HEADER.size + start * RECORD.size
+        end = HEADER.size + self.count * RECORD.size
+        strings = self.strings
+        view = memoryview(self.map)[begin:end]
+        try:
+            for address, cycle, code, mnemo_id, mem_addr, flags_id, layout_id \
+                    in RECORD.iter_unpack(view):
+                if mem_addr == NO_MEM:
+                    mem_addr = None
+                yield (address, code, cycle, strings[mnemo_id], mem_addr,
+                    strings[flags_id], strings[layout_id])
+        finally:
+            view.release()
+
+    def instructions(self, start=0, xlen=32):
+        "Generate instructions from the record `start`"
+        for record in self.records(start):
+            yield RecordInstruction(*record, xlen=xlen)
+
+def convert(input_file, output_file):
+    "Convert an RVFI text trace into a binary trace, returns the record count"
+    string_ids = {}
+    count = 0
+    with open(output_file, "wb") as dst:
+        dst.write(HEADER.pack(MAGIC, 0, 0))
+        for found, mem_addr in scan_trace(input_file):
+            cycle = NO_CYCLE if found.cycle is None else found.cycle
+            layout = line_layout(found.line, found.cycle)
+            dst.write(RECORD.pack(
+                int(found.address, 16),
+                cycle,
+                int(found.hex_code, 16),
+                string_ids.setdefault(found.mnemo, len(string_ids)),
+                NO_MEM if mem_addr is None else mem_addr,
+                string_ids.setdefault(found.flags, len(string_ids)),
+                string_ids.setdefault(layout, len(string_ids))))
+            count += 1
+        table_offset = dst.tell()
+        dst.write("\n".join(string_ids).encode("utf8"))
+        dst.seek(0)
+        dst.write(HEADER.pack(MAGIC, count, table_offset))
+    return count
+
+def main(input_file: str, output_file: str):
+    "Entry point"
+    count = convert(input_file, output_file)
+    print(f"{count} instructions written to {output_file}")
+
+if __name__ == "__main__":
+    main(sys.argv[1], sys.argv[2])
@@ -0,0 +1,106 @@
+# Copyright 2024 Thales Silicon Security
+#
+# Licensed under the Solderpad Hardware Licence, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# SPDX-License-Identifier: Apache-2.0 WITH SHL-2.0
+# You may obtain a copy of the License at https://solderpad.org/licenses/
+#
+# Original Author: Côme ALLART - Thales
+
+"""
+Cache models for the performance model
+
+A cache is described by a spec string "size:ways:line_size:miss_latency",
+optionally followed by the write policy, ":wb" (default) or ":wt" for a
+write-through cache. A write-back policy can be followed by the latency of
+writing a dirty line back, 0 by default.
+The size accepts a "k" suffix, for instance "32k:8:64:20" or
+"32k:8:64:20:wb:10".
+"""
+
+from collections import OrderedDict
+
+class Cache:
+    """
+    Set-associative cache with LRU replacement
+    Write-back caches allocate lines on write misses and write dirty lines
+    back when they are evicted. Write-through caches do not allocate lines
+    on write misses.
+    """
+
+    def __init__(
+            self,
+            size=32768,
+            ways=8,
+            line_size=64,
+            miss_latency=20,
+            write_back=True,
+            writeback_latency=0):
+        n_sets = size // (ways * line_size)
+        assert n_sets > 0 and n_sets * ways * line_size == size
+        self.sets = [OrderedDict() for _ in range(n_sets)]
+        self.ways = ways
+        self.line_size = line_size
+        self.miss_latency = miss_latency
+        self.write_back = write_back
+        self.writeback_latency = writeback_latency
+        self.hits = 0
+        self.misses = 0
+        self.writebacks = 0
+
+    def line(self, addr):
+        "Line number of an address"
+        return addr // self.line_size
+
+    def access(self, addr, write=False):
+        "Access an address, returns (hit, latency added by the access)"
+        line = self.line(addr)
+        lines = self.sets[line % len(self.sets)]
+        if line in lines:
+            self.hits += 1
+            lines.move_to_end(line)
+            if write and self.write_back:
+                lines[line] = True
+            return True, 0
+        self.misses += 1
+        if write and not self.write_back:
+            return False, 0
+        latency = self.miss_latency
+        lines[line] = write
+        if len(lines) > self.ways:
+            _, dirty = lines.popitem(last=False)
+            if dirty:
+                self.writebacks += 1
+                latency += self.writeback_latency
+        return False, latency
+
+    def miss_rate(self):
+        "Ratio of accesses which missed"
+        total = self.hits + self.misses
+        return self.misses / total if total else 0.
+
+def parse_size(text):
+    "Parse a size in bytes, with an optional k suffix"
+    if text.lower().endswith("k"):
+        return int(text[:-1]) * 1024
+    return int(text)
+
+def make_cache(spec):
+    "Build a cache from its spec string, None gives None"
+    if spec is None:
+        return None
+    fields = spec.split(":")
+    if not 4 <= len(fields) <= 6:
+        raise ValueError(f"bad cache spec: {spec}")
+    policy = fields[4] if len(fields) > 4 else "wb"
+    if policy not in ["wb", "wt"]:
+        raise ValueError(f"bad write policy {policy!r} in cache spec: {spec}")
+    if len(fields) == 6 and policy != "wb":
+        raise ValueError(f"write-back latency of a write-through cache: {spec}")
+    return Cache(
+        size=parse_size(fields[0]),
+        ways=int(fields[1]),
+        line_size=int(fields[2]),
+        miss_latency=int(fields[3]),
+        write_back=policy == "wb",
+        writeback_latency=int(fields[5]) if len(fields) == 6 else 0)
@@ -0,0 +1,207 @@
+# Copyright 2024 Thales Silicon Security
+#
+# Licensed under the Solderpad Hardware Licence, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# SPDX-License-Identifier: Apache-2.0 WITH SHL-2.0
+# You may obtain a copy of the License at https://solderpad.org/licenses/
+#
+# Original Author: Côme ALLART - Thales
+
+"""
+Checkpoints of the performance model
+
+A checkpoint is the state of a `Model` (predictors, RAS, instruction queue,
+scoreboard, caches, events of the instructions in flight) with the position
+in the trace, its XLEN and the cycle number, pickled and compressed with
+gzip.
+
+It is taken after a given number of retired instructions, or just before
+the timed part of the program (the first `csrr minstret`). It is either
+simulated in detail, or trained functionally with `Model.warm_up`, which is
+much faster but starts with empty pipelines.
+
+A run restarted from a checkpoint can change the parameters which do not
+hold state: issue and commit widths, scoreboard length, forwarding and
+renaming. The parameters derived from the issue width follow it, as in a
+new `Model`, and the instruction queue restarts full.
+"""
+
+import argparse
+import gzip
+import itertools
+import pickle
+import sys
+
+from collections import deque
+
+from bintrace import BinaryTrace, is_binary_trace
+from model import Model, Stats, TimedFilter, read_trace, parse_trace
+
+VERSION = 3
+
+def timed_start(path):
+    "Index of the first `csrr minstret` instruction of a trace, None if none"
+    if is_binary_trace(path):
+        mnemos = (record[3] for record in BinaryTrace(path).records())
+    else:
+        mnemos = (fields[3] for fields in parse_trace(path))
+    for index, mnemo in enumerate(mnemos):
+        if TimedFilter.re_csrr_minstret.search(mnemo):
+            return index
+    return None
+
+def read_from(path, start, xlen=32):
+    "Generate the instructions of a trace from the instruction `start`"
+    if is_binary_trace(path):
+        return BinaryTrace(path).instructions(start, xlen)
+    return itertools.islice(read_trace(path, xlen), start, None)
+
+def create(path, at, functional=False, xlen=32, **params):
+    """
+    Run a model on the first instructions of a trace, returns a checkpoint
+    In detailed mode, the model stops at the first cycle where at least `at`
+    instructions are retired. In functional mode, it is trained with the
+    first `at` instructions. The trace is decoded as RV32 or RV64 according
+    to `xlen`, which the checkpoint keeps for resuming.
+    """
+    model = Model(**params)
+    cycle = 0
+    if functional:
+        for instr in itertools.islice(read_trace(path, xlen), at):
+            model.warm_up(instr)
+            model.n_queued += 1
+        model.n_retired = model.n_queued
+    elif at > 0:
+        model.stream(read_trace(path, xlen), lambda instr: None)
+        cycle = model.run(max_retired=at)
+    return {
+        "version": VERSION,
+        "trace": path,
+        "xlen": xlen,
+        "position": model.n_queued,
+        "retired": model.n_retired,
+        "cycle": cycle,
+        "timed_start": timed_start(path),
+        "params": params,
+        "model": model,
+    }
+
+def save(checkpoint, path):
+    "Write a checkpoint to a file"
+    with gzip.open(path, "wb") as f:
+        pickle.dump(checkpoint, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+def load(path):
+    "Read a checkpoint from a file"
+    with gzip.open(path, "rb") as f:
+        checkpoint = pickle.load(f)
+    if checkpoint.get("version") != VERSION:
+        raise ValueError(f"{path}: unsupported checkpoint version")
+    return checkpoint
+
+def apply_overrides(model, **params):
+    "Change parameters of a restored model"
+    for name, value in params.items():
+        if name == "issue":
+            model.set_issue_width(value)
+        elif name == "commit":
+            model.commit_width = value
+        elif name == "sb_len":
+            if value < len(model.scoreboard):
+                raise ValueError(
+                    f"sb_len={value} but {len(model.scoreboard)} instructions"
+                    " are in the scoreboard")
+            model.sb_len = value
+            model.scoreboard = deque(model.scoreboard, maxlen=value)
+        elif name in ["has_forwarding", "has_renaming"]:
+            setattr(model, name, value)
+        else:
+            raise ValueError(f"{name} cannot be changed from a checkpoint")
+
+def resume(checkpoint, on_retire, on_events=None, trace=None, **params):
+    """
+    Prepare the model of a checkpoint to continue on its trace
+    Returns the model and the cycle to give to `Model.run`.
+    """
+    model = checkpoint["model"]
+    apply_overrides(model, **params)
+    instructions = read_from(trace or checkpoint["trace"],
+        checkpoint["position"], checkpoint["xlen"])
+    model.stream(instructions, on_retire,
+        window=max(64, model.issue_width), on_events=on_events)
+    return model, checkpoint["cycle"]
+
+def run_stats(checkpoint, timed=False, trace=None, **params):
+    "Resume a checkpoint until the end, returns the statistics"
+    stats = Stats()
+    retire = TimedFilter(stats.add) if timed else stats.add
+    if timed:
+        start = checkpoint["timed_start"]
+        if start is None:
+            raise ValueError("the trace has no timed part")
+        if checkpoint["retired"] > start:
+            raise ValueError("the checkpoint is after the start of the timed part")
+    model, cycle = resume(checkpoint, retire, stats.add_events, trace, **params)
+    model.run(start_cycle=cycle)
+    return stats
+
+def main(argv):
+    "Entry point"
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    save_parser = commands.add_parser("save", help="create a checkpoint")
+    save_parser.add_argument("input_file", help="RVFI trace or binary trace")
+    save_parser.add_argument("output_file", help="checkpoint file")
+    where = save_parser.add_mutually_exclusive_group(required=True)
+    where.add_argument("--at", type=int,
+        help="number of instructions to retire before the checkpoint")
+    where.add_argument("--at-timed", action="store_true",
+        help="checkpoint just before the first csrr minstret")
+    save_parser.add_argument("--functional", action="store_true",
+        help="train the model without timing instead of simulating it")
+    save_parser.add_argument("--issue", type=int, default=2)
+    save_parser.add_argument("--commit", type=int, default=2)
+    save_parser.add_argument("--icache", help="I-cache spec, see caches.py")
+    save_parser.add_argument("--dcache", help="D-cache spec, see caches.py")
+    save_parser.add_argument("--xlen", type=int, choices=[32, 64], default=32,
+        help="decode the trace as RV32 or RV64 (default: %(default)s)")
+
+    run_parser = commands.add_parser("run", help="resume from a checkpoint")
+    run_parser.add_argument("checkpoint", help="checkpoint file")
+    run_parser.add_argument("--trace", help="trace file, if it has moved")
+    run_parser.add_argument("--timed", action="store_true",
+        help="only count the part between csrr minstret instructions")
+    run_parser.add_argument("--issue", type=int)
+    run_parser.add_argument("--commit", type=int)
+    run_parser.add_argument("--sb-len", type=int)
+    args = parser.parse_args(argv)
+
+    if args.command == "save":
+        params = {"issue": args.issue, "commit": args.commit,
+            "icache": args.icache, "dcache": args.dcache}
+        start = timed_start(args.input_file)
+        at = args.at
+        if args.at_timed:
+            if start is None:
+                sys.exit("no csrr minstret in the trace")
+            # The csrr must not retire in the cycle where the model stops
+            at = start if args.functional else max(start - args.commit + 1, 0)
+        checkpoint = create(args.input_file, at, args.functional, args.xlen,
+            **params)
+        save(checkpoint, args.output_file)
+        print(f"checkpoint after {checkpoint['retired']} instructions,"
+            f" cycle {checkpoint['cycle']}, written to {args.output_file}")
+        return
+
+    checkpoint = load(args.checkpoint)
+    overrides = {name: value for name, value in
+        [("issue", args.issue), ("commit", args.commit),
+            ("sb_len", args.sb_len)]
+        if value is not None}
+    stats = run_stats(checkpoint, args.timed, args.trace, **overrides)
+    stats.print()
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,223 @@
+# Copyright 2024 Thales Silicon Security
+#
+# Licensed under the Solderpad Hardware Licence, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# SPDX-License-Identifier: Apache-2.0 WITH SHL-2.0
+# You may obtain a copy of the License at https://solderpad.org/licenses/
+#
+# Original Author: Côme ALLART - Thales
+
+"""
+Correlates the cycles of the model with the cycles of the RTL
+
+The RTL trace and the model trace (annotated by the model, or produced on
+the fly with --run) are walked in lockstep. The duration of an instruction
+is the number of cycles since the previous one retired, as in
+`cycle_diff.py`. The divergence is the model duration minus the RTL one.
+
+Divergences are accumulated by PC and by basic block, a block being a
+straight-line run of instructions ended by a taken branch or jump.
+"""
+
+import argparse
+import sys
+
+from collections import Counter, defaultdict
+
+from bintrace import BinaryTrace, is_binary_trace, NO_CYCLE
+from cycle_diff import print_data, re_csrr_minstret
+from model import Model, read_trace, scan_trace
+
+class Correlator:
+    """
+    Accumulates the divergence between two streams of retired instructions
+    Each instruction is given to `add` with its RTL and model cycles.
+    """
+
+    def __init__(self, timed=False, histogram_range=16):
+        self.timed = timed
+        self.accepting = not timed
+        self.histogram_range = histogram_range
+        self.histogram = Counter()
+        self.pcs = defaultdict(Counter)
+        self.blocks = defaultdict(Counter)
+        self.mnemos = {}
+        self.n_instr = 0
+        self.n_exact = 0
+        self.rtl_cycles = 0
+        self.model_cycles = 0
+        self.last = None # (address, RTL cycle, model cycle)
+        self.block = None # [start, end, RTL cycles, model cycles]
+
+    def add(self, address, rtl_cycle, model_cycle, mnemo=""):
+        "Account for a retired instruction, cycles are None if unknown"
+        if self.timed and re_csrr_minstret.search(mnemo):
+            self.accepting = not self.accepting
+            self.end_block()
+            self.last = None
+            return
+        if not self.accepting:
+            return
+        if rtl_cycle is None or model_cycle is None:
+            self.end_block()
+            self.last = None
+            return
+        last = self.last
+        self.last = (address, rtl_cycle, model_cycle)
+        if last is None:
+            return
+        if address not in (last[0] + 2, last[0] + 4):
+            self.end_block()
+        rtl = rtl_cycle - last[1]
+        model = model_cycle - last[2]
+        diff = model - rtl
+        self.n_instr += 1
+        self.n_exact += diff == 0
+        self.rtl_cycles += rtl
+        self.model_cycles += model
+        bound = self.histogram_range
+        self.histogram[max(-bound, min(bound, diff))] += 1
+        pc = self.pcs[address]
+        pc["count"] += 1
+        pc["rtl"] += rtl
+        pc["model"] += model
+        pc["error"] += abs(diff)
+        self.mnemos.setdefault(address, mnemo)
+        if self.block is None:
+            self.block = [address, address, 0, 0]
+        self.block[1] = address
+        self.block[2] += rtl
+        self.block[3] += model
+
+    def end_block(self):
+        "Account for the current basic block"
+        if self.block is None:
+            return
+        start, end, rtl, model = self.block
+        block = self.blocks[(start, end)]
+        block["count"] += 1
+        block["rtl"] += rtl
+        block["model"] += model
+        block["error"] += abs(model - rtl)
+        self.block = None
+
+    def print(self, top=20):
+        "Print the summary, the histogram and the most divergent PCs and blocks"
+        self.end_block()
+        n_instr = max(self.n_instr, 1)
+        print_data("instruction number", self.n_instr)
+        print_data("RTL cycles", self.rtl_cycles)
+        print_data("model cycles", self.model_cycles)
+        error = self.model_cycles - self.rtl_cycles
+        print_data("cycle error", f"{100 * error / max(self.rtl_cycles, 1):+.2f}%")
+        print_data("exact durations", f"{100 * self.n_exact / n_instr:.2f}%")
+        mean = sum(c["error"] for c in self.pcs.values()) / n_instr
+        print_data("mean abs divergence", f"{mean:.3f}")
+        print()
+        self.print_histogram()
+        print()
+        print("Most divergent PCs")
+        _print_table(
+            {f"0x{addr:08x} {self.mnemos[addr]}": c
+                for addr, c in self.pcs.items()},
+            top)
+        print()
+        print("Most divergent basic blocks")
+        _print_table(
+            {f"0x{start:08x}-0x{end:08x}": c
+                for (start, end), c in self.blocks.items()},
+            top)
+
+    def print_histogram(self, width=50):
+        "Print the histogram of the divergences, model minus RTL"
+        peak = max(self.histogram.values(), default=1)
+        bound = self.histogram_range
+        for diff in range(-bound, bound + 1):
+            count = self.histogram[diff]
+            if count == 0:
+                continue
+            label = f"{diff:+}"
+            if abs(diff) == bound:
+                label = ("<=" if diff < 0 else ">=") + label
+            bar = "#" * max(1, width * count // peak)
+            print(f"{label:>6} {count:>9} {bar}")
+
+def _print_table(rows, top):
+    ranked = sorted(rows.items(), key=lambda item: item[1]["error"],
+        reverse=True)[:top]
+    width = max([4] + [len(name) for name, _ in ranked])
+    print(f"{'':<{width}} {'count':>9} {'RTL':>9} {'model':>9}"
+        f" {'diff':>9} {'abs diff':>9}")
+    for name, c in ranked:
+        print(f"{name:<{width}} {c['count']:>9} {c['rtl']:>9} {c['model']:>9}"
+            f" {c['model'] - c['rtl']:>+9} {c['error']:>9}")
+
+def iter_cycles(path):
+    "Generate (address, cycle, mnemo) for each instruction of a trace file"
+    if is_binary_trace(path):
+        for address, _, cycle, mnemo, *_ in BinaryTrace(path).records():
+            yield address, None if cycle == NO_CYCLE else cycle, mnemo
+        return
+    for found, _ in scan_trace(path):
+        yield int(found.address, 16), found.cycle, found.mnemo
+
+def correlate_files(rtl_file, model_file, correlator):
+    "Walk an RTL trace and a model-annotated trace in lockstep"
+    model_records = iter_cycles(model_file)
+    for n, (address, rtl_cycle, mnemo) in enumerate(iter_cycles(rtl_file)):
+        model = next(model_records, None)
+        if model is None:
+            raise ValueError(f"model trace ends at instruction {n}")
+        if model[0] != address:
+            raise ValueError(f"traces diverge at instruction {n}:"
+                f" 0x{address:08x} in RTL, 0x{model[0]:08x} in model")
+        correlator.add(address, rtl_cycle, model[1], mnemo)
+
+def correlate_run(rtl_file, correlator, xlen=32, **params):
+    """
+    Run the model on an RTL trace and correlate as instructions retire
+    `xlen` selects the RV32 or RV64 decoding of the trace.
+    """
+    rtl_records = iter_cycles(rtl_file)
+    model = Model(**params)
+    def retire(instr):
+        _, rtl_cycle, mnemo = next(rtl_records)
+        cycle = instr.events[-1].cycle
+        correlator.add(instr.address, rtl_cycle, cycle, mnemo)
+    model.stream(read_trace(rtl_file, xlen), retire)
+    model.run()
+
+def main(argv):
+    "Entry point"
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("rtl_file", help="RVFI trace with RTL cycles")
+    parser.add_argument("model_file", nargs="?",
+        help="trace annotated by the model (see --run)")
+    parser.add_argument("--run", action="store_true",
+        help="run the model on the RTL trace instead of reading model_file")
+    parser.add_argument("--timed", action="store_true",
+        help="only correlate the part between csrr minstret instructions")
+    parser.add_argument("--top", type=int, default=20,
+        help="number of PCs and blocks to list")
+    parser.add_argument("--histogram-range", type=int, default=16,
+        help="divergences are clamped to [-range, range] in the histogram")
+    parser.add_argument("--issue", type=int, default=2)
+    parser.add_argument("--commit", type=int, default=2)
+    parser.add_argument("--xlen", type=int, choices=[32, 64], default=32,
+        help="with --run, decode the trace as RV32 or RV64"
+        " (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    correlator = Correlator(args.timed, args.histogram_range)
+    if args.run:
+        correlate_run(args.rtl_file, correlator, args.xlen,
+            issue=args.issue, commit=args.commit)
+    elif args.model_file:
+        correlate_files(args.rtl_file, args.model_file, correlator)
+    else:
+        parser.error("give a model_file or --run")
+    correlator.print(args.top)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
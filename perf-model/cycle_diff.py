@@ -10,10 +10,10 @@
 import re
 import sys
 
+from bintrace import BinaryTrace, is_binary_trace, NO_CYCLE
+from rvfi import scan
+
 re_csrr_minstret = re.compile(r"^csrr\s+\w+,\s*minstret$")
-re_full = re.compile(
-    r"([a-z]+)\s+0:\s*0x00000000([0-9a-f]+)\s*\(([0-9a-fx]+)\)\s*(\S*)@\s*([0-9]+)\s*(.*)"
-)
 
 class Trace:
     def __init__(self, addr, cycle, mnemo, flags):
@@ -43,16 +43,16 @@ def read_traces(input_file):
             return
         if filter_add.accepting:
             l.append(trace)
-    with open(input_file, "r", encoding="utf8") as f:
-        for line in [l.strip() for l in f]:
-            found = re_full.search(line)
-            if found:
-                addr = found.group(2)
-                flags = found.group(4)
-                cycle = int(found.group(5))
-                mnemo = found.group(6)
-                filter_add(Trace(addr, cycle, mnemo, flags))
-                #l.append(Trace(addr, cycle, mnemo, flags))
+    if is_binary_trace(input_file):
+        for address, _, cycle, mnemo, _, flags, _ \
+                in BinaryTrace(input_file).records():
+            if cycle != NO_CYCLE:
+                filter_add(Trace(f"{address:08x}", cycle, mnemo, flags))
+        return l
+    for found, _ in scan(input_file):
+        if found.cycle is not None:
+            filter_add(Trace(f"{int(found.address, 16):08x}", found.cycle,
+                found.mnemo, found.flags))
     return l
 
 def write_traces(outfile, traces):
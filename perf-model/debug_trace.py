@@ -0,0 +1,185 @@
+# Copyright 2024 Thales Silicon Security
+#
+# Licensed under the Solderpad Hardware Licence, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# SPDX-License-Identifier: Apache-2.0 WITH SHL-2.0
+# You may obtain a copy of the License at https://solderpad.org/licenses/
+#
+# Original Author: Côme ALLART - Thales
+
+"""
+Debug trace of the performance model
+
+Components of the model send messages to a `DebugTrace` as a format string
+and its arguments. Nothing is formatted unless the component is selected
+and the cycle is in the selected window.
+
+Messages are printed, or written as binary records to be rendered later
+by running this script, which filters them again by component, cycle and
+regular expression.
+"""
+
+import argparse
+import re
+import struct
+import sys
+
+# Components which can send messages
+COMPONENTS = ["iq", "ras", "scoreboard", "fus", "events"]
+
+MAGIC = b"PMDBG\x00\x00\x02"
+
+# Record kinds
+FORMAT = 0
+MESSAGE = 1
+
+# kind, format id, length of the format string
+FORMAT_RECORD = struct.Struct("<BHH")
+# kind, cycle, component, format id, number of arguments
+MESSAGE_RECORD = struct.Struct("<BqBHB")
+# Integer arguments are tagged b"i" if non-negative, b"n" if negative and
+# stored as their absolute value, so that 64-bit addresses fit. Wider ones
+# are tagged b"I" and stored as decimal strings.
+INT_ARG = struct.Struct("<Q")
+STR_LEN = struct.Struct("<H")
+
+class DebugTrace:
+    """
+    Receives the debug messages of a model
+    `components` is a list of names from COMPONENTS (all by default),
+    `cycles` a (first, last) window, either bound being None if open.
+    Messages are printed to `file`, or written as binary records to
+    `binary`, an open binary file.
+    """
+
+    def __init__(self, components=None, cycles=(None, None), file=None,
+            binary=None):
+        self.selected = set(COMPONENTS if components is None else components)
+        unknown = self.selected - set(COMPONENTS)
+        if unknown:
+            raise ValueError(f"unknown debug components: {sorted(unknown)}")
+        self.first, self.last = cycles
+        self.file = file
+        self.binary = binary
+        self.formats = {}
+        self.cycle = None
+        self.components = set()
+        self.set_cycle(None)
+        if binary is not None:
+            binary.write(MAGIC)
+
+    def __getstate__(self):
+        # A restored checkpoint has no debug output
+        state = self.__dict__.copy()
+        state["file"] = None
+        state["binary"] = None
+        state["selected"] = set()
+        state["components"] = set()
+        return state
+
+    def set_cycle(self, cycle):
+        "Set the current cycle, which enables or disables the components"
+        self.cycle = cycle
+        in_window = cycle is None or (
+            (self.first is None or cycle >= self.first)
+            and (self.last is None or cycle <= self.last))
+        self.components = self.selected if in_window else set()
+
+    def log(self, component, message, args=()):
+        "Send a message, `message % args`, if the component is enabled"
+        if component not in self.components:
+            return
+        if self.binary is not None:
+            self._write(component, message, args)
+            return
+        cycle = "-" if self.cycle is None else self.cycle
+        print(f"@{cycle} {component}: {message % args}", file=self.file)
+
+    def _write(self, component, message, args):
+        fmt_id = self.formats.get(message)
+        if fmt_id is None:
+            fmt_id = len(self.formats)
+            self.formats[message] = fmt_id
+            encoded = message.encode()
+            self.binary.write(FORMAT_RECORD.pack(FORMAT, fmt_id, len(encoded)))
+            self.binary.write(encoded)
+        cycle = -1 if self.cycle is None else self.cycle
+        self.binary.write(MESSAGE_RECORD.pack(MESSAGE, cycle,
+            COMPONENTS.index(component), fmt_id, len(args)))
+        for arg in args:
+            if isinstance(arg, int) and abs(arg) < 1 << 64:
+                tag = b"i" if arg >= 0 else b"n"
+                self.binary.write(tag + INT_ARG.pack(abs(arg)))
+            elif isinstance(arg, int):
+                encoded = str(arg).encode()
+                self.binary.write(b"I" + STR_LEN.pack(len(encoded)) + encoded)
+            else:
+                encoded = str(arg).encode()[:0xffff]
+                self.binary.write(b"s" + STR_LEN.pack(len(encoded)) + encoded)
+
+def read_records(f):
+    "Generate (cycle or None, component, message) from a binary debug trace"
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError("not a binary debug trace")
+    formats = {}
+    while True:
+        kind = f.read(1)
+        if not kind:
+            return
+        if kind[0] == FORMAT:
+            _, fmt_id, length = FORMAT_RECORD.unpack(
+                kind + f.read(FORMAT_RECORD.size - 1))
+            formats[fmt_id] = f.read(length).decode()
+            continue
+        _, cycle, component, fmt_id, n_args = MESSAGE_RECORD.unpack(
+            kind + f.read(MESSAGE_RECORD.size - 1))
+        args = []
+        for _ in range(n_args):
+            tag = f.read(1)
+            if tag in (b"i", b"n"):
+                value, = INT_ARG.unpack(f.read(INT_ARG.size))
+                args.append(value if tag == b"i" else -value)
+            else:
+                length, = STR_LEN.unpack(f.read(STR_LEN.size))
+                text = f.read(length).decode()
+                args.append(int(text) if tag == b"I" else text)
+        yield (None if cycle < 0 else cycle, COMPONENTS[component],
+            formats[fmt_id] % tuple(args))
+
+def parse_cycles(text):
+    "Parse a FIRST:LAST cycle window, either bound can be omitted"
+    first, _, last = text.partition(":")
+    return (int(first) if first else None, int(last) if last else None)
+
+def view(path, components=None, cycles=(None, None), pattern=None):
+    "Print the messages of a binary debug trace"
+    selected = set(COMPONENTS if components is None else components)
+    first, last = cycles
+    regex = re.compile(pattern) if pattern else None
+    with open(path, "rb") as f:
+        for cycle, component, message in read_records(f):
+            if component not in selected:
+                continue
+            if cycle is not None and ((first is not None and cycle < first)
+                    or (last is not None and cycle > last)):
+                continue
+            if regex is not None and not regex.search(message):
+                continue
+            print(f"@{'-' if cycle is None else cycle} {component}: {message}")
+
+def main(argv):
+    "Entry point"
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input_file", help="binary debug trace")
+    parser.add_argument("--components", nargs="+", choices=COMPONENTS,
+        help="components to show (default: all)")
+    parser.add_argument("--cycles", type=parse_cycles, default=(None, None),
+        metavar="FIRST:LAST", help="cycle window to show")
+    parser.add_argument("--grep", metavar="REGEX",
+        help="only show the messages matching a regular expression")
+    args = parser.parse_args(argv)
+    view(args.input_file, args.components, args.cycles, args.grep)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
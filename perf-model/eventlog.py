@@ -0,0 +1,210 @@
+# Copyright 2024 Thales Silicon Security
+#
+# Licensed under the Solderpad Hardware Licence, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# SPDX-License-Identifier: Apache-2.0 WITH SHL-2.0
+# You may obtain a copy of the License at https://solderpad.org/licenses/
+#
+# Original Author: Côme ALLART - Thales
+
+"""
+Compact log of the events of the performance model
+
+Events are stored in typed columns: instruction index, event kind (as the
+small integer value of `EventKind`) and cycle. Statistics are computed on
+these columns, with numpy if it is available.
+"""
+
+from array import array
+from enum import Enum
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+EventKind = Enum('EventKind', [
+    'WAW', 'WAR', 'RAW',
+    'BMISS', 'BHIT',
+    'STRUCT',
+    'issue', 'done', 'commit',
+    'IMISS', 'DMISS',
+])
+
+class Event:
+    """Represents an event on an instruction"""
+    def __init__(self, kind, cycle):
+        self.kind = kind
+        self.cycle = cycle
+
+    def __repr__(self):
+        return f"@{self.cycle}: {self.kind}"
+
+# Type codes of the columns: instruction index, kind, cycle
+INDEX, KIND, CYCLE = 'q', 'B', 'q'
+
+def _zeros(typecode, length):
+    return array(typecode, bytes(length * array(typecode).itemsize))
+
+def as_numpy(column):
+    "View a column as a numpy array, without copy"
+    return np.frombuffer(column, dtype=column.typecode)
+
+class EventLog:
+    """
+    Events of a model run, in preallocated typed columns
+
+    Rows are identified by their absolute number, which stays valid when
+    the rows of retired instructions are dropped (see `drop_until`).
+    """
+
+    def __init__(self, capacity=1 << 16):
+        self.capacity = capacity
+        self.index = _zeros(INDEX, capacity)
+        self.kind = _zeros(KIND, capacity)
+        self.cycle = _zeros(CYCLE, capacity)
+        self.len = 0
+        # Rows numbered from `base` are stored at `number + offset`,
+        # older rows kept by `drop_until` are at the beginning
+        self.base = 0
+        self.offset = 0
+
+    def __len__(self):
+        return self.len
+
+    def append(self, index, kind, cycle):
+        "Add an event, returns its row number"
+        if self.len == self.capacity:
+            self._grow()
+        pos = self.len
+        self.index[pos] = index
+        self.kind[pos] = kind
+        self.cycle[pos] = cycle
+        self.len += 1
+        return pos - self.offset
+
+    def _grow(self):
+        for column in [self.index, self.kind, self.cycle]:
+            column.frombytes(bytes(self.capacity * column.itemsize))
+        self.capacity *= 2
+
+    def columns(self):
+        "Copy of the (index, kind, cycle) columns"
+        n = self.len
+        return self.index[:n], self.kind[:n], self.cycle[:n]
+
+    def events_of(self, index, first_row):
+        "Events of an instruction, given its index and its first row number"
+        if first_row >= self.base:
+            start = first_row + self.offset
+        else:
+            start = 0
+        events = []
+        for pos in range(start, self.len):
+            if self.index[pos] == index:
+                kind = EventKind(self.kind[pos])
+                events.append(Event(kind, self.cycle[pos]))
+        return events
+
+    def drop_until(self, last_index):
+        """
+        Remove the events of instructions up to `last_index` included
+        Returns the removed rows as (index, kind, cycle) columns
+        """
+        index, kind, cycle = self.columns()
+        if np is not None:
+            done = as_numpy(index) <= last_index
+            keep = ~done
+            dropped = [array(c.typecode, as_numpy(c)[done].tobytes())
+                for c in (index, kind, cycle)]
+            kept = [array(c.typecode, as_numpy(c)[keep].tobytes())
+                for c in (index, kind, cycle)]
+        else:
+            dropped = [array(c.typecode) for c in (index, kind, cycle)]
+            kept = [array(c.typecode) for c in (index, kind, cycle)]
+            for row in zip(index, kind, cycle):
+                target = dropped if row[0] <= last_index else kept
+                for column, value in zip(target, row):
+                    column.append(value)
+        n_kept = len(kept[0])
+        self.index[:n_kept] = kept[0]
+        self.kind[:n_kept] = kept[1]
+        self.cycle[:n_kept] = kept[2]
+        self.base = self.len - self.offset
+        self.len = n_kept
+        self.offset = n_kept - self.base
+        return tuple(dropped)
+
+def select(index, runs):
+    "Mask of the rows whose instruction index is in one of the [first, last] runs"
+    index = as_numpy(index)
+    low, high = index.min(), index.max()
+    mask = np.zeros(len(index), dtype=bool)
+    for first, last in runs:
+        if first <= high and last >= low:
+            mask |= (index >= first) & (index <= last)
+    return mask
+
+def count_kinds(index, kind, runs):
+    """
+    Count events of the selected instructions by kind
+    Returns (kind, count) in order of first appearance in instruction order
+    """
+    if len(index) == 0:
+        return []
+    if np is None:
+        counts = {}
+        first_seen = {}
+        for pos, (i, k) in enumerate(zip(index, kind)):
+            if any(first <= i <= last for first, last in runs):
+                counts[k] = counts.get(k, 0) + 1
+                first_seen[k] = min(first_seen.get(k, (i, pos)), (i, pos))
+        order = sorted(first_seen, key=first_seen.get)
+        return [(EventKind(k), counts[k]) for k in order]
+    mask = select(index, runs)
+    sel_index = as_numpy(index)[mask]
+    sel_kind = as_numpy(kind)[mask]
+    counts = np.bincount(sel_kind, minlength=len(EventKind) + 1)
+    by_instr = sel_kind[np.argsort(sel_index, kind='stable')]
+    codes, first_seen = np.unique(by_instr, return_index=True)
+    codes = codes[np.argsort(first_seen)]
+    return [(EventKind(int(k)), int(counts[k])) for k in codes]
+
+def instruction_span(index, cycle, runs):
+    """
+    Indexes of the first and last selected instructions, with the first
+    cycle of the first one and the last cycle of the last one
+    Returns None if no instruction is selected
+    """
+    if len(index) == 0:
+        return None
+    if np is None:
+        rows = [(i, c) for i, c in zip(index, cycle)
+            if any(first <= i <= last for first, last in runs)]
+        if not rows:
+            return None
+        first = min(i for i, _ in rows)
+        last = max(i for i, _ in rows)
+        start = min(c for i, c in rows if i == first)
+        end = max(c for i, c in rows if i == last)
+        return first, start, last, end
+    mask = select(index, runs)
+    sel_index = as_numpy(index)[mask]
+    sel_cycle = as_numpy(cycle)[mask]
+    if len(sel_index) == 0:
+        return None
+    first = sel_index.min()
+    last = sel_index.max()
+    start = sel_cycle[sel_index == first].min()
+    end = sel_cycle[sel_index == last].max()
+    return int(first), int(start), int(last), int(end)
+
+def commit_cycles(index, kind, cycle):
+    "Commit cycle of each instruction, as a {index: cycle} mapping"
+    commit = EventKind.commit.value
+    if np is None:
+        return {i: c for i, k, c in zip(index, kind, cycle) if k == commit}
+    mask = as_numpy(kind) == commit
+    return dict(zip(
+        as_numpy(index)[mask].tolist(),
+        as_numpy(cycle)[mask].tolist()))
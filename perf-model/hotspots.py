@@ -0,0 +1,324 @@
+# Copyright 2024 Thales Silicon Security
+#
+# Licensed under the Solderpad Hardware Licence, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# SPDX-License-Identifier: Apache-2.0 WITH SHL-2.0
+# You may obtain a copy of the License at https://solderpad.org/licenses/
+#
+# Original Author: Côme ALLART - Thales
+
+"""
+Attributes the cycles of a model run to PCs, functions and stall causes
+
+Each instruction is charged the cycles between the issue of the previous
+instruction and its own issue. The cycles in between are stall cycles,
+attributed to a cause from the events logged on the instruction:
+SB-full (scoreboard full), RAW, WAW, STRUCT, or for the front-end IMISS,
+BMISS (charged to the mispredicted branch) and IQ-empty.
+
+Function names come from an ELF file or an `objdump -d` listing.
+The call stack is followed with the calls and returns of the trace, which
+gives a folded-stack file usable by flamegraph tools.
+"""
+
+import argparse
+import bisect
+import re
+import struct
+import sys
+
+from collections import Counter, defaultdict
+
+from eventlog import EventKind
+from model import Model, TimedFilter, read_trace
+
+CAUSES = ["SB-full", "RAW", "WAW", "STRUCT", "IMISS", "BMISS", "IQ-empty"]
+
+# Data hazards in order of priority when several are logged in a cycle
+HAZARDS = {
+    EventKind.RAW.value: "RAW",
+    EventKind.WAW.value: "WAW",
+    EventKind.STRUCT.value: "STRUCT",
+}
+
+# Deeper call stacks lose their outermost frames
+MAX_DEPTH = 64
+
+class Symbols:
+    "Function names, looked up by address"
+
+    re_objdump = re.compile(r"^([0-9a-f]+) <([^>]+)>:$")
+
+    def __init__(self, symbols=None):
+        symbols = sorted((symbols or {}).items())
+        self.addresses = [addr for addr, _ in symbols]
+        self.names = [name for _, name in symbols]
+
+    def lookup(self, addr):
+        "Name of the function containing the address, None if unknown"
+        pos = bisect.bisect_right(self.addresses, addr)
+        return self.names[pos - 1] if pos else None
+
+    @staticmethod
+    def from_file(path):
+        "Read symbols from an ELF file or an objdump listing"
+        with open(path, "rb") as f:
+            data = f.read()
+        if data[:4] == b"\x7fELF":
+            return Symbols(read_elf_symbols(data))
+        return Symbols(read_objdump_symbols(data.decode("utf8", "replace")))
+
+def read_objdump_symbols(text):
+    "Symbols of the `address <name>:` lines of an objdump listing"
+    symbols = {}
+    for line in text.splitlines():
+        found = Symbols.re_objdump.search(line)
+        if found:
+            symbols.setdefault(int(found.group(1), 16), found.group(2))
+    return symbols
+
+def read_elf_symbols(data):
+    "Symbols of the executable sections of an ELF file, from its symtab"
+    is_64 = data[4] == 2
+    endian = "<" if data[5] == 1 else ">"
+    if is_64:
+        shoff, = struct.unpack_from(endian + "Q", data, 0x28)
+        shentsize, shnum = struct.unpack_from(endian + "HH", data, 0x3a)
+        section_fmt = endian + "IIQQQQIIQQ"
+        symbol_fmt = endian + "IBBHQQ"
+    else:
+        shoff, = struct.unpack_from(endian + "I", data, 0x20)
+        shentsize, shnum = struct.unpack_from(endian + "HH", data, 0x2e)
+        section_fmt = endian + "IIIIIIIIII"
+        symbol_fmt = endian + "IIIBBH"
+    # (type, flags, offset, size, link)
+    sections = []
+    for i in range(shnum):
+        fields = struct.unpack_from(section_fmt, data, shoff + i * shentsize)
+        sections.append((fields[1], fields[2], fields[4], fields[5], fields[6]))
+    symbols = {}
+    for sh_type, _, offset, size, link in sections:
+        if sh_type != 2: # SHT_SYMTAB
+            continue
+        strtab = sections[link][2]
+        for pos in range(offset, offset + size, struct.calcsize(symbol_fmt)):
+            fields = struct.unpack_from(symbol_fmt, data, pos)
+            if is_64:
+                name, info, _, shndx, value, _ = fields
+            else:
+                name, value, _, info, _, shndx = fields
+            if info & 0xf not in [0, 2]: # STT_NOTYPE, STT_FUNC
+                continue
+            if shndx == 0 or shndx >= len(sections):
+                continue
+            if not sections[shndx][1] & 4: # SHF_EXECINSTR
+                continue
+            end = data.index(b"\0", strtab + name)
+            label = data[strtab + name:end].decode("utf8", "replace")
+            if not label or label.startswith(("$", ".L")):
+                continue
+            if info & 0xf == 2 or value not in symbols:
+                symbols[value] = label
+    return symbols
+
+class Profiler:
+    """
+    Accumulates cycles by PC, function and stall cause
+    Instructions are given to `retire` and their events to `add_events`.
+    """
+
+    def __init__(self, sb_len, symbols=None, timed=False):
+        self.sb_len = sb_len
+        self.symbols = symbols or Symbols()
+        self.timed = timed
+        self.accepting = not timed
+        self.retired = {}
+        self.stack = []
+        self.prev = None # (address, call stack, is call, is ret) of the last one
+        self.last_issue = None
+        self.commits = {}
+        self.pcs = defaultdict(Counter)
+        self.functions = {}
+        self.folded = Counter()
+
+    def retire(self, instr):
+        "Record a retired instruction"
+        selected = self.accepting
+        if self.timed and TimedFilter.re_csrr_minstret.search(instr.mnemo):
+            self.accepting = not self.accepting
+            selected = False
+        self.retired[instr.index] = (
+            instr.address, instr.is_call(), instr.is_ret(), selected)
+
+    def _enter(self, address, call, ret):
+        "Follow the call stack, returns it as a folded string"
+        name = self.symbols.lookup(address)
+        if not self.stack or call:
+            self.stack.append(name or f"0x{address:x}")
+            if len(self.stack) > MAX_DEPTH:
+                del self.stack[0]
+        elif ret:
+            if name in self.stack[:-1]:
+                # Unwind to the caller, even if some returns were missed
+                while self.stack[-1] != name:
+                    self.stack.pop()
+            elif len(self.stack) > 1:
+                self.stack.pop()
+            if name is not None:
+                self.stack[-1] = name
+        elif name is not None and name != self.stack[-1]:
+            self.stack[-1] = name
+        return ";".join(self.stack)
+
+    def add_events(self, index, kind, cycle):
+        "Account for the events of retired instructions"
+        events = defaultdict(list)
+        for i, k, c in zip(index, kind, cycle):
+            events[i].append((k, c))
+        for i in sorted(events):
+            self._account(i, events[i])
+
+    def _account(self, i, events):
+        address, call, ret, selected = self.retired.pop(i)
+        issue = commit = None
+        hazards = {}
+        front = "IQ-empty"
+        for k, c in events:
+            if k == EventKind.issue.value:
+                issue = c
+            elif k == EventKind.commit.value:
+                commit = c
+            elif k in HAZARDS:
+                hazards.setdefault(c, set()).add(k)
+            elif k == EventKind.IMISS.value:
+                front = "IMISS"
+            elif k == EventKind.BMISS.value and front != "IMISS":
+                front = "BMISS"
+        self.commits[i] = commit
+        self.commits.pop(i - self.sb_len - 1, None)
+        last_issue = self.last_issue if self.last_issue is not None else issue - 1
+        self.last_issue = issue
+        prev = self.prev
+        after_call = prev is not None and prev[2]
+        after_ret = prev is not None and prev[3]
+        stack = self._enter(address, after_call, after_ret)
+        self.prev = (address, stack, call, ret)
+        if not selected:
+            return
+        pc = self.pcs[address]
+        pc["count"] += 1
+        pc["cycles"] += max(issue - last_issue, 0)
+        self.functions.setdefault(address, self.stack[-1])
+        stalls = Counter()
+        blocking = self.commits.get(i - self.sb_len)
+        for c in range(last_issue + 1, issue):
+            if blocking is not None and blocking > c:
+                stalls["SB-full"] += 1
+            elif c in hazards:
+                kind = next(k for k in HAZARDS if k in hazards[c])
+                stalls[HAZARDS[kind]] += 1
+            else:
+                stalls[front] += 1
+        n_stalls = sum(stalls.values())
+        self.folded[stack] += max(issue - last_issue, 0) - n_stalls
+        for cause, count in stalls.items():
+            if cause == "BMISS" and prev is not None:
+                # The mispredicted branch or jump is the culprit
+                self.pcs[address]["cycles"] -= count
+                self.pcs[prev[0]]["cycles"] += count
+                self.pcs[prev[0]][cause] += count
+                self.folded[f"{prev[1]};[{cause}]"] += count
+            else:
+                pc[cause] += count
+                self.folded[f"{stack};[{cause}]"] += count
+
+    def by_function(self):
+        "Counters aggregated by function"
+        functions = defaultdict(Counter)
+        for address, counts in self.pcs.items():
+            name = self.functions.get(address)
+            if name is None:
+                name = self.symbols.lookup(address) or f"0x{address:x}"
+            functions[name].update(counts)
+        return functions
+
+    def total(self):
+        "Counters of the whole run"
+        total = Counter()
+        for counts in self.pcs.values():
+            total.update(counts)
+        return total
+
+    def print(self, top=20):
+        "Print the causes, then the top functions and PCs by cycles"
+        total = self.total()
+        n_cycles = total["cycles"]
+        print(f"instructions = {total['count']}")
+        print(f"cycles       = {n_cycles}")
+        for cause in CAUSES:
+            print(f"{cause:<12} = {total[cause]:>9}"
+                f" ({100 * total[cause] / max(n_cycles, 1):.2f}%)")
+        print()
+        _print_table("function", self.by_function(), n_cycles, top)
+        print()
+        pcs = {f"0x{addr:08x} {self.functions.get(addr, '')}": counts
+            for addr, counts in self.pcs.items()}
+        _print_table("PC", pcs, n_cycles, top)
+
+    def write_folded(self, path):
+        "Write the folded stacks, weighted by cycles"
+        with open(path, "w", encoding="utf8") as f:
+            for stack, count in sorted(self.folded.items()):
+                if count > 0:
+                    f.write(f"{stack} {count}\n")
+
+def _print_table(title, rows, n_cycles, top):
+    width = max([len(title)] + [len(name) for name in rows])
+    header = f"{title:<{width}} {'count':>9} {'cycles':>9} {'%':>6}"
+    print(header + "".join(f" {cause:>8}" for cause in CAUSES))
+    ranked = sorted(rows.items(), key=lambda item: item[1]["cycles"],
+        reverse=True)
+    for name, counts in ranked[:top]:
+        line = f"{name:<{width}} {counts['count']:>9} {counts['cycles']:>9}" \
+            f" {100 * counts['cycles'] / max(n_cycles, 1):>6.2f}"
+        print(line + "".join(f" {counts[cause]:>8}" for cause in CAUSES))
+
+def profile(input_file, symbols=None, timed=False, xlen=32, **params):
+    "Run the model on a trace, decoded as RV32 or RV64, and profile it"
+    model = Model(**params)
+    profiler = Profiler(model.sb_len, symbols, timed)
+    model.stream(read_trace(input_file, xlen), profiler.retire,
+        on_events=profiler.add_events)
+    model.run()
+    return profiler
+
+def main(argv):
+    "Entry point"
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input_file", help="RVFI trace")
+    parser.add_argument("--symbols",
+        help="ELF file or objdump listing giving function names")
+    parser.add_argument("--folded", help="write folded stacks to this file")
+    parser.add_argument("--timed", action="store_true",
+        help="only profile the part between csrr minstret instructions")
+    parser.add_argument("--top", type=int, default=20,
+        help="number of functions and PCs to list")
+    parser.add_argument("--issue", type=int, default=2)
+    parser.add_argument("--commit", type=int, default=2)
+    parser.add_argument("--icache", help="I-cache spec, see caches.py")
+    parser.add_argument("--dcache", help="D-cache spec, see caches.py")
+    parser.add_argument("--xlen", type=int, choices=[32, 64], default=32,
+        help="decode the trace as RV32 or RV64 (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    symbols = Symbols.from_file(args.symbols) if args.symbols else None
+    profiler = profile(args.input_file, symbols, args.timed, args.xlen,
+        issue=args.issue, commit=args.commit,
+        icache=args.icache, dcache=args.dcache)
+    profiler.print(args.top)
+    if args.folded:
+        profiler.write_folded(args.folded)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
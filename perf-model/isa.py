@@ -9,9 +9,14 @@
 
 """
 Represents the instruction set
+
+Instructions are decoded for RV32 or RV64 (`xlen`), which only differ by
+some compressed instructions. Registers are numbered from 0 to 63: the
+integer registers, then the floating-point registers (Reg.f0 is 32).
 """
 
 from dataclasses import dataclass
+from functools import cached_property, lru_cache
 
 class Reg:
     """Constants to represent registers"""
@@ -82,6 +87,8 @@ class Reg:
     x29 = 29
     x30 = 30
     x31 = 31
+    # Floating-point registers follow the integer ones
+    f0 = 32
 
 def sign_ext(imm, index, xlen=32):
     """
@@ -170,6 +177,74 @@ class Jtype:
             | (((instr.bin >> 21) & 0x3ff) << 1)
         , 20)
 
+class R4type:
+    """R4-type instructions (fused multiply-add), on FP registers"""
+    def __init__(self, instr):
+        self.rs3 = Reg.f0 + (instr.bin >> 27)
+        self.funct2 = (instr.bin >> 25) & 3
+        self.rs2 = Reg.f0 + ((instr.bin >> 20) & 31)
+        self.rs1 = Reg.f0 + ((instr.bin >> 15) & 31)
+        self.rm = (instr.bin >> 12) & 7
+        self.rd = Reg.f0 + ((instr.bin >> 7) & 31)
+        self.opcode = instr.bin & 63
+
+class FPtype(Rtype):
+    """OP-FP instructions, whose registers are FP or integer by funct5"""
+    def __init__(self, instr):
+        Rtype.__init__(self, instr)
+        self.funct5 = self.funct7 >> 2
+        if self.funct5 not in FPtype.int_rd:
+            self.rd += Reg.f0
+        if self.funct5 not in FPtype.int_rs1:
+            self.rs1 += Reg.f0
+        if self.funct5 in FPtype.unary:
+            self.rs2 = None
+        else:
+            self.rs2 += Reg.f0
+
+    # FCMP, FCVT.int.fp, FMV.X/FCLASS
+    int_rd = [0b10100, 0b11000, 0b11100]
+    # FCVT.fp.int, FMV.fp.X
+    int_rs1 = [0b11010, 0b11110]
+    # FCVT.fp.fp, FSQRT and the above: rs2 is not a register
+    unary = [0b01000, 0b01011, 0b11000, 0b11010, 0b11100, 0b11110]
+
+class FLtype(Itype):
+    """Floating-point loads"""
+    def __init__(self, instr):
+        Itype.__init__(self, instr)
+        self.rd += Reg.f0
+
+class FStype(Stype):
+    """Floating-point stores"""
+    def __init__(self, instr):
+        Stype.__init__(self, instr)
+        self.rs2 += Reg.f0
+
+class Atype(Rtype):
+    """Atomic memory operations"""
+    def __init__(self, instr):
+        Rtype.__init__(self, instr)
+        self.funct5 = self.funct7 >> 2
+        self.name = Atype.names.get(self.funct5, 'AMO')
+        if self.name == 'LR':
+            self.rs2 = None
+        self.offset = 0
+
+    names = {
+        0b00010: 'LR',
+        0b00011: 'SC',
+        0b00001: 'AMOSWAP',
+        0b00000: 'AMOADD',
+        0b00100: 'AMOXOR',
+        0b01100: 'AMOAND',
+        0b01000: 'AMOOR',
+        0b10000: 'AMOMIN',
+        0b10100: 'AMOMAX',
+        0b11000: 'AMOMINU',
+        0b11100: 'AMOMAXU',
+    }
+
 class MOItype:
     """Memory ordering instructions"""
     def __init__(self, instr):
@@ -231,6 +306,8 @@ class CItype:
                 base = 'C.LUI'
         if base in CItype.SPload + CItype.constgen:
             self.rd = r
+        if base in CItype.fp:
+            self.rd += Reg.f0
         if base in CItype.SPload:
             self.rs1 = Reg.sp
             self.offset = CItype.offset[base](instr.bin)
@@ -252,6 +329,7 @@ class CItype:
             self.shamt = CItype.imm(instr.bin)
 
     SPload = ['C.LWSP', 'C.LDSP', 'C.LQSP', 'C.FLWSP', 'C.FLDSP']
+    fp = ['C.FLWSP', 'C.FLDSP']
     constgen = ['C.LI', 'C.LUI']
     regimm = ['C.ADDI', 'C.ADDIW', 'C.ADDI16SP', 'C.SLLI']
 
@@ -281,9 +359,14 @@ class CSStype:
         self.rs1 = Reg.sp
         self.rs2 = (instr.bin >> 2) & 31
         self.op = instr.bin & 3
-        self.offset = CSStype.offset[instr.base()](instr.bin)
+        base = instr.base()
+        if base in CSStype.fp:
+            self.rs2 += Reg.f0
+        self.offset = CSStype.offset[base](instr.bin)
         # zero-extended offset
 
+    fp = ['C.FSWSP', 'C.FSDSP']
+
     Woffset = lambda i: (((i >> 9) & 15) << 2) | (((i >> 7) & 3) << 6)
     Doffset = lambda i: (((i >> 10) & 7) << 3) | (((i >> 7) & 7) << 6)
     Qoffset = lambda i: (((i >> 11) & 3) << 4) | (((i >> 7) & 15) << 6)
@@ -325,9 +408,14 @@ class CLtype:
         self.rs1 = rs1_ + 8
         self.rd = rd_ + 8
         self.op = instr.bin & 3
-        self.offset = CLtype.offset[instr.base()](instr.bin)
+        base = instr.base()
+        if base in CLtype.fp:
+            self.rd += Reg.f0
+        self.offset = CLtype.offset[base](instr.bin)
         # zero-extended offset
 
+    fp = ['C.FLW', 'C.FLD']
+
     offset = {
         'C.LW': CLS_Woffset,
         'C.LD': CLS_Doffset,
@@ -345,9 +433,14 @@ class CStype:
         self.rs1 = rs1_ + 8
         self.rs2 = rs2_ + 8
         self.op = instr.bin & 3
-        self.offset = CStype.offset[instr.base()](instr.bin)
+        base = instr.base()
+        if base in CStype.fp:
+            self.rs2 += Reg.f0
+        self.offset = CStype.offset[base](instr.bin)
         # zero-extended offset
 
+    fp = ['C.FSW', 'C.FSD']
+
     offset = {
         'C.SW': CLS_Woffset,
         'C.SD': CLS_Doffset,
@@ -364,7 +457,9 @@ class CAtype:
         self.rd = r + 8
         self.rs1 = r + 8
         self.funct2 = (instr.bin >> 5) & 3
-        self.rs2 = ((instr.bin >> 2) & 7) + 8
+        # C.SRLI, C.SRAI and C.ANDI have an immediate instead of rs2
+        if (self.funct6 & 3) == 3:
+            self.rs2 = ((instr.bin >> 2) & 7) + 8
         self.op = instr.bin & 3
 
 class CBtype:
@@ -421,6 +516,15 @@ class Instr:
             'C.J[AL]R/C.MV/C.ADD', 'C.FSDSP', 'C.SWSP', 'C.FSWSP'],
     ]
 
+    table_16_4_RV64 = [
+        ['C.ADDI4SPN', 'C.FLD', 'C.LW', 'C.LD',
+            'Reserved', 'C.FSD', 'C.SW', 'C.SD'],
+        ['C.ADDI', 'C.ADDIW', 'C.LI', 'C.LUI/C.ADDI16SP',
+            'MISC-ALU', 'C.J', 'C.BEQZ', 'C.BNEZ'],
+        ['C.SLLI', 'C.FLDSP', 'C.LWSP', 'C.LDSP',
+            'C.J[AL]R/C.MV/C.ADD', 'C.FSDSP', 'C.SWSP', 'C.SDSP'],
+    ]
+
     table_24_1 = [
         ['LOAD', 'LOAD-FP', 'custom-0', 'MISC-MEM', 'OP-IMM', 'AUIPC', 'OP-IMM-32', '48b'],
         ['STORE', 'STORE-FP', 'custom-1', 'AMO', 'OP', 'LUI', 'OP-32', '64b'],
@@ -429,6 +533,7 @@ class Instr:
     ]
     type_of_base = {
         'OP-IMM': Itype,
+        'OP-IMM-32': Itype,
         'LUI': Utype,
         'AUIPC': Utype,
         'OP': Rtype,
@@ -438,6 +543,15 @@ class Instr:
         'BRANCH': Btype,
         'LOAD': Itype,
         'STORE': Stype,
+        'LOAD-FP': FLtype,
+        'STORE-FP': FStype,
+        'AMO': Atype,
+        'OP-FP': FPtype,
+        'MADD': R4type,
+        'MSUB': R4type,
+        'NMSUB': R4type,
+        'NMADD': R4type,
+        'MISC-MEM': MOItype,
         'SYSTEM': Itype,
         'C.LWSP': CItype,
         'C.LDSP': CItype,
@@ -472,24 +586,32 @@ class Instr:
         'C.SLLI': CItype,
         'MISC-ALU': CAtype,
     }
-    iloads = ['C.LW', 'C.LWSP', 'LOAD']
+    iloads = ['C.LW', 'C.LWSP', 'C.LD', 'C.LDSP', 'LOAD']
     floads = ['C.FLD', 'C.FLW', 'C.FLDSP', 'C.FLWSP', 'LOAD-FP']
-    istores = ['C.SW', 'C.SWSP', 'STORE']
+    istores = ['C.SW', 'C.SWSP', 'C.SD', 'C.SDSP', 'STORE']
     fstores = ['C.FSD', 'C.FSW', 'C.FSDSP', 'C.FSWSP', 'STORE-FP']
     loads = iloads + floads
     stores = istores + fstores
 
-    def __init__(self, bincode):
+    def __init__(self, bincode, xlen=32):
         self.bin = bincode
+        self.xlen = xlen
         self.inst_1_0 = self.bin & 3
 
+    @cached_property
+    def decoded(self):
+        """Precomputed decoding of the instruction word, see `decode`"""
+        return decode(self.bin, self.xlen)
+
     def base(self):
         """Get the name of the base instruction"""
         result = ""
         if self.is_compressed():
             line = self.bin & 3
             col = (self.bin >> 13) & 7
-            result = Instr.table_16_4_RV32[line][col]
+            table = Instr.table_16_4_RV64 if self.xlen == 64 \
+                else Instr.table_16_4_RV32
+            result = table[line][col]
         else:
             line = (self.bin >> 5) & 3
             col = (self.bin >> 2) & 7
@@ -497,8 +619,12 @@ class Instr:
         return result
 
     def fields(self):
-        """Get an object with the fields of the instruction"""
-        return Instr.type_of_base[self.base()](self)
+        """
+        Get an object with the fields of the instruction
+        None for the bases without fields (custom, reserved)
+        """
+        fields_type = Instr.type_of_base.get(self.base())
+        return fields_type(self) if fields_type is not None else None
 
     def is_compressed(self):
         """Is the instruction from the C extension?"""
@@ -506,69 +632,118 @@ class Instr:
 
     def size(self):
         """Size of the instruction in bytes"""
-        return 2 if self.is_compressed() else 4
+        return self.decoded.size
 
     def is_load(self):
         """Is the instruction a load?"""
-        return self.base() in Instr.loads
+        return self.decoded.is_load
 
     def is_store(self):
         """Is the instruction a store?"""
-        return self.base() in Instr.stores
+        return self.decoded.is_store
 
     def is_branch(self):
         """Is it a taken/not taken branch?"""
-        return self.base() in ['C.BEQZ', 'C.BNEZ', 'BRANCH']
+        return self.decoded.is_branch
 
     def is_regjump(self):
         """Is it a register jump?"""
-        if self.base() in ['JALR']:
-            return True
-        if self.base() == 'C.J[AL]R/C.MV/C.ADD':
-            return self.fields().name in ['C.JALR', 'C.JR']
-        return False
+        return self.decoded.is_regjump
 
     def is_jump(self):
         """Is it an immediate jump?"""
-        return self.base() in ['JAL', 'C.JAL', 'C.J']
+        return self.decoded.is_jump
 
     def is_muldiv(self):
         """Is it a muldiv instruction?"""
-        return self.base() in ['OP', 'OP-32'] and self.fields().funct7 == 1
+        return self.decoded.is_muldiv
 
     def offset(self):
         """Get offset from instr (sometimes it is just 'imm' in RISCV spec)"""
-        fields = self.fields()
-        return fields.offset if hasattr(fields, 'offset') else fields.imm
+        return self.decoded.offset
 
     def addr_fields(self):
         """Get the register and offset to build an address"""
-        return AddrFields(self.fields().rs1, self.offset())
+        return AddrFields(self.decoded.rs1, self.decoded.offset)
 
     def has_WAW_from(self, other):
         """b.has_WAW_from(a) if a.rd == b.rd"""
-        a = other.fields()
-        b = self.fields()
-        if not (hasattr(a, 'rd') and hasattr(b, 'rd')):
+        a = other.decoded
+        b = self.decoded
+        if a.rd is None or b.rd is None:
             return False
         return a.rd == b.rd and a.rd != Reg.zero
 
     def has_RAW_from(self, other):
         """b.has_RAW_from(a) if b.rsX == a.rd"""
-        a = other.fields()
-        b = self.fields()
-        if not hasattr(a, 'rd') or a.rd == Reg.zero:
+        a = other.decoded
+        b = self.decoded
+        if a.rd is None or a.rd == Reg.zero:
             return False
-        if hasattr(b, 'rs1') and a.rd == b.rs1:
-            return True
-        return hasattr(b, 'rs2') and a.rd == b.rs2
+        return a.rd == b.rs1 or a.rd == b.rs2 or a.rd == b.rs3
 
     def has_WAR_from(self, other):
         """b.has_WAR_from(a) if b.rd == a.rsX"""
-        a = other.fields()
-        b = self.fields()
-        if not hasattr(b, 'rd') or b.rd == Reg.zero:
+        a = other.decoded
+        b = self.decoded
+        if b.rd is None or b.rd == Reg.zero:
             return False
-        if hasattr(a, 'rs1') and a.rs1 == b.rd:
-            return True
-        return hasattr(a, 'rs2') and a.rs2 == b.rd
+        return a.rs1 == b.rd or a.rs2 == b.rd or a.rs3 == b.rd
+
+@dataclass(frozen=True)
+class Decoded:
+    """
+    Compact record of a decoded instruction word
+    Register and offset fields are None when the format does not have them
+    """
+    base: str
+    name: str
+    rd: int = None
+    rs1: int = None
+    rs2: int = None
+    rs3: int = None
+    offset: int = None
+    size: int = 4
+    is_compressed: bool = False
+    is_load: bool = False
+    is_store: bool = False
+    is_branch: bool = False
+    is_regjump: bool = False
+    is_jump: bool = False
+    is_muldiv: bool = False
+
+DECODE_CACHE_SIZE = 1 << 16
+
+@lru_cache(maxsize=DECODE_CACHE_SIZE)
+def decode(bincode, xlen=32):
+    """
+    Decode an instruction word once
+    The result is cached by instruction word, as traces reuse the same words
+    Atomic memory operations are loads and stores, except LR (load) and
+    SC (store).
+    """
+    instr = Instr(bincode, xlen)
+    base = instr.base()
+    fields = instr.fields()
+    name = getattr(fields, 'name', base)
+    # Some formats have a class-level `offset` table, only the formats which
+    # set an offset on their instance have one
+    own_fields = vars(fields) if fields is not None else {}
+    is_compressed = instr.is_compressed()
+    return Decoded(
+        base=base,
+        name=name,
+        rd=getattr(fields, 'rd', None),
+        rs1=getattr(fields, 'rs1', None),
+        rs2=getattr(fields, 'rs2', None),
+        rs3=getattr(fields, 'rs3', None),
+        offset=own_fields.get('offset', own_fields.get('imm')),
+        size=2 if is_compressed else 4,
+        is_compressed=is_compressed,
+        is_load=base in Instr.loads or base == 'AMO' and name != 'SC',
+        is_store=base in Instr.stores or base == 'AMO' and name != 'LR',
+        is_branch=base in ['C.BEQZ', 'C.BNEZ', 'BRANCH'],
+        is_regjump=base == 'JALR' or name in ['C.JALR', 'C.JR'],
+        is_jump=base in ['JAL', 'C.JAL', 'C.J'],
+        is_muldiv=base in ['OP', 'OP-32'] and fields.funct7 == 1,
+    )
@@ -0,0 +1,210 @@
+# Copyright 2024 Thales Silicon Security
+#
+# Licensed under the Solderpad Hardware Licence, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# SPDX-License-Identifier: Apache-2.0 WITH SHL-2.0
+# You may obtain a copy of the License at https://solderpad.org/licenses/
+#
+# Original Author: Côme ALLART - Thales
+
+"""
+Exports the pipeline of the performance model to pipeline viewers
+
+Instructions are written as they retire, from their events, in the Kanata
+format of the Konata viewer or in the Chrome trace format (chrome://tracing,
+Perfetto). The stages of an instruction are:
+
+- St: stalled at the head of the instruction queue (hazards, misses),
+  from its first event to its issue
+- Ex: from its issue to the end of its execution (done)
+- Cm: waiting in the scoreboard until it commits
+
+Hazard and miss events are shown as annotations of the instruction.
+"""
+
+import argparse
+import heapq
+import itertools
+import json
+import sys
+
+from collections import Counter
+
+from model import Model, EventKind, read_trace
+
+# Events shown as annotations
+HAZARDS = [EventKind.WAW, EventKind.WAR, EventKind.RAW, EventKind.STRUCT,
+    EventKind.BMISS, EventKind.IMISS, EventKind.DMISS]
+
+def stages(instr):
+    """
+    Stages of a retired instruction and its hazards
+    Returns ([(stage, start, end)], Counter of hazard kinds).
+    """
+    issue = done = commit = None
+    first = None
+    hazards = Counter()
+    for event in instr.events:
+        if first is None:
+            first = event.cycle
+        if event.kind == EventKind.issue:
+            issue = event.cycle
+        elif event.kind == EventKind.done:
+            done = event.cycle
+        elif event.kind == EventKind.commit:
+            commit = event.cycle
+        elif event.kind in HAZARDS:
+            hazards[event.kind.name] += 1
+    result = []
+    if first < issue:
+        result.append(("St", first, issue))
+    result.append(("Ex", issue, done))
+    if done < commit:
+        result.append(("Cm", done, commit))
+    return result, hazards
+
+class KanataWriter:
+    """
+    Writes retired instructions in the Kanata 0004 format
+    Commands must be in cycle order, but instructions retire long after they
+    start. Commands are buffered, and written once no instruction retiring
+    later can have an earlier one: the instructions are issued in order, so
+    they cannot start before the last retired one was issued.
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.buffer = []
+        self.sequence = itertools.count()
+        self.cycle = None
+        self.n_retired = 0
+
+    def _command(self, cycle, line):
+        heapq.heappush(self.buffer, (cycle, next(self.sequence), line))
+
+    def _flush(self, before=None):
+        "Write the buffered commands of the cycles before `before`"
+        while self.buffer and (before is None or self.buffer[0][0] < before):
+            cycle, _, line = heapq.heappop(self.buffer)
+            if self.cycle is None:
+                self.file.write(f"Kanata\t0004\nC=\t{cycle}\n")
+            elif cycle > self.cycle:
+                self.file.write(f"C\t{cycle - self.cycle}\n")
+            self.cycle = cycle
+            self.file.write(line)
+
+    def retire(self, instr):
+        "Write a retired instruction"
+        instr_stages, hazards = stages(instr)
+        uid = instr.index
+        start = instr_stages[0][1]
+        self._command(start, f"I\t{uid}\t{uid}\t0\n")
+        mnemo = instr.mnemo.replace("\t", " ")
+        self._command(start, f"L\t{uid}\t0\t{instr.address:08x} {mnemo}\n")
+        if hazards:
+            text = ", ".join(f"{k} x{n}" for k, n in hazards.items())
+            self._command(start, f"L\t{uid}\t1\t{text}\n")
+        for name, begin, end in instr_stages:
+            self._command(begin, f"S\t{uid}\t0\t{name}\n")
+            self._command(end, f"E\t{uid}\t0\t{name}\n")
+        commit = instr_stages[-1][2]
+        self._command(commit, f"R\t{uid}\t{self.n_retired}\t0\n")
+        self.n_retired += 1
+        issue = next(begin for name, begin, _ in instr_stages if name == "Ex")
+        self._flush(issue)
+
+    def close(self):
+        "Write the remaining commands"
+        self._flush()
+
+class ChromeTraceWriter:
+    """
+    Writes retired instructions as Chrome trace events, one cycle per
+    microsecond
+    Each instruction is drawn on a row (thread) which is free at its start,
+    the rows are reused.
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.row_ends = []
+        self.first = True
+        self.file.write("[\n")
+
+    def _event(self, event):
+        if not self.first:
+            self.file.write(",\n")
+        self.first = False
+        self.file.write(json.dumps(event, separators=(",", ":")))
+
+    def _row(self, start, end):
+        for row, row_end in enumerate(self.row_ends):
+            if row_end <= start:
+                self.row_ends[row] = end
+                return row
+        self.row_ends.append(end)
+        return len(self.row_ends) - 1
+
+    def retire(self, instr):
+        "Write a retired instruction"
+        instr_stages, hazards = stages(instr)
+        row = self._row(instr_stages[0][1], instr_stages[-1][2])
+        name = f"{instr.address:08x} {instr.mnemo}"
+        args = {"index": instr.index, "instruction": name}
+        if hazards:
+            args["hazards"] = dict(hazards)
+        for stage, begin, end in instr_stages:
+            self._event({"name": stage, "cat": "stage", "ph": "X",
+                "ts": begin, "dur": end - begin, "pid": 0, "tid": row,
+                "args": args})
+
+    def close(self):
+        "End the document"
+        self.file.write("\n]\n")
+
+WRITERS = {
+    "kanata": KanataWriter,
+    "chrome": ChromeTraceWriter,
+}
+
+def export(input_file, output_file, kind="kanata", first=0, count=None,
+        xlen=32, **params):
+    """
+    Run the model on a trace and export the retired instructions from the
+    instruction `first`, `count` of them or all
+    `xlen` selects the RV32 or RV64 decoding of the trace.
+    """
+    with open(output_file, "w", encoding="utf8") as f:
+        writer = WRITERS[kind](f)
+        model = Model(**params)
+        def retire(instr):
+            if instr.index >= first and (count is None
+                    or instr.index < first + count):
+                writer.retire(instr)
+        model.stream(read_trace(input_file, xlen), retire,
+            window=max(64, model.issue_width))
+        model.run(max_retired=None if count is None else first + count)
+        writer.close()
+
+def main(argv):
+    "Entry point"
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input_file", help="RVFI trace")
+    parser.add_argument("-o", "--output", default="pipeline.log",
+        help="output file (default: %(default)s)")
+    parser.add_argument("--format", choices=list(WRITERS), default="kanata")
+    parser.add_argument("--first", type=int, default=0,
+        help="index of the first instruction to export")
+    parser.add_argument("--count", type=int,
+        help="number of instructions to export (default: all)")
+    parser.add_argument("--issue", type=int, default=2)
+    parser.add_argument("--commit", type=int, default=2)
+    parser.add_argument("--xlen", type=int, choices=[32, 64], default=32,
+        help="decode the trace as RV32 or RV64 (default: %(default)s)")
+    args = parser.parse_args(argv)
+    export(args.input_file, args.output, args.format, args.first, args.count,
+        args.xlen, issue=args.issue, commit=args.commit)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -13,21 +13,22 @@ Performance model of the cva6
 
 import sys
 import re
+import argparse
 
 from dataclasses import dataclass
 from enum import Enum
-from collections import defaultdict
+from collections import defaultdict, deque
 
 #from matplotlib import pyplot as plt
 
 from isa import Instr, Reg
-
-EventKind = Enum('EventKind', [
-    'WAW', 'WAR', 'RAW',
-    'BMISS', 'BHIT',
-    'STRUCT',
-    'issue', 'done', 'commit',
-])
+from eventlog import EventKind, Event, EventLog # pylint: disable=unused-import
+from eventlog import count_kinds, instruction_span, commit_cycles
+from predictors import Bht, Btb, PredictionStats, make_predictor # pylint: disable=unused-import
+from caches import make_cache
+from rvfi import annotate, scan
+from debug_trace import DebugTrace, COMPONENTS, parse_cycles
+from schedulers import make_scheduler
 
 def to_signed(value, xlen=32):
     signed = value
@@ -35,25 +36,36 @@ def to_signed(value, xlen=32):
         signed -= 1 << xlen
     return signed
 
-class Event:
-    """Represents an event on an instruction"""
-    def __init__(self, kind, cycle):
-        self.kind = kind
-        self.cycle = cycle
-
-    def __repr__(self):
-        return f"@{self.cycle}: {self.kind}"
-
 class Instruction(Instr):
     """Represents a RISC-V instruction with annotations"""
 
-    def __init__(self, line, address, hex_code, mnemo):
-        Instr.__init__(self, int(hex_code, base=16))
+    def __init__(self, line, address, hex_code, mnemo, mem_addr=None,
+            xlen=32):
+        Instr.__init__(self, int(hex_code, base=16), xlen)
         self.line = line
         self.address = int(address, base=16)
         self.hex_code = hex_code
         self.mnemo = mnemo
-        self.events = []
+        self.mem_addr = mem_addr
+        self.init_events()
+
+    def init_events(self):
+        """No event yet, the model sets the index and log when it gets it"""
+        self.index = None
+        self.log = None
+        self.first_row = None
+        self.event_mask = 0
+
+    @property
+    def events(self):
+        """Events on the instruction, read from the event log"""
+        if self.first_row is None:
+            return []
+        return self.log.events_of(self.index, self.first_row)
+
+    def has_event(self, kind):
+        """Has an event of this kind been logged on the instruction?"""
+        return (self.event_mask >> kind.value) & 1 == 1
 
     def mnemo_name(self):
         """The name of the instruction (fisrt word of the mnemo)"""
@@ -67,7 +79,7 @@ class Instruction(Instr):
 
     def is_ret(self):
         "Does CVA6 consider this instruction as a ret?"
-        f = self.fields()
+        f = self.decoded
         # Strange conditions, no imm check, no rd-discard check
         return self.is_regjump() \
                 and f.rs1 in Instruction._ret_regs \
@@ -75,8 +87,8 @@ class Instruction(Instr):
 
     def is_call(self):
         "Does CVA6 consider this instruction as a ret?"
-        base = self.base()
-        f = self.fields()
+        f = self.decoded
+        base = f.base
         return base == 'C.JAL' \
             or base == 'C.J[AL]R/C.MV/C.ADD' and f.name == 'C.JALR' \
             or base in ['JAL', 'JALR'] and f.rd in Instruction._ret_regs
@@ -90,6 +102,8 @@ class Entry:
     instr: Instruction
     cycles_since_issue = 0
     done: bool = False
+    duration: int = 1
+    started: bool = True
 
     def __repr__(self):
         status = "DONE" if self.done else "WIP "
@@ -101,50 +115,62 @@ class LastIssue:
     """To store the last issued instruction"""
     instr: Instruction
     issue_cycle: int
+    # Its prediction is counted in the stats, the first time it is made
+    recorded: bool = False
 
 class IqLen:
     """Model of the instruction queue with only a size counter"""
-    def __init__(self, fetch_size, debug=False):
+    def __init__(self, fetch_size, debug=None):
         self.fetch_size = 4
         while self.fetch_size < fetch_size:
             self.fetch_size <<= 1
         self.debug = debug
         self.len = self.fetch_size
         self.new_fetch = True
+        self.stalled = 0
 
     def fetch(self):
         """Fetch bytes"""
+        if self.stalled > 0:
+            self.stalled -= 1
+            self._debug("stalled, %d cycles left", self.stalled)
+            return
         self.len += self.fetch_size
-        self._debug(f"fetched {self.fetch_size}, got {self.len}")
+        self._debug("fetched %d, got %d", self.fetch_size, self.len)
         self.new_fetch = True
 
     def flush(self):
         """Flush instruction queue (bmiss or exception)"""
         self.len = 0
-        self._debug(f"flushed, got {self.len}")
+        self._debug("flushed, got %d", self.len)
         self.new_fetch = False
 
+    def stall(self, cycles):
+        """Stop fetching for some cycles (cache miss)"""
+        self.stalled = cycles
+        self._debug("stalling for %d cycles", cycles)
+
     def jump(self):
         """Loose a fetch cycle and truncate (jump, branch hit taken)"""
         if self.new_fetch:
             self.len -= self.fetch_size
-            self._debug(f"jumping, removed {self.fetch_size}, got {self.len}")
+            self._debug("jumping, removed %d, got %d", self.fetch_size, self.len)
             self.new_fetch = False
         self._truncate()
-        self._debug(f"jumped, got {self.len}")
+        self._debug("jumped, got %d", self.len)
 
     def has(self, instr):
         """Does the instruction queue have this instruction?"""
         length = self.len
         if self._is_crossword(instr):
             length -= (self.fetch_size - 2)
-        self._debug(f"comparing {length} to {instr.size()} ({instr})")
+        self._debug("comparing %d to %d (%s)", length, instr.size(), instr)
         return length >= instr.size()
 
     def remove(self, instr):
         """Remove instruction from queue"""
         self.len -= instr.size()
-        self._debug(f"removed {instr.size()}, got {self.len}")
+        self._debug("removed %d, got %d", instr.size(), self.len)
         self._truncate(self._addr_index(instr.next_addr()))
         if instr.is_jump():
             self.jump()
@@ -162,26 +188,26 @@ class IqLen:
         if to_remove < 0:
             to_remove += self.fetch_size
         self.len -= to_remove
-        self._debug(f"truncated, removed {to_remove}, got {self.len}")
+        self._debug("truncated, removed %d, got %d", to_remove, self.len)
 
-    def _debug(self, message):
-        if self.debug:
-            print(f"iq: {message}")
+    def _debug(self, message, *args):
+        if self.debug is not None:
+            self.debug.log("iq", message, args)
 
 class Ras:
     "Return Address Stack"
-    def __init__(self, depth=2, debug=False):
+    def __init__(self, depth=2, debug=None):
         self.depth = depth - 1
-        self.stack = []
+        self.stack = deque(maxlen=self.depth)
         self.debug = debug
         self.last_dropped = None
 
     def push(self, addr):
         "Push an address on the stack, forget oldest entry if full"
+        overflow = len(self.stack) == self.depth
         self.stack.append(addr)
-        self._debug(f"pushed 0x{addr:08X}")
-        if len(self.stack) > self.depth:
-            self.stack.pop(0)
+        self._debug("pushed 0x%08X", addr)
+        if overflow:
             self._debug("overflown")
 
     def drop(self):
@@ -198,14 +224,14 @@ class Ras:
         self._debug("reading")
         if self.last_dropped is not None:
             addr = self.last_dropped
-            self._debug(f"read 0x{addr:08X}")
+            self._debug("read 0x%08X", addr)
             return addr
         self._debug("was empty")
         return None
 
     def resolve(self, instr):
         "Push or pop depending on the instruction"
-        self._debug(f"issuing {instr}")
+        self._debug("issuing %s", instr)
         if instr.is_ret():
             self._debug("detected ret")
             self.drop()
@@ -213,43 +239,9 @@ class Ras:
             self._debug("detected call")
             self.push(instr.next_addr())
 
-    def _debug(self, message):
-        if self.debug:
-            print(f"RAS: {message}")
-
-class Bht:
-    "Branch History Table"
-
-    @dataclass
-    class Entry:
-        "A BTB entry"
-        valid: bool = False
-        sat_counter: int = 0
-
-    def __init__(self, entries=128):
-        self.contents = [Bht.Entry() for _ in range(entries)]
-
-    def predict(self, addr):
-        "Is the branch taken? None if don't know"
-        entry = self.contents[self._index(addr)]
-        if entry.valid:
-            return entry.sat_counter >= 2
-        return None
-
-    def resolve(self, addr, taken):
-        "Update branch prediction"
-        index = self._index(addr)
-        entry = self.contents[index]
-        entry.valid = True
-        if taken:
-            if entry.sat_counter < 3:
-                entry.sat_counter += 1
-        else:
-            if entry.sat_counter > 0:
-                entry.sat_counter -= 1
-
-    def _index(self, addr):
-        return (addr >> 1) % len(self.contents)
+    def _debug(self, message, *args):
+        if self.debug is not None:
+            self.debug.log("ras", message, args)
 
 Fu = Enum('Fu', ['ALU', 'MUL', 'BRANCH', 'LDU', 'STU'])
 
@@ -343,13 +335,63 @@ class FusBusy:
         self.alu2 = False
         self.issued_mul = False
 
+    def duration(self, instr):
+        "Number of cycles to execute the instruction, without cache misses"
+        if instr.is_load() or instr.is_store() or instr.is_muldiv():
+            return 2
+        return 1
+
+class FuPool:
+    """
+    Functional units described by a spec, "FU:count:latency[:np]" separated
+    by commas, for instance "ALU:2:1,MUL:1:4:np". "np" is for units which
+    are not pipelined. Unlisted units have the defaults below.
+    """
+
+    defaults = {
+        Fu.ALU: (1, 1),
+        Fu.MUL: (1, 2),
+        Fu.BRANCH: (1, 1),
+        Fu.LDU: (1, 2),
+        Fu.STU: (1, 2),
+    }
+
+    def __init__(self, spec=""):
+        self.units = {fu: [count, latency, True]
+            for fu, (count, latency) in FuPool.defaults.items()}
+        for item in filter(None, spec.split(",")):
+            fields = item.split(":")
+            if len(fields) not in [3, 4] or fields[0] not in Fu.__members__:
+                raise ValueError(f"bad functional unit spec: {item}")
+            if len(fields) == 4 and fields[3] != "np":
+                raise ValueError(f"bad functional unit spec: {item}")
+            self.units[Fu[fields[0]]] = \
+                [int(fields[1]), int(fields[2]), len(fields) == 3]
+        # Remaining busy cycles of the units in use
+        self.busy = {fu: [] for fu in Fu}
+
+    def is_ready(self, fu):
+        return len(self.busy[fu]) < self.units[fu][0]
+
+    def is_ready_for(self, instr):
+        return self.is_ready(to_fu(instr))
+
+    def issue(self, instr):
+        fu = to_fu(instr)
+        _, latency, pipelined = self.units[fu]
+        self.busy[fu].append(1 if pipelined else latency)
+
+    def cycle(self):
+        for fu, busy in self.busy.items():
+            self.busy[fu] = [cycles - 1 for cycles in busy if cycles > 1]
+
+    def duration(self, instr):
+        "Number of cycles to execute the instruction, without cache misses"
+        return self.units[to_fu(instr)][1]
+
 class Model:
     """Models the scheduling of CVA6"""
 
-    re_instr = re.compile(
-        r"([a-z]+)\s+0:\s*0x0*([0-9a-f]+)\s*\(([0-9a-fx]+)\)\s*(@\s*[0-9]+)?\s*(.*)"
-    )
-
     def __init__(
             self,
             debug=False,
@@ -358,31 +400,84 @@ class Model:
             sb_len=8,
             fetch_size=None,
             has_forwarding=True,
-            has_renaming=True):
-        self.ras = Ras(debug=debug)
-        self.bht = Bht()
-        self.instr_queue = []
-        self.scoreboard = []
-        self.fus = FusBusy(issue > 1)
+            has_renaming=True,
+            bht_entries=128,
+            predictor="bimodal",
+            history_bits=8,
+            btb_entries=0,
+            btb_ways=2,
+            icache=None,
+            dcache=None,
+            scheduler="in-order",
+            issue_window=4,
+            fus=None):
+        if debug is True:
+            debug = DebugTrace()
+        self.debug = debug or None
+        self.ras = Ras(debug=self.debug)
+        self.bht = make_predictor(predictor, bht_entries, history_bits)
+        self.btb = Btb(btb_entries, btb_ways) if btb_entries else None
+        self.branch_stats = PredictionStats()
+        self.jump_stats = PredictionStats()
+        self.icache = make_cache(icache)
+        self.dcache = make_cache(dcache)
+        self.fetch_line = None
+        self.instr_queue = deque()
+        self.scoreboard = deque(maxlen=sb_len)
+        self.fus = FusBusy(issue > 1) if fus is None else FuPool(fus)
+        self.scheduler = make_scheduler(scheduler, issue_window)
         self.last_issued = None
         self.last_committed = None
         self.retired = []
         self.sb_len = sb_len
-        self.debug = debug
-        self.iqlen = IqLen(fetch_size or 4 * issue, debug)
+        self.fetch_size = fetch_size
         self.issue_width = issue
+        self.iqlen = self._new_iqlen()
         self.commit_width = commit
         self.has_forwarding = has_forwarding
         self.has_renaming = has_renaming
-        self.log = []
+        self.log = EventLog()
+        self.n_queued = 0
+        self.n_retired = 0
+        self.source = None
+        self.window = 0
+        self.on_retire = None
+        self.on_events = None
+        self.event_flush = None
+
+    def _new_iqlen(self):
+        "Instruction queue fetching `fetch_size` bytes, or 4 per issue"
+        return IqLen(self.fetch_size or 4 * self.issue_width, self.debug)
+
+    def set_issue_width(self, issue):
+        """
+        Change the issue width and what depends on it: the second ALU of the
+        default units and the fetch size, unless it was given
+        The instruction queue restarts full, as after a reset.
+        """
+        self.issue_width = issue
+        if isinstance(self.fus, FusBusy):
+            self.fus.has_alu2 = issue > 1
+        stalled = self.iqlen.stalled
+        self.iqlen = self._new_iqlen()
+        self.iqlen.stalled = stalled
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Given again to `stream` when restoring a checkpoint
+        state["source"] = None
+        state["on_retire"] = None
+        state["on_events"] = None
+        return state
 
     def log_event_on(self, instr, kind, cycle):
         """Log an event on the instruction"""
-        if self.debug:
-            print(f"{instr}: {kind}")
-        event = Event(kind, cycle)
-        instr.events.append(event)
-        self.log.append((event, instr))
+        if self.debug is not None:
+            self.debug.log("events", "%s: %s", (instr, kind))
+        row = self.log.append(instr.index, kind.value, cycle)
+        if instr.first_row is None:
+            instr.first_row = row
+        instr.event_mask |= 1 << kind.value
 
     def predict_branch(self, instr):
         """Predict if branch is taken or not"""
@@ -395,7 +490,9 @@ class Model:
         """Predict destination address of indirect jump"""
         if instr.is_ret():
             return self.ras.read() or 0
-        return 0 # always miss, as there is no btb yet
+        if self.btb is not None:
+            return self.btb.predict(instr.address) or 0
+        return 0 # always miss when there is no btb
 
     def predict_pc(self, last):
         """Predict next program counter depending on last issued instruction"""
@@ -417,8 +514,14 @@ class Model:
                 resolved = cycle >= self.last_issued.issue_cycle + 6
                 if bmiss and not resolved:
                     self.iqlen.flush()
+                if not self.last_issued.recorded:
+                    # instr can stall, the prediction is then made again
+                    self.last_issued.recorded = True
+                    stats = self.branch_stats if last.is_branch() \
+                        else self.jump_stats
+                    stats.record(last.address, not bmiss)
                 branch = EventKind.BMISS if bmiss else EventKind.BHIT
-                if branch not in [e.kind for e in instr.events]:
+                if not instr.has_event(branch):
                     self.log_event_on(instr, branch, cycle)
                     taken = instr.address != last.next_addr()
                     if taken and not bmiss:
@@ -432,6 +535,8 @@ class Model:
             if last.is_branch():
                 taken = instr.address != last.next_addr()
                 self.bht.resolve(last.address, taken)
+            if last.is_regjump() and not last.is_ret() and self.btb is not None:
+                self.btb.resolve(last.address, instr.address)
         self.last_committed = instr
 
     def find_data_hazards(self, instr, cycle):
@@ -447,6 +552,32 @@ class Model:
                 found = True
         return found
 
+    def fetch_from_icache(self, instr, cycle):
+        """Look up the I-cache when reaching a new line, stall fetch on miss"""
+        line = self.icache.line(instr.address)
+        if line == self.fetch_line:
+            return
+        self.fetch_line = line
+        hit, latency = self.icache.access(instr.address)
+        if not hit:
+            self.log_event_on(instr, EventKind.IMISS, cycle)
+            self.iqlen.flush()
+            self.iqlen.stall(latency)
+
+    def duration(self, instr, cycle):
+        """Number of cycles to execute an instruction issued at this cycle"""
+        duration = self.fus.duration(instr)
+        if instr.is_load() or instr.is_store():
+            if self.dcache is not None and instr.mem_addr is not None:
+                hit, latency = self.dcache.access(
+                    instr.mem_addr, instr.is_store())
+                if not hit:
+                    self.log_event_on(instr, EventKind.DMISS, cycle)
+                # Stores wait in the store buffer, they do not stall
+                if instr.is_load():
+                    duration += latency
+        return duration
+
     def find_structural_hazard(self, instr, cycle):
         """Detect and log structural hazards"""
         if not self.fus.is_ready_for(instr):
@@ -465,29 +596,84 @@ class Model:
         if self.find_structural_hazard(instr, cycle):
             can_issue = False
         self.issue_manage_last_branch(instr, cycle)
+        if self.icache is not None:
+            self.fetch_from_icache(instr, cycle)
         if not self.iqlen.has(instr):
             can_issue = False
         if can_issue:
             self.iqlen.remove(instr)
-            instr = self.instr_queue.pop(0)
+            instr = self.instr_queue.popleft()
             self.log_event_on(instr, EventKind.issue, cycle)
-            entry = Entry(instr)
+            entry = Entry(instr, duration=self.duration(instr, cycle))
             self.scoreboard.append(entry)
             self.fus.issue(instr)
+            if self.debug is not None:
+                self.debug.log("fus", "%s to %s", (instr, to_fu(instr).name))
             self.last_issued = LastIssue(instr, cycle)
             self.ras.resolve(instr)
 
+    def try_dispatch(self, cycle):
+        """
+        Move the head of the instruction queue to the scoreboard, without
+        starting its execution (see `try_start`)
+        """
+        if len(self.instr_queue) == 0 or len(self.scoreboard) >= self.sb_len:
+            return False
+        instr = self.instr_queue[0]
+        self.issue_manage_last_branch(instr, cycle)
+        if self.icache is not None:
+            self.fetch_from_icache(instr, cycle)
+        if not self.iqlen.has(instr):
+            return False
+        self.iqlen.remove(instr)
+        instr = self.instr_queue.popleft()
+        self.log_event_on(instr, EventKind.issue, cycle)
+        self.scoreboard.append(Entry(instr, started=False))
+        self.last_issued = LastIssue(instr, cycle)
+        self.ras.resolve(instr)
+        return True
+
+    def try_start(self, entry, cycle, has_renaming):
+        """Start the execution of a dispatched instruction if it is ready"""
+        instr = entry.instr
+        can_start = True
+        for older in self.scoreboard:
+            if older is entry:
+                break
+            if instr.has_WAW_from(older.instr) and not has_renaming \
+                    and not older.done:
+                self.log_event_on(instr, EventKind.WAW, cycle)
+                can_start = False
+            can_forward = self.has_forwarding and older.done
+            if instr.has_RAW_from(older.instr) and not can_forward:
+                self.log_event_on(instr, EventKind.RAW, cycle)
+                can_start = False
+            # Memory accesses start in order
+            if not older.started and (instr.is_load() or instr.is_store()) \
+                    and (older.instr.is_load() or older.instr.is_store()):
+                can_start = False
+        if self.find_structural_hazard(instr, cycle):
+            can_start = False
+        if can_start:
+            entry.started = True
+            entry.duration = self.duration(instr, cycle)
+            self.fus.issue(instr)
+            if self.debug is not None:
+                self.debug.log("fus", "%s to %s", (instr, to_fu(instr).name))
+        return can_start
+
+    def n_waiting(self):
+        """Number of dispatched instructions which have not started"""
+        return sum(1 for entry in self.scoreboard if not entry.started)
+
     def try_execute(self, cycle):
         """Try to execute instructions"""
         for entry in self.scoreboard:
+            if not entry.started:
+                continue
             entry.cycles_since_issue += 1
             instr = entry.instr
-            duration = 1
-            if instr.is_load() or instr.is_store():
-                duration = 2
-            if instr.is_muldiv():
-                duration = 2
-            if entry.cycles_since_issue == duration:
+            if entry.cycles_since_issue == entry.duration:
                 self.log_event_on(instr, EventKind.done, cycle)
                 entry.done = True
 
@@ -503,68 +689,165 @@ class Model:
         if not entry.done:
             can_commit = False
         if can_commit:
-            instr = self.scoreboard.pop(0).instr
+            instr = self.scoreboard.popleft().instr
             self.log_event_on(instr, EventKind.commit, cycle)
-            self.retired.append(instr)
+            self.n_retired += 1
+            if self.on_retire is None:
+                self.retired.append(instr)
+            else:
+                self.on_retire(instr)
             self.commit_manage_last_branch(instr, cycle)
 
     def run_cycle(self, cycle):
         """Runs a cycle"""
+        if self.debug is not None:
+            self.debug.set_cycle(cycle)
         self.fus.cycle()
         for commit_port in range(self.commit_width):
             self.try_commit(cycle, commit_port)
         self.try_execute(cycle)
-        for _ in range(self.issue_width):
-            self.try_issue(cycle)
+        self.scheduler.issue(self, cycle)
         self.iqlen.fetch()
 
-    def load_file(self, path):
+    def warm_up(self, instr):
+        """Train the predictors, the RAS and the caches, without timing"""
+        self.commit_manage_last_branch(instr, None)
+        self.ras.resolve(instr)
+        if self.icache is not None:
+            line = self.icache.line(instr.address)
+            if line != self.fetch_line:
+                self.fetch_line = line
+                self.icache.access(instr.address)
+        if self.dcache is not None and instr.mem_addr is not None:
+            if instr.is_load() or instr.is_store():
+                self.dcache.access(instr.mem_addr, instr.is_store())
+
+    def push(self, instr):
+        """Add an instruction at the end of the instruction queue"""
+        instr.index = self.n_queued
+        instr.log = self.log
+        self.n_queued += 1
+        self.instr_queue.append(instr)
+
+    def load_file(self, path, xlen=32):
         """Fill a model from a trace file"""
-        with open(path, "r", encoding="utf8") as file:
-            for line in [l.strip() for l in file]:
-                found = Model.re_instr.search(line)
-                if found:
-                    address = found.group(2)
-                    hex_code = found.group(3)
-                    mnemo = found.group(5)
-                    instr = Instruction(line, address, hex_code, mnemo)
-                    self.instr_queue.append(instr)
-
-    def run(self, cycles=None):
-        """Run until completion"""
-        cycle = 0
+        for instr in read_trace(path, xlen):
+            self.push(instr)
+
+    def stream(self, instructions, on_retire, window=64, on_events=None):
+        """
+        Feed the model from an iterable instead of filling it up front
+        Only `window` instructions are waiting to be issued at a time.
+        Retired instructions are given to `on_retire` instead of being kept.
+        Events of retired instructions are regularly dropped from the log,
+        after being given to `on_events` as (index, kind, cycle) columns.
+        """
+        assert window >= self.issue_width
+        self.source = iter(instructions)
+        self.window = window
+        self.on_retire = on_retire
+        self.on_events = on_events
+        self.event_flush = self.log.capacity // 2
+
+    def flush_events(self):
+        """Drop the events of retired instructions from the log"""
+        columns = self.log.drop_until(self.n_retired - 1)
+        if self.on_events is not None:
+            self.on_events(*columns)
+
+    def refill(self):
+        """Fill the fetch window from the streamed instructions"""
+        if self.source is None:
+            return
+        while len(self.instr_queue) < self.window:
+            instr = next(self.source, None)
+            if instr is None:
+                self.source = None
+                return
+            self.push(instr)
+
+    def run(self, cycles=None, start_cycle=0, max_retired=None):
+        """
+        Run until completion, or until `max_retired` instructions are retired
+        Returns the number of the next cycle to run.
+        """
+        cycle = start_cycle
+        self.refill()
         while len(self.instr_queue) > 0 or len(self.scoreboard) > 0:
             self.run_cycle(cycle)
-            if self.debug:
-                print(f"Scoreboard @{cycle}")
+            if self.debug is not None:
                 for entry in self.scoreboard:
-                    print(f"    {entry}")
-                print(f"iqlen = {self.iqlen.len}")
-                print()
+                    self.debug.log("scoreboard", "%s", (entry,))
+                self.debug.log("iq", "iqlen = %d", (self.iqlen.len,))
             cycle += 1
 
             if cycles is not None and cycle > cycles:
                 break
+            if max_retired is not None and self.n_retired >= max_retired:
+                break
+            self.refill()
+            if self.event_flush is not None \
+                    and len(self.log) >= self.event_flush:
+                self.flush_events()
+        if self.event_flush is not None:
+            self.flush_events()
         return cycle
 
-def write_trace(output_file, instructions):
-    """Write cycle-annotated trace"""
-    pattern = re.compile(r"\)\s*(@\s*[0-9]+)? ")
-
-    lines = []
-    for instr in instructions:
-        commit_event = instr.events[-1]
-        assert commit_event.kind == EventKind.commit
-        cycle = commit_event.cycle
-        annotated = re.sub(pattern, f") @ {cycle} ", instr.line)
+def scan_trace(path):
+    """
+    Generate (found, mem_addr) for each instruction of a trace file
+    `found` is the `rvfi.TraceLine` of the instruction line.
+    `mem_addr` is the memory address found on the following lines
+    (written by the RVFI tracer for loads and stores), None if there is none.
+    """
+    return scan(path)
+
+def parse_trace(path):
+    """
+    Generate the (line, address, hex_code, mnemo, mem_addr) tuples of a trace
+    These are the arguments of `Instruction`, they can be pickled
+    """
+    for found, mem_addr in scan(path):
+        yield found.line, found.address, found.hex_code, found.mnemo, mem_addr
+
+def read_trace(path, xlen=32):
+    """
+    Generate the instructions of a trace file, one line at a time
+    `xlen` selects the RV32 or RV64 decoding of compressed instructions.
+    """
+    from bintrace import BinaryTrace, is_binary_trace # pylint: disable=import-outside-toplevel
+    if is_binary_trace(path):
+        yield from BinaryTrace(path).instructions(xlen=xlen)
+        return
+    for fields in parse_trace(path):
+        yield Instruction(*fields, xlen=xlen)
+
+class TraceWriter:
+    """Writes cycle-annotated trace lines as instructions retire"""
+
+    def __init__(self, file):
+        self.file = file
+
+    def write(self, instr, cycle=None):
+        """Write the annotated line of a retired instruction"""
+        if cycle is None:
+            commit_event = instr.events[-1]
+            assert commit_event.kind == EventKind.commit
+            cycle = commit_event.cycle
+        annotated = annotate(instr.line, cycle)
         #if EventKind.STRUCT in [e.kind for e in instr.events]:
         #    annotated += " #STRUCT"
         #if EventKind.RAW in [e.kind for e in instr.events]:
         #    annotated += " #RAW"
-        lines.append(f"{annotated}\n")
+        self.file.write(f"{annotated}\n")
 
+def write_trace(output_file, instructions):
+    """Write cycle-annotated trace"""
+    cycles = commit_cycles(*instructions[0].log.columns()) if instructions else {}
     with open(output_file, 'w') as f:
-        f.writelines(lines)
+        writer = TraceWriter(f)
+        for instr in instructions:
+            writer.write(instr, cycles[instr.index])
 
 def print_data(name, value, ts=24, sep='='):
     "Prints 'name = data' with alignment of the '='"
@@ -598,6 +881,7 @@ def display_scores(scores):
 
 def issue_commit_graph(input_file, n = 3):
     """Plot the issue/commit graph"""
+    from sweep import sweep # pylint: disable=import-outside-toplevel
 
     r = range(n + 1)
     scores = [[0 for _ in r] for _ in r]
@@ -605,30 +889,35 @@ def issue_commit_graph(input_file, n = 3):
     if input_file is None:
         scores = [[0, 0, 0, 0, 0, 0], [0, 2.651936045910317, 2.651936045910317, 2.651936045910317, 2.651936045910317, 2.651936045910317], [0, 3.212779150348426, 3.6292766488711137, 3.6292766488711137, 3.6292766488711137, 3.6292766488711137], [0, 3.2550388000624966, 3.900216852056974, 3.914997572701505, 3.914997572701505, 3.914997572701505], [0, 3.2596436557555526, 3.9257869239889134, 3.9420984578510834, 3.9421606193922765, 3.9421606193922765], [0, 3.260695897718491, 3.944757614368385, 3.9623576027736505, 3.9625460150656, 3.9625460150656]] # pylint: disable=line-too-long
     else:
-        r = range(1, n + 1)
-        for issue in r:
-            for commit in r:
-                print("running", issue, commit)
-                model = Model(issue=issue, commit=commit)
-                model.load_file(input_file)
-                model.run()
-                n_cycles = count_cycles(filter_timed_part(model.retired))
-                score = 1000000 / n_cycles
-                scores[issue][commit] = score
+        r = list(range(1, n + 1))
+        rows = sweep(input_file, {"issue": r, "commit": r}, timed=True)
+        for row in rows:
+            scores[row["issue"]][row["commit"]] = row["CoreMark/MHz"]
         print(scores)
     display_scores(scores)
 
+class TimedFilter:
+    "Forwards only the timed part of a stream of instructions"
+
+    re_csrr_minstret = re.compile(r"^csrr\s+\w\w,\s*minstret$")
+
+    def __init__(self, consumer):
+        self.consumer = consumer
+        self.accepting = False
+
+    def __call__(self, instr):
+        if TimedFilter.re_csrr_minstret.search(instr.mnemo):
+            self.accepting = not self.accepting
+            return
+        if self.accepting:
+            self.consumer(instr)
+
 def filter_timed_part(all_instructions):
     "Keep only timed part from a trace"
     filtered = []
-    re_csrr_minstret = re.compile(r"^csrr\s+\w\w,\s*minstret$")
-    accepting = False
+    keep = TimedFilter(filtered.append)
     for instr in all_instructions:
-        if re_csrr_minstret.search(instr.mnemo):
-            accepting = not accepting
-            continue
-        if accepting:
-            filtered.append(instr)
+        keep(instr)
     return filtered
 
 def count_cycles(retired):
@@ -636,27 +925,85 @@ def count_cycles(retired):
     end = max(e.cycle for e in retired[-1].events)
     return end - start
 
-def print_stats(instructions):
-    ecount = defaultdict(lambda: 0)
+class Stats:
+    """
+    Statistics accumulated as instructions retire
+    Instructions are selected with `add`, then their events are counted
+    when the event log columns are given to `add_events`.
+    """
+    def __init__(self):
+        self.ecount = defaultdict(lambda: 0)
+        self.n_instr = 0
+        self.runs = []
+        self.first = None
+        self.start = None
+        self.last = None
+        self.end = None
+
+    def add(self, instr):
+        "Select a retired instruction"
+        if self.runs and self.runs[-1][1] == instr.index - 1:
+            self.runs[-1][1] = instr.index
+        else:
+            self.runs.append([instr.index, instr.index])
+        self.n_instr += 1
+
+    def add_events(self, index, kind, cycle):
+        "Account for the events of selected instructions"
+        for ek, count in count_kinds(index, kind, self.runs):
+            self.ecount[ek] += count
+        span = instruction_span(index, cycle, self.runs)
+        if span is None:
+            return
+        first, start, last, end = span
+        if self.first is None or first < self.first:
+            self.first, self.start = first, start
+        if self.last is None or last > self.last:
+            self.last, self.end = last, end
+
+    def n_cycles(self):
+        "Number of cycles between the first and the last instruction"
+        return self.end - self.start
+
+    def print(self):
+        "Print the statistics"
+        n_instr = self.n_instr
+        n_cycles = self.n_cycles()
+
+        print_data("cycle number", n_cycles)
+        print_data("Coremark/MHz", 1000000 / n_cycles)
+        print_data("instruction number", n_instr)
+        for ek, count in self.ecount.items():
+            print_data(f"{ek}/instr", f"{100 * count / n_instr:.2f}%")
 
+def print_stats(instructions):
+    stats = Stats()
     for instr in instructions:
-        for e in instr.events:
-            ecount[e.kind] += 1
-            cycle = e.cycle
-    n_instr = len(instructions)
-    n_cycles = count_cycles(instructions)
-
-    print_data("cycle number", n_cycles)
-    print_data("Coremark/MHz", 1000000 / n_cycles)
-    print_data("instruction number", n_instr)
-    for ek, count in ecount.items():
-        print_data(f"{ek}/instr", f"{100 * count / n_instr:.2f}%")
-
-def main(input_file: str):
+        stats.add(instr)
+    stats.add_events(*instructions[0].log.columns())
+    stats.print()
+
+def main(input_file: str, stream=False, debug=None, xlen=32):
     "Entry point"
 
-    model = Model(debug=True, issue=2, commit=2)
-    model.load_file(input_file)
+    model = Model(debug=debug, issue=2, commit=2)
+
+    if stream:
+        stats = Stats()
+        count = stats.add
+        #count = TimedFilter(stats.add)
+        with open('annotated.log', 'w') as f:
+            writer = TraceWriter(f)
+            def retire(instr):
+                writer.write(instr)
+                count(instr)
+            model.stream(read_trace(input_file, xlen), retire,
+                on_events=stats.add_events)
+            model.run()
+        stats.print()
+        return
+
+    model.load_file(input_file, xlen)
     model.run()
 
     write_trace('annotated.log', model.retired)
@@ -665,4 +1012,26 @@ def main(input_file: str):
     print_stats(model.retired)
 
 if __name__ == "__main__":
-    main(sys.argv[1])
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("input_file", help="RVFI trace")
+    parser.add_argument("--stream", action="store_true",
+        help="stream the trace instead of loading it, for large traces")
+    parser.add_argument("--xlen", type=int, choices=[32, 64], default=32,
+        help="decode the trace as RV32 or RV64 (default: %(default)s)")
+    parser.add_argument("--debug", nargs="*", choices=COMPONENTS,
+        help="print debug messages of some components (default: all)")
+    parser.add_argument("--debug-cycles", type=parse_cycles,
+        default=(None, None), metavar="FIRST:LAST",
+        help="only print debug messages in this cycle window")
+    parser.add_argument("--debug-output", metavar="FILE",
+        help="write debug messages as binary records, see debug_trace.py")
+    args = parser.parse_args()
+    binary = open(args.debug_output, "wb") if args.debug_output else None
+    debug = None
+    if args.debug is not None or binary is not None:
+        debug = DebugTrace(args.debug or None, args.debug_cycles, binary=binary)
+    try:
+        main(args.input_file, args.stream, debug, args.xlen)
+    finally:
+        if binary is not None:
+            binary.close()
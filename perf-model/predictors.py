@@ -0,0 +1,324 @@
+# Copyright 2024 Thales Silicon Security
+#
+# Licensed under the Solderpad Hardware Licence, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# SPDX-License-Identifier: Apache-2.0 WITH SHL-2.0
+# You may obtain a copy of the License at https://solderpad.org/licenses/
+#
+# Original Author: Côme ALLART - Thales
+
+"""
+Branch predictors of the performance model
+
+Direction predictors have a `predict(addr)` method which tells if the
+branch is taken (None if they don't know) and a `resolve(addr, taken)`
+method called when the branch commits. The BTB predicts the target of
+indirect jumps with `predict(addr)` and `resolve(addr, target)`.
+
+Global histories are updated when branches are resolved: the model does
+not keep a speculative history.
+"""
+
+import argparse
+import sys
+
+from collections import defaultdict, OrderedDict
+from dataclasses import dataclass
+
+def _index(addr, entries):
+    return (addr >> 1) % entries
+
+def _update_counter(counter, taken, maximum=3):
+    if taken:
+        return min(counter + 1, maximum)
+    return max(counter - 1, 0)
+
+class Bht:
+    "Branch History Table, bimodal predictor"
+
+    @dataclass
+    class Entry:
+        "A BTB entry"
+        valid: bool = False
+        sat_counter: int = 0
+
+    def __init__(self, entries=128):
+        self.contents = [Bht.Entry() for _ in range(entries)]
+
+    def predict(self, addr):
+        "Is the branch taken? None if don't know"
+        entry = self.contents[self._index(addr)]
+        if entry.valid:
+            return entry.sat_counter >= 2
+        return None
+
+    def resolve(self, addr, taken):
+        "Update branch prediction"
+        index = self._index(addr)
+        entry = self.contents[index]
+        entry.valid = True
+        if taken:
+            if entry.sat_counter < 3:
+                entry.sat_counter += 1
+        else:
+            if entry.sat_counter > 0:
+                entry.sat_counter -= 1
+
+    def _index(self, addr):
+        return (addr >> 1) % len(self.contents)
+
+class Gshare(Bht):
+    "Bimodal table indexed with the PC xor the global history"
+
+    def __init__(self, entries=128, history_bits=8):
+        Bht.__init__(self, entries)
+        self.history_bits = history_bits
+        self.history = 0
+
+    def resolve(self, addr, taken):
+        "Update branch prediction and global history"
+        Bht.resolve(self, addr, taken)
+        mask = (1 << self.history_bits) - 1
+        self.history = ((self.history << 1) | int(taken)) & mask
+
+    def _index(self, addr):
+        return ((addr >> 1) ^ self.history) % len(self.contents)
+
+class Tournament:
+    "Chooses between a bimodal and a gshare predictor with a table of counters"
+
+    def __init__(self, entries=128, history_bits=8):
+        self.local = Bht(entries)
+        self.globl = Gshare(entries, history_bits)
+        self.chooser = [1] * entries
+        # chooser >= 2: use the global predictor
+
+    def predict(self, addr):
+        "Is the branch taken? None if don't know"
+        if self.chooser[_index(addr, len(self.chooser))] >= 2:
+            first, second = self.globl, self.local
+        else:
+            first, second = self.local, self.globl
+        pred = first.predict(addr)
+        return pred if pred is not None else second.predict(addr)
+
+    def resolve(self, addr, taken):
+        "Update both predictors and the chooser"
+        local = self.local.predict(addr)
+        globl = self.globl.predict(addr)
+        if local is not None and globl is not None and local != globl:
+            index = _index(addr, len(self.chooser))
+            self.chooser[index] = _update_counter(
+                self.chooser[index], globl == taken)
+        self.local.resolve(addr, taken)
+        self.globl.resolve(addr, taken)
+
+class Tage:
+    """
+    Small TAGE predictor: a bimodal base predictor and tagged tables
+    indexed with geometrically increasing global history lengths
+    """
+
+    @dataclass
+    class Entry:
+        "A tagged entry"
+        tag: int = -1
+        counter: int = 4
+        useful: int = 0
+
+    def __init__(self, entries=128, history_lengths=(4, 8, 16, 32), tag_bits=8):
+        self.base = Bht(entries)
+        self.index_bits = max(1, (entries - 1).bit_length())
+        self.history_lengths = history_lengths
+        self.tag_bits = tag_bits
+        self.tables = [
+            [Tage.Entry() for _ in range(1 << self.index_bits)]
+            for _ in history_lengths
+        ]
+        self.history = 0
+
+    def _fold(self, length, bits):
+        history = self.history & ((1 << length) - 1)
+        folded = 0
+        while history:
+            folded ^= history & ((1 << bits) - 1)
+            history >>= bits
+        return folded
+
+    def _index(self, addr, table):
+        fold = self._fold(self.history_lengths[table], self.index_bits)
+        return ((addr >> 1) ^ fold ^ table) & ((1 << self.index_bits) - 1)
+
+    def _tag(self, addr, table):
+        fold = self._fold(self.history_lengths[table], self.tag_bits)
+        return ((addr >> 1) ^ (fold << 1) ^ fold) & ((1 << self.tag_bits) - 1)
+
+    def _provider(self, addr):
+        "Longest matching table, and its entry"
+        for table in reversed(range(len(self.tables))):
+            entry = self.tables[table][self._index(addr, table)]
+            if entry.tag == self._tag(addr, table):
+                return table, entry
+        return None, None
+
+    def predict(self, addr):
+        "Is the branch taken? None if don't know"
+        _, entry = self._provider(addr)
+        if entry is not None:
+            return entry.counter >= 4
+        return self.base.predict(addr)
+
+    def resolve(self, addr, taken):
+        "Update the provider, allocate a longer entry on misprediction"
+        table, entry = self._provider(addr)
+        if entry is None:
+            pred = self.base.predict(addr)
+            self.base.resolve(addr, taken)
+        else:
+            pred = entry.counter >= 4
+            alt = self.base.predict(addr)
+            if pred != alt:
+                entry.useful = _update_counter(entry.useful, pred == taken)
+            entry.counter = _update_counter(entry.counter, taken, 7)
+        if pred != taken:
+            self._allocate(addr, taken, -1 if table is None else table)
+        self.history = (self.history << 1) | int(taken)
+        self.history &= (1 << max(self.history_lengths)) - 1
+
+    def _allocate(self, addr, taken, provider):
+        for table in range(provider + 1, len(self.tables)):
+            entry = self.tables[table][self._index(addr, table)]
+            if entry.useful == 0:
+                entry.tag = self._tag(addr, table)
+                entry.counter = 4 if taken else 3
+                return
+        for table in range(provider + 1, len(self.tables)):
+            entry = self.tables[table][self._index(addr, table)]
+            entry.useful = max(entry.useful - 1, 0)
+
+class Btb:
+    "Set-associative Branch Target Buffer with LRU replacement"
+
+    def __init__(self, entries=32, ways=2):
+        assert entries % ways == 0
+        self.sets = [OrderedDict() for _ in range(entries // ways)]
+        self.ways = ways
+
+    def _set(self, addr):
+        return self.sets[_index(addr, len(self.sets))]
+
+    def predict(self, addr):
+        "Predicted target address, None if unknown"
+        entries = self._set(addr)
+        target = entries.get(addr)
+        if target is not None:
+            entries.move_to_end(addr)
+        return target
+
+    def resolve(self, addr, target):
+        "Record the actual target of the jump"
+        entries = self._set(addr)
+        entries[addr] = target
+        entries.move_to_end(addr)
+        if len(entries) > self.ways:
+            entries.popitem(last=False)
+
+PREDICTORS = {
+    "bimodal": lambda entries, history_bits: Bht(entries),
+    "gshare": Gshare,
+    "tournament": Tournament,
+    "tage": lambda entries, history_bits:
+        Tage(entries, tage_history_lengths(history_bits)),
+}
+
+def tage_history_lengths(history_bits):
+    """
+    History lengths of the tagged tables of TAGE: half, once, twice and four
+    times `history_bits`, (4, 8, 16, 32) by default
+    """
+    return tuple(max(1, history_bits << i >> 1) for i in range(4))
+
+def make_predictor(name, entries=128, history_bits=8):
+    "Build a direction predictor from its name"
+    return PREDICTORS[name](entries, history_bits)
+
+class PredictionStats:
+    "Hits and misses of predictions, by PC"
+
+    def __init__(self):
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+
+    def record(self, addr, hit):
+        "Record the outcome of a prediction"
+        if hit:
+            self.hits[addr] += 1
+        else:
+            self.misses[addr] += 1
+
+    def n_predictions(self):
+        "Number of predictions"
+        return sum(self.hits.values()) + sum(self.misses.values())
+
+    def n_misses(self):
+        "Number of mispredictions"
+        return sum(self.misses.values())
+
+    def accuracy(self):
+        "Ratio of correct predictions"
+        total = self.n_predictions()
+        return (total - self.n_misses()) / total if total else 1.
+
+    def mpki(self, n_instr):
+        "Mispredictions per thousand instructions"
+        return 1000 * self.n_misses() / n_instr
+
+    def print(self, n_instr, top=20):
+        "Print the global figures and the PCs with the most misses"
+        print(f"predictions = {self.n_predictions()}")
+        print(f"accuracy    = {100 * self.accuracy():.2f}%")
+        print(f"MPKI        = {self.mpki(n_instr):.3f}")
+        worst = sorted(self.misses, key=self.misses.get, reverse=True)[:top]
+        print(f"{'PC':>18} {'count':>9} {'misses':>9} {'accuracy':>9}")
+        for addr in worst:
+            misses = self.misses[addr]
+            total = misses + self.hits[addr]
+            print(f"0x{addr:016x} {total:>9} {misses:>9}"
+                f" {100 * (total - misses) / total:>8.2f}%")
+
+def main(argv):
+    "Entry point: report prediction accuracy for a trace"
+    from model import Model # pylint: disable=import-outside-toplevel
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input_file", help="RVFI trace")
+    parser.add_argument("--predictor", choices=list(PREDICTORS), default="bimodal")
+    parser.add_argument("--bht-entries", type=int, default=128)
+    parser.add_argument("--history-bits", type=int, default=8)
+    parser.add_argument("--btb-entries", type=int, default=0)
+    parser.add_argument("--btb-ways", type=int, default=2)
+    parser.add_argument("--top", type=int, default=20,
+        help="number of PCs to list")
+    parser.add_argument("--xlen", type=int, choices=[32, 64], default=32,
+        help="decode the trace as RV32 or RV64 (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    model = Model(
+        issue=2,
+        commit=2,
+        predictor=args.predictor,
+        bht_entries=args.bht_entries,
+        history_bits=args.history_bits,
+        btb_entries=args.btb_entries,
+        btb_ways=args.btb_ways)
+    model.load_file(args.input_file, args.xlen)
+    model.run()
+    n_instr = len(model.retired)
+    print("branches")
+    model.branch_stats.print(n_instr, args.top)
+    print()
+    print("indirect jumps")
+    model.jump_stats.print(n_instr, args.top)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,193 @@
+# Copyright 2024 Thales Silicon Security
+#
+# Licensed under the Solderpad Hardware Licence, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# SPDX-License-Identifier: Apache-2.0 WITH SHL-2.0
+# You may obtain a copy of the License at https://solderpad.org/licenses/
+#
+# Original Author: Côme ALLART - Thales
+
+"""
+Reader of RVFI traces
+
+An instruction line looks like
+
+    core   0: 0x0000000080000000 (0x00000297) @ 12 auipc t0, 0x0
+
+The address has 32 or 64 bits, the cycle (`@ 12`) is optional and can be
+preceded by flags (`X@ 12`). The following lines of a load or store give
+its memory address (`mem 0x...`).
+
+Usual lines are parsed by a regular expression anchored at the start of
+the line, which fails at the first character of the other lines. Lines
+with text before the core, or flags before the cycle, are split into
+fields. Run this script on a trace to compare its speed and results with
+the previous parser, an unanchored regular expression (`re_instr`).
+
+Annotated traces are written by splicing the cycle into the line.
+"""
+
+import re
+import sys
+import time
+
+from typing import NamedTuple, Optional
+
+# Instruction line starting with the core, the common case
+re_line = re.compile(
+    r"[a-z]+\s+0:\s*0x0*([0-9a-f]+)\s*\(([0-9a-fx]+)\)\s*(?:([^\s@]*)@\s*([0-9]+))?\s*(.*)"
+)
+# Previous parser of an instruction line, for comparison
+re_instr = re.compile(
+    r"([a-z]+)\s+0:\s*0x0*([0-9a-f]+)\s*\(([0-9a-fx]+)\)\s*(@\s*[0-9]+)?\s*(.*)"
+)
+re_mem = re.compile(r"\smem\s+0x([0-9a-f]+)")
+re_cycle = re.compile(r"\)\s*(@\s*[0-9]+)? ")
+re_flags_cycle = re.compile(r"([^\s@]*)@\s*[0-9]+\s*")
+
+_HEX = frozenset("0123456789abcdefABCDEF")
+
+class TraceLine(NamedTuple):
+    """Fields of an instruction line"""
+    line: str # stripped
+    address: str # hexadecimal, without 0x
+    hex_code: str # with 0x, as in the trace
+    cycle: Optional[int]
+    mnemo: str
+    flags: str = ""
+
+def _is_hex(text):
+    return text != "" and _HEX.issuperset(text)
+
+def parse_line(line):
+    "Fields of a stripped instruction line, None if it is not one"
+    found = re_line.match(line)
+    if found is not None:
+        address, hex_code, flags, cycle, mnemo = found.groups()
+        return TraceLine(line, address, hex_code, cycle and int(cycle), mnemo,
+            flags or "")
+    if " 0:" not in line:
+        return None
+    return _parse_line_slow(line)
+
+def _parse_line_slow(line):
+    "Split an unusual instruction line: text before the core, flags"
+    pos = line.find(" 0:")
+    if pos <= 0:
+        return None
+    prefix = line[:pos].rstrip()
+    if not prefix or not "a" <= prefix[-1] <= "z":
+        return None
+    rest = line[pos + 3:].lstrip()
+    if not rest.startswith("0x"):
+        return None
+    open_paren = rest.find("(")
+    close = rest.find(")", open_paren)
+    if open_paren < 0 or close < 0:
+        return None
+    address = rest[2:open_paren].rstrip().lstrip("0") or "0"
+    hex_code = rest[open_paren + 1:close]
+    if not _is_hex(address) or not _is_hex(hex_code.replace("x", "")):
+        return None
+    tail = rest[close + 1:].lstrip()
+    cycle = None
+    flags = ""
+    at = tail.find("@")
+    if at >= 0 and " " not in tail[:at]:
+        digits = tail[at + 1:].lstrip()
+        end = 0
+        while end < len(digits) and digits[end].isdigit():
+            end += 1
+        if end > 0:
+            flags = tail[:at]
+            cycle = int(digits[:end])
+            tail = digits[end:].lstrip()
+    return TraceLine(line, address, hex_code, cycle, tail, flags)
+
+def parse_mem(line):
+    "Memory address of a line following a load or store, None if none"
+    found = re_mem.search(line)
+    return None if found is None else int(found.group(1), 16)
+
+def scan(path):
+    """
+    Generate (TraceLine, mem_addr) for each instruction of a trace file
+    `mem_addr` is the memory address found on the following lines, None if
+    there is none.
+    """
+    found = None
+    mem_addr = None
+    with open(path, "r", encoding="utf8") as file:
+        for line in file:
+            line = line.strip()
+            next_found = parse_line(line)
+            if next_found:
+                if found:
+                    yield found, mem_addr
+                found = next_found
+                mem_addr = None
+            elif found and " mem " in line:
+                mem = parse_mem(line)
+                if mem is not None:
+                    mem_addr = mem
+    if found:
+        yield found, mem_addr
+
+def scan_regex(path):
+    "Same as `scan`, with the regular expressions, for comparison"
+    found = None
+    mem_addr = None
+    with open(path, "r", encoding="utf8") as file:
+        for line in file:
+            line = line.strip()
+            match = re_instr.search(line)
+            if match:
+                if found:
+                    yield found, mem_addr
+                cycle = match.group(4)
+                found = TraceLine(line, match.group(2), match.group(3),
+                    None if cycle is None else int(cycle[1:]),
+                    match.group(5))
+                mem_addr = None
+            elif found and " mem " in line:
+                mem = re_mem.search(line)
+                if mem:
+                    mem_addr = int(mem.group(1), base=16)
+    if found:
+        yield found, mem_addr
+
+def annotate(line, cycle):
+    "Set the cycle of an instruction line, keeping its flags"
+    close = line.find(")")
+    tail = line[close + 1:].lstrip()
+    flags = ""
+    found = re_flags_cycle.match(tail)
+    if found is not None:
+        flags = found.group(1)
+        tail = tail[found.end():]
+    return f"{line[:close + 1]} {flags}@ {cycle} {tail}"
+
+def benchmark(path):
+    "Compare the speed and the results of `scan` and `scan_regex`"
+    results = {}
+    for name, function in [("regex", scan_regex), ("rvfi", scan)]:
+        start = time.perf_counter()
+        results[name] = list(function(path))
+        print(f"{name:<8} {time.perf_counter() - start:8.3f} s"
+            f" {len(results[name])} instructions")
+    lines = [found.line for found, _ in results["rvfi"]]
+    start = time.perf_counter()
+    by_regex = [re.sub(re_cycle, ") @ 1 ", line) for line in lines]
+    print(f"{'re.sub':<8} {time.perf_counter() - start:8.3f} s")
+    start = time.perf_counter()
+    by_splice = [annotate(line, 1) for line in lines]
+    print(f"{'splice':<8} {time.perf_counter() - start:8.3f} s")
+    differences = sum(a[0][:5] != b[0][:5] or a[1] != b[1]
+        for a, b in zip(results["regex"], results["rvfi"]))
+    differences += abs(len(results["regex"]) - len(results["rvfi"]))
+    differences += sum(a != b for a, b in zip(by_regex, by_splice))
+    print(f"differences: {differences}")
+    return differences
+
+if __name__ == "__main__":
+    sys.exit(1 if benchmark(sys.argv[1]) else 0)
@@ -0,0 +1,69 @@
+# Copyright 2024 Thales Silicon Security
+#
+# Licensed under the Solderpad Hardware Licence, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# SPDX-License-Identifier: Apache-2.0 WITH SHL-2.0
+# You may obtain a copy of the License at https://solderpad.org/licenses/
+#
+# Original Author: Côme ALLART - Thales
+
+"""
+Scheduling policies of the performance model
+
+A scheduler has an `issue(model, cycle)` method, called once per cycle
+after the execution stage. All the schedulers share the front-end of the
+model (instruction queue, branch prediction, I-cache), its scoreboard as
+reorder buffer, its in-order commit and its event log.
+"""
+
+class InOrder:
+    """
+    Issues the head of the instruction queue in order, straight into the
+    scoreboard and the functional units, as CVA6 does
+    """
+
+    def issue(self, model, cycle):
+        "Issue up to `issue_width` instructions"
+        for _ in range(model.issue_width):
+            model.try_issue(cycle)
+
+class IssueWindow:
+    """
+    Dispatches instructions in order into the scoreboard, where up to `size`
+    of them wait to start their execution
+
+    In order, only the oldest waiting instructions can start. Out of order,
+    any ready instruction starts, the oldest first, and registers are
+    renamed: only RAW hazards remain. Loads and stores start in order.
+    """
+
+    def __init__(self, size=4, out_of_order=False):
+        self.size = size
+        self.out_of_order = out_of_order
+
+    def issue(self, model, cycle):
+        "Dispatch, then start up to `issue_width` instructions"
+        for _ in range(model.issue_width):
+            if model.n_waiting() >= self.size or not model.try_dispatch(cycle):
+                break
+        started = 0
+        has_renaming = model.has_renaming or self.out_of_order
+        for entry in list(model.scoreboard):
+            if started == model.issue_width:
+                break
+            if entry.started:
+                continue
+            if model.try_start(entry, cycle, has_renaming):
+                started += 1
+            elif not self.out_of_order:
+                break
+
+SCHEDULERS = {
+    "in-order": lambda size: InOrder(),
+    "window": lambda size: IssueWindow(size),
+    "ooo": lambda size: IssueWindow(size, out_of_order=True),
+}
+
+def make_scheduler(name, issue_window=4):
+    "Build a scheduler from its name"
+    return SCHEDULERS[name](issue_window)
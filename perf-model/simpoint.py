@@ -0,0 +1,244 @@
+# Copyright 2024 Thales Silicon Security
+#
+# Licensed under the Solderpad Hardware Licence, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# SPDX-License-Identifier: Apache-2.0 WITH SHL-2.0
+# You may obtain a copy of the License at https://solderpad.org/licenses/
+#
+# Original Author: Côme ALLART - Thales
+
+"""
+Sampled simulation of long traces, in the style of SimPoint
+
+The trace is split into intervals of a fixed number of instructions.
+The basic-block vector of each interval (number of instructions executed in
+each basic block) is randomly projected to a few dimensions, then the
+intervals are clustered with k-means. A few intervals of each cluster are
+simulated in detail, after a functional warm-up of the branch predictors,
+the RAS and the caches, and the CPI of the whole trace is extrapolated from
+their CPI, weighted by the size of the clusters.
+
+With two samples or more per cluster, the estimate comes with the bounds
+of a stratified sample (95% confidence).
+"""
+
+import argparse
+import math
+import random
+import sys
+
+from collections import deque
+
+from bintrace import BinaryTrace, RecordInstruction, is_binary_trace
+from model import Model, Instruction, parse_trace, read_trace
+
+def trace_records(path):
+    "Records of a trace, with the function building an instruction from one"
+    if is_binary_trace(path):
+        return BinaryTrace(path).records(), RecordInstruction
+    return parse_trace(path), Instruction
+
+def pcs_and_sizes(path):
+    "Generate (address, size) for each instruction of a trace"
+    if is_binary_trace(path):
+        for address, code, *_ in BinaryTrace(path).records():
+            yield address, 4 if code & 3 == 3 else 2
+        return
+    for _, address, hex_code, _, _ in parse_trace(path):
+        yield int(address, 16), 4 if int(hex_code, 16) & 3 == 3 else 2
+
+def basic_block_vectors(path, interval, dimensions=15, seed=0):
+    """
+    Projected basic-block vectors of the complete intervals of a trace
+    A basic block starts after a taken branch or jump. Each block gets a
+    random vector, the vector of an interval is the sum of the vectors of
+    the blocks weighted by their share of the instructions of the interval.
+    """
+    rand = random.Random(seed)
+    projections = {}
+    vectors = []
+    counts = {}
+    block = None
+    next_pc = None
+    n = 0
+    for address, size in pcs_and_sizes(path):
+        if address != next_pc:
+            block = address
+        next_pc = address + size
+        counts[block] = counts.get(block, 0) + 1
+        n += 1
+        if n == interval:
+            vector = [0.] * dimensions
+            for start, count in counts.items():
+                projection = projections.get(start)
+                if projection is None:
+                    projection = [rand.uniform(-1, 1) for _ in range(dimensions)]
+                    projections[start] = projection
+                for d in range(dimensions):
+                    vector[d] += projection[d] * count / interval
+            vectors.append(vector)
+            counts = {}
+            n = 0
+    return vectors
+
+def _distance(a, b):
+    return sum((x - y) ** 2 for x, y in zip(a, b))
+
+def kmeans(points, k, seed=0, iterations=100):
+    "Cluster points with k-means (k-means++ seeding), returns (labels, centroids)"
+    rand = random.Random(seed)
+    k = min(k, len(points))
+    centroids = [rand.choice(points)]
+    while len(centroids) < k:
+        weights = [min(_distance(p, c) for c in centroids) for p in points]
+        if sum(weights) == 0:
+            break
+        centroids.append(rand.choices(points, weights)[0])
+    labels = None
+    for _ in range(iterations):
+        new_labels = [
+            min(range(len(centroids)), key=lambda c, p=p: _distance(p, centroids[c]))
+            for p in points
+        ]
+        if new_labels == labels:
+            break
+        labels = new_labels
+        for c in range(len(centroids)):
+            members = [p for p, label in zip(points, labels) if label == c]
+            if members:
+                centroids[c] = [sum(x) / len(members) for x in zip(*members)]
+    return labels, centroids
+
+def choose_samples(vectors, clusters=10, per_cluster=2, seed=0):
+    """
+    Choose the intervals to simulate
+    Returns a list of (cluster size, [interval numbers]), the first interval of
+    each cluster is the one closest to its centroid.
+    """
+    rand = random.Random(seed)
+    labels, centroids = kmeans(vectors, clusters, seed)
+    strata = []
+    for c, centroid in enumerate(centroids):
+        members = [i for i, label in enumerate(labels) if label == c]
+        if not members:
+            continue
+        closest = min(members, key=lambda i: _distance(vectors[i], centroid))
+        others = [i for i in members if i != closest]
+        chosen = [closest] + rand.sample(others, min(per_cluster, len(members)) - 1)
+        strata.append((len(members), chosen))
+    return strata
+
+def simulate_intervals(path, starts, interval, warmup, xlen=32, **params):
+    """
+    CPI of the intervals beginning at the given instruction numbers
+    Each interval is simulated by a new model, trained on the `warmup`
+    instructions before it. The trace is read once, and decoded as RV32 or
+    RV64 according to `xlen`.
+    """
+    records, make_instruction = trace_records(path)
+    pending = deque(sorted(starts))
+    active = []
+    cpis = {}
+    for index, record in enumerate(records):
+        while pending and pending[0] - warmup <= index:
+            active.append((pending.popleft(), Model(**params)))
+        if not active:
+            if not pending:
+                break
+            continue
+        instr = make_instruction(*record, xlen=xlen)
+        for start, model in active:
+            if index < start:
+                model.warm_up(instr)
+            else:
+                model.push(instr)
+        for start, model in [job for job in active if job[0] + interval - 1 == index]:
+            cpis[start] = model.run() / interval
+            active.remove((start, model))
+    return cpis
+
+def estimate_cpi(strata, cpis):
+    """
+    Extrapolate the CPI from the CPI of the samples of each cluster
+    Returns (CPI, half width of the 95% confidence interval or None)
+    """
+    total = sum(size for size, _ in strata)
+    estimate = 0.
+    variance = 0.
+    bounded = True
+    for size, samples in strata:
+        weight = size / total
+        values = [cpis[i] for i in samples]
+        mean = sum(values) / len(values)
+        estimate += weight * mean
+        if len(values) > 1:
+            var = sum((v - mean) ** 2 for v in values) / (len(values) - 1)
+            fpc = 1 - len(values) / size
+            variance += weight ** 2 * var / len(values) * fpc
+        elif size > 1:
+            bounded = False
+    return estimate, 1.96 * math.sqrt(variance) if bounded else None
+
+def full_cpi(path, xlen=32, **params):
+    "CPI of a detailed simulation of the whole trace, for validation"
+    model = Model(**params)
+    n_instr = 0
+    def count(_):
+        nonlocal n_instr
+        n_instr += 1
+    model.stream(read_trace(path, xlen), count)
+    return model.run() / n_instr
+
+def main(argv):
+    "Entry point"
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input_file", help="RVFI trace or binary trace")
+    parser.add_argument("--interval", type=int, default=100000,
+        help="number of instructions of an interval")
+    parser.add_argument("--warmup", type=int, default=100000,
+        help="number of instructions of functional warm-up before an interval")
+    parser.add_argument("--clusters", type=int, default=10)
+    parser.add_argument("--per-cluster", type=int, default=2,
+        help="number of intervals simulated per cluster")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--full", action="store_true",
+        help="also simulate the whole trace to measure the error")
+    parser.add_argument("--issue", type=int, default=2)
+    parser.add_argument("--commit", type=int, default=2)
+    parser.add_argument("--icache", help="I-cache spec, see caches.py")
+    parser.add_argument("--dcache", help="D-cache spec, see caches.py")
+    parser.add_argument("--xlen", type=int, choices=[32, 64], default=32,
+        help="decode the trace as RV32 or RV64 (default: %(default)s)")
+    args = parser.parse_args(argv)
+    params = {"issue": args.issue, "commit": args.commit,
+        "icache": args.icache, "dcache": args.dcache}
+
+    vectors = basic_block_vectors(args.input_file, args.interval,
+        seed=args.seed)
+    if not vectors:
+        sys.exit(f"the trace is shorter than an interval ({args.interval})")
+    strata = choose_samples(vectors, args.clusters, args.per_cluster,
+        args.seed)
+    chosen = [i for _, samples in strata for i in samples]
+    cpis = simulate_intervals(args.input_file,
+        [i * args.interval for i in chosen],
+        args.interval, args.warmup, args.xlen, **params)
+    cpis = {i: cpis[i * args.interval] for i in chosen}
+
+    print(f"intervals: {len(vectors)} of {args.interval} instructions")
+    print(f"simulated: {len(chosen)} ({100 * len(chosen) / len(vectors):.1f}%)")
+    print(f"{'cluster':>7} {'weight':>7}  CPI of samples (interval number)")
+    total = len(vectors)
+    for c, (size, samples) in enumerate(strata):
+        values = " ".join(f"{cpis[i]:.3f} ({i})" for i in samples)
+        print(f"{c:>7} {size / total:>7.3f}  {values}")
+    cpi, bound = estimate_cpi(strata, cpis)
+    bound_text = "" if bound is None else f" +/- {bound:.4f}"
+    print(f"estimated CPI = {cpi:.4f}{bound_text}")
+    if args.full:
+        actual = full_cpi(args.input_file, args.xlen, **params)
+        print(f"full CPI      = {actual:.4f} ({100 * (cpi - actual) / actual:+.2f}%)")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,157 @@
+# Copyright 2024 Thales Silicon Security
+#
+# Licensed under the Solderpad Hardware Licence, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# SPDX-License-Identifier: Apache-2.0 WITH SHL-2.0
+# You may obtain a copy of the License at https://solderpad.org/licenses/
+#
+# Original Author: Côme ALLART - Thales
+
+"""
+Runs the performance model on a grid of parameters, in parallel
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import sys
+
+from multiprocessing import Pool
+
+from model import Model, Instruction, EventKind, Stats, TimedFilter
+from model import parse_trace
+from bintrace import BinaryTrace, is_binary_trace
+
+# Parameters of `Model.__init__` which can be swept, with their type
+PARAMETERS = {
+    "issue": int,
+    "commit": int,
+    "sb_len": int,
+    "fetch_size": int,
+    "has_forwarding": bool,
+    "has_renaming": bool,
+    "bht_entries": int,
+    "predictor": str,
+    "history_bits": int,
+    "btb_entries": int,
+    "btb_ways": int,
+    "icache": str,
+    "dcache": str,
+    "scheduler": str,
+    "issue_window": int,
+    "fus": str,
+}
+
+# Trace shared by the workers, set once per process by `_init_worker`
+_records = None
+
+def _init_worker(records):
+    global _records # pylint: disable=global-statement
+    _records = records
+
+def configurations(grid):
+    "All the combinations of a {parameter: [values]} grid"
+    names = list(grid)
+    for values in itertools.product(*(grid[name] for name in names)):
+        yield dict(zip(names, values))
+
+def run_configuration(params, records=None, timed=False, xlen=32):
+    """
+    Run the model with the given parameters, returns a result row
+    `xlen` selects the RV32 or RV64 decoding of the trace.
+    """
+    records = _records if records is None else records
+    if isinstance(records, BinaryTrace):
+        instructions = records.instructions(xlen=xlen)
+    else:
+        instructions = (Instruction(*r, xlen=xlen) for r in records)
+    stats = Stats()
+    model = Model(**params)
+    model.stream(
+        instructions,
+        TimedFilter(stats.add) if timed else stats.add,
+        window=max(64, model.issue_width),
+        on_events=stats.add_events)
+    model.run()
+    n_cycles = stats.n_cycles()
+    row = dict(params)
+    row["cycles"] = n_cycles
+    row["instructions"] = stats.n_instr
+    row["IPC"] = stats.n_instr / n_cycles
+    row["CoreMark/MHz"] = 1000000 / n_cycles
+    for kind in EventKind:
+        row[f"{kind.name}/instr"] = stats.ecount.get(kind, 0) / stats.n_instr
+    return row
+
+def _run_task(task):
+    params, timed, xlen = task
+    return run_configuration(params, timed=timed, xlen=xlen)
+
+def sweep(input_file, grid, processes=None, timed=False, records=None,
+        xlen=32):
+    """
+    Run the model for every configuration of the grid
+    The trace is parsed once and shared with a pool of worker processes.
+    A binary trace is not parsed, each worker maps the file instead.
+    Returns one result row per configuration, in the grid order.
+    """
+    if records is None and is_binary_trace(input_file):
+        records = BinaryTrace(input_file)
+    if records is None:
+        records = list(parse_trace(input_file))
+    tasks = [(params, timed, xlen) for params in configurations(grid)]
+    with Pool(processes, _init_worker, (records,)) as pool:
+        return pool.map(_run_task, tasks, chunksize=1)
+
+def write_results(output_file, rows):
+    "Write result rows to a CSV file, or a JSON file if the name says so"
+    if output_file.endswith(".json"):
+        with open(output_file, "w", encoding="utf8") as f:
+            json.dump(rows, f, indent=2)
+        return
+    with open(output_file, "w", encoding="utf8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+def parse_bool(value):
+    "Parse a boolean command line value"
+    if value.lower() in ["1", "true", "yes", "on"]:
+        return True
+    if value.lower() in ["0", "false", "no", "off"]:
+        return False
+    raise argparse.ArgumentTypeError(f"not a boolean: {value}")
+
+def main(argv):
+    "Entry point"
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("input_file", help="RVFI trace")
+    parser.add_argument("-o", "--output", default="sweep.csv",
+        help="result table, CSV or JSON (.json) (default: %(default)s)")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+        help="number of worker processes (default: number of CPUs)")
+    parser.add_argument("--timed", action="store_true",
+        help="only measure the timed part of the trace")
+    parser.add_argument("--xlen", type=int, choices=[32, 64], default=32,
+        help="decode the trace as RV32 or RV64 (default: %(default)s)")
+    for name, kind in PARAMETERS.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", dest=name,
+            nargs="+", type=parse_bool if kind is bool else kind,
+            metavar="VALUE", help=f"values of Model {name}")
+    args = parser.parse_args(argv)
+
+    grid = {
+        name: getattr(args, name)
+        for name in PARAMETERS
+        if getattr(args, name) is not None
+    }
+    rows = sweep(args.input_file, grid, args.jobs, args.timed,
+        xlen=args.xlen)
+    write_results(args.output, rows)
+    for row in rows:
+        params = ", ".join(f"{name}={row[name]}" for name in grid)
+        print(f"{params}: {row['CoreMark/MHz']:.4f} CoreMark/MHz")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
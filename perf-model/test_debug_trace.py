@@ -0,0 +1,50 @@
+# Copyright 2024 Thales Silicon Security
+#
+# Licensed under the Solderpad Hardware Licence, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# SPDX-License-Identifier: Apache-2.0 WITH SHL-2.0
+# You may obtain a copy of the License at https://solderpad.org/licenses/
+#
+# Original Author: Côme ALLART - Thales
+
+"""
+Tests of the binary debug trace
+
+Run with `python3 -m unittest test_debug_trace` (or pytest) from this
+directory.
+"""
+
+import io
+import unittest
+
+from debug_trace import DebugTrace, read_records
+
+class BinaryTraceTest(unittest.TestCase):
+    "Messages written as binary records read back as printed"
+
+    def round_trip(self, messages):
+        binary = io.BytesIO()
+        trace = DebugTrace(binary=binary)
+        for cycle, component, message, args in messages:
+            trace.set_cycle(cycle)
+            trace.log(component, message, args)
+        binary.seek(0)
+        return list(read_records(binary))
+
+    def test_args(self):
+        messages = [
+            # RV64 kernel addresses do not fit a signed 64-bit integer
+            (None, "ras", "pushed 0x%08X", (0xffffffff80000004,)),
+            (3, "ras", "read 0x%08X", (0xffffffff80000004,)),
+            (4, "iq", "%d %d %s", (-1, 1 << 70, "text")),
+            (5, "events", "%d", (-(1 << 64) + 1,)),
+        ]
+        self.assertEqual(self.round_trip(messages), [
+            (None, "ras", "pushed 0xFFFFFFFF80000004"),
+            (3, "ras", "read 0xFFFFFFFF80000004"),
+            (4, "iq", f"-1 {1 << 70} text"),
+            (5, "events", f"{-(1 << 64) + 1}"),
+        ])
+
+if __name__ == "__main__":
+    unittest.main()
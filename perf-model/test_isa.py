@@ -0,0 +1,103 @@
+# Copyright 2024 Thales Silicon Security
+#
+# Licensed under the Solderpad Hardware Licence, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# SPDX-License-Identifier: Apache-2.0 WITH SHL-2.0
+# You may obtain a copy of the License at https://solderpad.org/licenses/
+#
+# Original Author: Côme ALLART - Thales
+
+"""
+Tests of the instruction decoding
+
+Run with `python3 -m unittest test_isa` (or pytest) from this directory.
+Floating-point registers are numbered from 32, see `isa.Reg`.
+"""
+
+import unittest
+
+from isa import decode, Instr
+
+A0, A1, A2, SP = 10, 11, 12, 2
+FA0, FA1, FA2, FA3 = 42, 43, 44, 45
+
+# Fields which are not checked
+ANY = object()
+
+# word, xlen, name, rd, rs1, rs2, rs3, offset, flags which are true
+CASES = [
+    # Compressed instructions which differ between RV32 and RV64
+    (0x2505, 64, "C.ADDIW", A0, A0, None, None, 1, ["is_compressed"]),
+    (0x2505, 32, "C.JAL", None, None, None, None, ANY,
+        ["is_compressed", "is_jump"]),
+    (0x6588, 64, "C.LD", A0, A1, None, None, 8, ["is_compressed", "is_load"]),
+    (0x6588, 32, "C.FLW", FA0, A1, None, None, 8,
+        ["is_compressed", "is_load"]),
+    (0xe588, 64, "C.SD", None, A1, A0, None, 8, ["is_compressed", "is_store"]),
+    (0xe588, 32, "C.FSW", None, A1, FA0, None, 8,
+        ["is_compressed", "is_store"]),
+    (0x6522, 64, "C.LDSP", A0, SP, None, None, 8,
+        ["is_compressed", "is_load"]),
+    (0x6522, 32, "C.FLWSP", FA0, SP, None, None, 8,
+        ["is_compressed", "is_load"]),
+    # Compressed instructions common to RV32 and RV64
+    (0x2588, 64, "C.FLD", FA0, A1, None, None, 8,
+        ["is_compressed", "is_load"]),
+    (0xa42a, 64, "C.FSDSP", None, SP, FA0, None, 8,
+        ["is_compressed", "is_store"]),
+    (0x0505, 32, "C.ADDI", A0, A0, None, None, None, ["is_compressed"]),
+    (0x4515, 32, "C.LI", A0, None, None, None, 5, ["is_compressed"]),
+    # c.srli has an immediate, not rs2
+    (0x8105, 32, "MISC-ALU", A0, A0, None, None, None, ["is_compressed"]),
+    # RV64 word operations
+    (0x00c5853b, 64, "OP-32", A0, A1, A2, None, None, []),
+    (0x02c5853b, 64, "OP-32", A0, A1, A2, None, None, ["is_muldiv"]),
+    (0xfff5851b, 64, "OP-IMM-32", A0, A1, None, None, 0xffffffff, []),
+    # F and D
+    (0x0085b507, 32, "LOAD-FP", FA0, A1, None, None, 8, ["is_load"]),
+    (0x00a5b427, 32, "STORE-FP", None, A1, FA0, None, 8, ["is_store"]),
+    # fadd.d fa0, fa1, fa2
+    (0x02c5f553, 32, "OP-FP", FA0, FA1, FA2, None, None, []),
+    # fcvt.w.d a0, fa1
+    (0xc205f553, 32, "OP-FP", A0, FA1, None, None, None, []),
+    # fcvt.d.w fa0, a1
+    (0xd205f553, 32, "OP-FP", FA0, A1, None, None, None, []),
+    # fmadd.d fa0, fa1, fa2, fa3
+    (0x6ac5f543, 32, "MADD", FA0, FA1, FA2, FA3, None, []),
+    # A
+    (0x1005a52f, 32, "LR", A0, A1, None, None, 0, ["is_load"]),
+    (0x18c5a52f, 32, "SC", A0, A1, A2, None, 0, ["is_store"]),
+    (0x00c5a52f, 32, "AMOADD", A0, A1, A2, None, 0, ["is_load", "is_store"]),
+    # Others
+    (0x0ff0000f, 32, "MISC-MEM", ANY, ANY, None, None, None, []),
+    (0x00b50463, 32, "BRANCH", None, A0, A1, None, 8, ["is_branch"]),
+]
+
+FLAGS = ["is_compressed", "is_load", "is_store", "is_branch", "is_jump",
+    "is_regjump", "is_muldiv"]
+
+class DecodeTest(unittest.TestCase):
+    "Table-driven tests of `isa.decode`"
+
+    def test_cases(self):
+        for word, xlen, name, *fields, flags in CASES:
+            with self.subTest(word=f"0x{word:08x}", xlen=xlen):
+                decoded = decode(word, xlen)
+                self.assertEqual(decoded.name, name)
+                for field, expected in zip(
+                        ["rd", "rs1", "rs2", "rs3", "offset"], fields):
+                    if expected is not ANY:
+                        self.assertEqual(getattr(decoded, field), expected,
+                            field)
+                self.assertEqual(
+                    [flag for flag in FLAGS if getattr(decoded, flag)],
+                    [flag for flag in FLAGS if flag in flags])
+                self.assertEqual(decoded.size, 2 if word & 3 != 3 else 4)
+
+    def test_no_fields(self):
+        # custom-0
+        self.assertIsNone(Instr(0x0000000b).fields())
+        self.assertEqual(decode(0x0000000b).name, "custom-0")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -627,31 +627,41 @@ def iss_cmp(test_list, iss, target, output_dir, stop_on_first_error, exp, debug_
   save_regr_report(report)
 
 
-def compare_iss_log(iss_list, log_list, report, stop_on_first_error=0, exp=False):
+def compare_iss_log(iss_list, log_list, report, stop_on_first_error=0, exp=False,
+                    save_csv=True):
+  """Compare two ISS logs
+
+  Both logs are parsed concurrently, each one in its own process, and their
+  entries are compared as they come. The CSV traces are only written if
+  save_csv is true.
+  """
   if (len(iss_list) != 2 or len(log_list) != 2):
     logging.error("Only support comparing two ISS logs")
     logging.info("len(iss_list) = %s len(log_list) = %s" % (len(iss_list), len(log_list)))
   else:
-    csv_list = []
+    trace_list = []
+    path_list = []
     for i in range(2):
       log = log_list[i]
-      csv = log.replace(".log", ".csv");
+      csv = log.replace(".log", ".csv") if save_csv else None
       iss = iss_list[i]
-      csv_list.append(csv)
       if iss == "spike":
-        process_spike_sim_log(log, csv)
+        read_trace, args = spike_sim_log_entries, (log,)
       elif "veri" in iss or "vsim" in iss or "vcs" in iss or "questa" in iss:
-        process_verilator_sim_log(log, csv)
+        read_trace, args = verilator_sim_log_entries, (log,)
       elif iss == "ovpsim":
-        process_ovpsim_sim_log(log, csv, stop_on_first_error)
+        read_trace, args = ovpsim_sim_log_entries, (log, stop_on_first_error)
       elif iss == "sail":
-        process_sail_sim_log(log, csv)
+        read_trace, args = sail_sim_log_entries, (log,)
       elif iss == "whisper":
-        process_whisper_sim_log(log, csv)
+        read_trace, args = whisper_sim_log_entries, (log,)
       else:
-        logging.error("Unsupported ISS" % iss)
+        logging.error("Unsupported ISS %s" % iss)
         sys.exit(RET_FAIL)
-    result = compare_trace_csv(csv_list[0], csv_list[1], iss_list[0], iss_list[1], report)
+      trace_list.append(stream_trace(read_trace, args, csv))
+      path_list.append(csv or log)
+    result = compare_trace(trace_list[0], trace_list[1], iss_list[0], iss_list[1],
+                           report, path_list[0], path_list[1])
     logging.info(result)
 
 
@@ -662,7 +672,7 @@ def save_regr_report(report):
   logging.info(summary)
   run_cmd(("echo %s >> %s" % (summary, report)))
   if failed_cnt != "0":
-    failed_details = run_cmd(r"sed -e 's,.*_sim/,,' %s | grep '\(csv\|matched\)' | uniq | sed -e 'N;s/\\n/ /g' | grep '\[FAILED\]'" % report).strip()
+    failed_details = run_cmd(r"sed -e 's,.*_sim/,,' %s | grep '\(\.csv\|\.log\|matched\)' | uniq | sed -e 'N;s/\\n/ /g' | grep '\[FAILED\]'" % report).strip()
     logging.info(failed_details)
     run_cmd(("echo %s >> %s" % (failed_details, report)))
     #sys.exit(RET_FAIL) #Do not return error code in case of test fail.
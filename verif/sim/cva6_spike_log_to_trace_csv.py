@@ -35,6 +35,8 @@ CORE_RE = re.compile(
 ADDR_RE = re.compile(
     r"(?P<rd>[a-z0-9]+?),(?P<imm>[\-0-9]+?)\((?P<rs1>[a-z0-9]+)\)")
 ILLE_RE = re.compile(r"trap_illegal_instruction")
+START_TRAMPOLINE_RE = re.compile(r'core.*: 0x0*10000 ')
+END_TRAMPOLINE_RE = re.compile(r'core.*: 0x0*10010 ')
 
 LOGGER = logging.getLogger()
 
@@ -59,7 +61,7 @@ def process_instr(trace):
             m.group("rd"), m.group("rs1"), m.group("imm"))
 
 
-def read_spike_instr(match, full_trace):
+def read_spike_instr(match, full_trace=0):
     """Unpack a regex match for CORE_RE to a RiscvInstructionTraceEntry
 
     If full_trace is true, extract operand data from the disassembled
@@ -77,18 +79,14 @@ def read_spike_instr(match, full_trace):
     instr.pc = match.group('addr')
     instr.instr_str = disasm
     instr.binary = match.group('bin')
-    if full_trace:
-        opcode = disasm.split(' ')[0]
-        operand = disasm[len(opcode):].replace(' ', '')
-        instr.instr, instr.operand = \
-            convert_pseudo_instr(opcode, operand, instr.binary)
 
-        process_instr(instr)
+    if full_trace:
+        decode_entry(SPIKE_LOG_FORMAT, instr)
 
     return instr
 
 
-def read_spike_trace(path, full_trace):
+def read_spike_trace(path, full_trace=0):
     """Read a Spike simulation log at <path>, yielding executed instructions.
 
     This assumes that the log was generated with the -l and --log-commits options
@@ -106,6 +104,16 @@ def read_spike_trace(path, full_trace):
     (entry, illegal). entry is a RiscvInstructionTraceEntry. illegal is a
     boolean, which is true if the instruction caused an illegal instruction trap.
 
+    """
+    with open(path, 'r') as handle:
+        yield from read_spike_lines(handle, full_trace=full_trace)
+
+
+def read_spike_lines(lines, in_trampoline=False, full_trace=0):
+    """Parse the lines of a Spike simulation log, see read_spike_trace
+
+    in_trampoline is true if the lines start in the trampoline.
+
     """
 
     # This loop is a simple FSM with states TRAMPOLINE, INSTR, EFFECT. The idea
@@ -121,109 +129,96 @@ def read_spike_trace(path, full_trace):
     # true. Otherwise, we are in state EFFECT if instr is not None, otherwise we
     # are in state INSTR.
 
-    start_trampoline_re = re.compile(r'core.*: 0x0*10000 ')
-    end_trampoline_re = re.compile(r'core.*: 0x0*10010 ')
-
-    in_trampoline = False
     instr = None
 
-    with open(path, 'r') as handle:
-        for line in handle:
-            if in_trampoline:
-                # The TRAMPOLINE state
-                if end_trampoline_re.match(line):
-                    in_trampoline = False
-                continue
-            elif start_trampoline_re.match(line):
-                in_trampoline = True
+    for line in lines:
+        if in_trampoline:
+            # The TRAMPOLINE state
+            if END_TRAMPOLINE_RE.match(line):
+                in_trampoline = False
+            continue
+        elif START_TRAMPOLINE_RE.match(line):
+            in_trampoline = True
+            continue
+
+        if instr is None:
+            # The INSTR state. We expect to see a line matching CORE_RE.
+            # We'll discard any other lines.
+            instr_match = CORE_RE.match(line)
+            if not instr_match:
                 continue
 
-            if instr is None:
-                # The INSTR state. We expect to see a line matching CORE_RE.
-                # We'll discard any other lines.
-                instr_match = CORE_RE.match(line)
-                if not instr_match:
-                    continue
+            instr = read_spike_instr(instr_match, full_trace)
 
-                instr = read_spike_instr(instr_match, full_trace)
+            # If instr.instr_str is 'ecall', we should stop.
+            if instr.instr_str == 'ecall':
+                break
 
-                # If instr.instr_str is 'ecall', we should stop.
-                if instr.instr_str == 'ecall':
-                    break
+            continue
 
-                continue
+        # The EFFECT state. If the line matches CORE_RE, we should have been in
+        # state INSTR, so we yield the instruction we had, read the new
+        # instruction and continue. As above, if the new instruction is 'ecall',
+        # we need to stop immediately.
+        instr_match = CORE_RE.match(line)
+        if instr_match:
+            yield instr, False
+            instr = read_spike_instr(instr_match, full_trace)
+            if instr.instr_str == 'ecall':
+                break
+            continue
 
-            # The EFFECT state. If the line matches CORE_RE, we should have been in
-            # state INSTR, so we yield the instruction we had, read the new
-            # instruction and continue. As above, if the new instruction is 'ecall',
-            # we need to stop immediately.
-            instr_match = CORE_RE.match(line)
-            if instr_match:
-                yield instr, False
-                instr = read_spike_instr(instr_match, full_trace)
-                if instr.instr_str == 'ecall':
-                    break
-                continue
+        # The line doesn't match CORE_RE, so we are definitely on a follow-on
+        # line in the log. First, check for illegal instructions
+        if 'trap_illegal_instruction' in line:
+            yield (instr, True)
+            instr = None
+            continue
 
-            # The line doesn't match CORE_RE, so we are definitely on a follow-on
-            # line in the log. First, check for illegal instructions
-            if 'trap_illegal_instruction' in line:
-                yield (instr, True)
-                instr = None
-                continue
+        # The instruction seems to have been fine. Do we have commit data (from
+        # the --log-commits Spike option)?
+        commit_match = RD_RE.match(line)
+        if commit_match:
+            instr.gpr.append(gpr_to_abi(commit_match.group('reg')
+                                        .replace(' ', '')) +
+                             ':' + commit_match.group('val'))
+            instr.mode = commit_match.group('pri')
+
+    # At EOF, we might have an instruction in hand. Yield it if so.
+    if instr is not None:
+        yield (instr, False)
 
-            # The instruction seems to have been fine. Do we have commit data (from
-            # the --log-commits Spike option)?
-            commit_match = RD_RE.match(line)
-            if commit_match:
-                instr.gpr.append(gpr_to_abi(commit_match.group('reg')
-                                            .replace(' ', '')) +
-                                 ':' + commit_match.group('val'))
-                instr.mode = commit_match.group('pri')
 
-        # At EOF, we might have an instruction in hand. Yield it if so.
-        if instr is not None:
-            yield (instr, False)
+SPIKE_LOG_FORMAT = TraceLogFormat(
+    "spike", read_spike_trace, fix_instr=(None, process_instr),
+    update_only=True, read_lines=read_spike_lines,
+    chunk_options=dict(instr_re=CORE_RE,
+                       regions=[(START_TRAMPOLINE_RE, END_TRAMPOLINE_RE)]))
 
 
-def process_spike_sim_log(spike_log, csv, full_trace=0):
+def spike_sim_log_entries(spike_log, full_trace=0):
+    """Generate the entries of a Spike simulation log which go to its CSV
+
+    Instructions that cause no architectural update are skipped if full_trace
+    is false.
+
+    """
+    return sim_log_entries(SPIKE_LOG_FORMAT, spike_log, full_trace)
+
+
+def process_spike_sim_log(spike_log, csv, full_trace=0, jobs=1):
     """Process SPIKE simulation log.
 
     Extract instruction and affected register information from spike simulation
     log and write the results to a CSV file at csv. Returns the number of
     instructions written.
 
-    """
-    logging.info("Processing spike log : {}".format(spike_log))
-    instrs_in = 0
-    instrs_out = 0
-
-    with open(csv, "w") as csv_fd:
-        trace_csv = RiscvInstructionTraceCsv(csv_fd)
-        trace_csv.start_new_trace()
-
-        for (entry, illegal) in read_spike_trace(spike_log, full_trace):
-            instrs_in += 1
-            if illegal and full_trace:
-                logging.debug("Illegal instruction: {}, opcode:{}"
-                              .format(entry.instr_str, entry.binary))
-
-            # Instructions that cause no architectural update (which includes illegal
-            # instructions) are ignored if full_trace is false.
-            #
-            # We say that an instruction caused an architectural update if either we
-            # saw a commit line (in which case, entry.gpr will contain a single
-            # entry) or the instruction was 'wfi' or 'ecall'.
-            if not (full_trace or entry.gpr or entry.instr_str in ['wfi',
-                                                                   'ecall']):
-                continue
-
-            trace_csv.write_trace_entry(entry)
-            instrs_out += 1
+    If jobs is not 1, the log is split into chunks which are parsed by jobs
+    processes, or one per CPU if jobs is 0.
 
-    logging.info("Processed instruction count : {}".format(instrs_in))
-    logging.info("CSV saved to : {}".format(csv))
-    return instrs_out
+    """
+    return process_sim_log(SPIKE_LOG_FORMAT, spike_log, csv, full_trace,
+                           jobs=jobs)
 
 
 def main():
@@ -234,6 +229,9 @@ def main():
     parser.add_argument("-f", "--full_trace", dest="full_trace",
                         action="store_true",
                         help="Generate the full trace")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Number of processes parsing the log in chunks, "
+                             "0 for one per CPU")
     parser.add_argument("-v", "--verbose", dest="verbose", action="store_true",
                         help="Verbose logging")
     parser.set_defaults(full_trace=False)
@@ -241,7 +239,7 @@ def main():
     args = parser.parse_args()
     setup_logging(args.verbose)
     # Process spike log
-    process_spike_sim_log(args.log, args.csv, args.full_trace)
+    process_spike_sim_log(args.log, args.csv, args.full_trace, args.jobs)
 
 
 if __name__ == "__main__":
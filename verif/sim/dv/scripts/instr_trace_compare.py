@@ -17,6 +17,8 @@ Compare the instruction trace CSV
 """
 
 import argparse
+import collections
+import itertools
 import re
 import sys
 import os
@@ -33,6 +35,28 @@ def compare_trace_csv(csv1, csv2, name1, name2, log,
                       mismatch_print_limit=5,
                       compare_final_value_only=0):
     """Compare two trace CSV file"""
+    with open(csv1, "r") as fd1, open(csv2, "r") as fd2:
+        trace_csv_1 = RiscvInstructionTraceCsv(fd1)
+        trace_csv_2 = RiscvInstructionTraceCsv(fd2)
+        return compare_trace(trace_csv_1.iter_trace(),
+                             trace_csv_2.iter_trace(),
+                             name1, name2, log, csv1, csv2,
+                             in_order_mode, coalescing_limit, verbose,
+                             mismatch_print_limit, compare_final_value_only)
+
+
+def compare_trace(instr_trace_1, instr_trace_2, name1, name2, log,
+                  path1, path2,
+                  in_order_mode=1,
+                  coalescing_limit=0,
+                  verbose=0,
+                  mismatch_print_limit=5,
+                  compare_final_value_only=0):
+    """Compare two iterables of RiscvInstructionTraceEntry
+
+    Both traces are streamed: only the GPR values are kept in memory. path1
+    and path2 are the files the traces come from, for the report.
+    """
     matched_cnt = 0
     mismatch_cnt = 0
 
@@ -45,192 +69,262 @@ def compare_trace_csv(csv1, csv2, name1, name2, log,
     else:
         fd = sys.stdout
 
-    fd.write("{} : {}\n".format(name1, csv1))
-    fd.write("{} : {}\n".format(name2, csv2))
+    fd.write("{} : {}\n".format(name1, path1))
+    fd.write("{} : {}\n".format(name2, path2))
 
-    with open(csv1, "r") as fd1, open(csv2, "r") as fd2:
-        instr_trace_1 = []
-        instr_trace_2 = []
-        trace_csv_1 = RiscvInstructionTraceCsv(fd1)
-        trace_csv_2 = RiscvInstructionTraceCsv(fd2)
-        trace_csv_1.read_trace(instr_trace_1)
-        trace_csv_2.read_trace(instr_trace_2)
-        trace_1_index = 0
-        trace_2_index = 0
-        mismatch_cnt = 0
-        matched_cnt = 0
-        if in_order_mode:
-            gpr_val_1 = {}
-            gpr_val_2 = {}
-            for trace in instr_trace_1:
-                trace_1_index += 1
-                if len(trace.gpr) == 0:
-                    continue
-                # Check if there's a GPR change caused by this instruction
-                gpr_state_change_1 = check_update_gpr(trace.gpr, gpr_val_1)
-                if gpr_state_change_1 == 0:
-                    continue
-                # Move forward the other trace until a GPR update happens
-                gpr_state_change_2 = 0
-                while (gpr_state_change_2 == 0 and trace_2_index < len(
-                        instr_trace_2)):
-                    gpr_state_change_2 = check_update_gpr(
-                        instr_trace_2[trace_2_index].gpr,
-                        gpr_val_2)
-                    trace_2_index += 1
-                # Check if the GPR update is the same between trace 1 and 2
-                if gpr_state_change_2 == 0:
-                    mismatch_cnt += 1
+    instr_trace_1 = iter(instr_trace_1)
+    instr_trace_2 = iter(instr_trace_2)
+    trace_1_index = 0
+    trace_2_index = 0
+    mismatch_cnt = 0
+    matched_cnt = 0
+    if in_order_mode:
+        gpr_val_1 = {}
+        gpr_val_2 = {}
+        trace = None
+        # Next entry of trace 2, None at the end of trace 2
+        next_trace_2 = next(instr_trace_2, None)
+        for trace in instr_trace_1:
+            trace_1_index += 1
+            if len(trace.gpr) == 0:
+                continue
+            # Check if there's a GPR change caused by this instruction
+            gpr_state_change_1 = check_update_gpr(trace.gpr, gpr_val_1)
+            if gpr_state_change_1 == 0:
+                continue
+            # Move forward the other trace until a GPR update happens
+            gpr_state_change_2 = 0
+            while gpr_state_change_2 == 0 and next_trace_2 is not None:
+                trace_2 = next_trace_2
+                gpr_state_change_2 = check_update_gpr(trace_2.gpr,
+                                                      gpr_val_2)
+                trace_2_index += 1
+                next_trace_2 = next(instr_trace_2, None)
+            # Check if the GPR update is the same between trace 1 and 2
+            if gpr_state_change_2 == 0:
+                mismatch_cnt += 1
+                fd.write("Mismatch[{}]:\n[{}] {} : {}\n".format(
+                  mismatch_cnt, trace_1_index, name1,trace.get_trace_string()))
+                # Trace 2 is over, the comparison stops here
+                fd.write("{} instructions left in trace {}\n".format(
+                  count_entries(instr_trace_1) + 1, name1))
+            elif len(trace.gpr) != len(trace_2.gpr):
+                mismatch_cnt += 1
+                # print first few mismatches
+                if mismatch_cnt <= mismatch_print_limit:
+                    fd.write("Mismatch[{}]:\n{}[{}] : {}\n".format(
+                      mismatch_cnt, name1, trace_2_index - 1,
+                      trace.get_trace_string()))
+                    fd.write("{}[{}] : {}\n".format(
+                      name2, trace_2_index - 1,
+                      trace_2.get_trace_string()))
+            else:
+                found_mismatch = 0
+                for i in range(len(trace.gpr)):
+                    if trace.gpr[i] != trace_2.gpr[i]:
+                        mismatch_cnt += 1
+                        found_mismatch = 1
+                        # print first few mismatches
+                        if mismatch_cnt <= mismatch_print_limit:
+                            fd.write("Mismatch[{}]:\n{}[{}] : {}\n".format(
+                                mismatch_cnt, name1, trace_2_index - 1,
+                                trace.get_trace_string()))
+                            fd.write("{}[{}] : {}\n".format(
+                                name2, trace_2_index - 1,
+                                trace_2.get_trace_string()))
+                        break
+                if not found_mismatch:
+                    matched_cnt += 1
+            # Break the loop if it reaches the end of trace 2
+            if next_trace_2 is None:
+                break
+        # Check if there's remaining instruction that change architectural state
+        if next_trace_2 is not None:
+            instr_trace_2 = itertools.chain([next_trace_2], instr_trace_2)
+            for trace_2 in instr_trace_2:
+                gpr_state_change_2 = check_update_gpr(trace_2.gpr,
+                                                      gpr_val_2)
+                if gpr_state_change_2 == 1:
                     fd.write("Mismatch[{}]:\n[{}] {} : {}\n".format(
-                      mismatch_cnt, trace_1_index, name1,trace.get_trace_string()))
+                        mismatch_cnt, trace_1_index, name1,
+                        trace.get_trace_string() if trace else ""))
+                    instr_left = count_entries(instr_trace_2) + 1
                     fd.write("{} instructions left in trace {}\n".format(
-                      len(instr_trace_1) - trace_1_index + 1, name1))
-                elif len(trace.gpr) != len(
-                        instr_trace_2[trace_2_index - 1].gpr):
+                      instr_left, name2))
+                    mismatch_cnt += instr_left
+                    break
+                trace_2_index += 1
+    else:
+        # For processors which can commit multiple instructions in one
+        # cycle, the ordering between different GPR update on that cycle
+        # could be non-deterministic. If multiple instructions try to update
+        # the same GPR on the same cycle, these updates could be coalesced
+        # to one update.
+        if compare_final_value_only:
+            final_1 = final_gpr_values(instr_trace_1)
+            final_2 = final_gpr_values(instr_trace_2)
+        else:
+            matched_cnt, mismatch_cnt, final_1, final_2 = \
+                compare_gpr_updates(instr_trace_1, instr_trace_2,
+                                    name1, name2, fd, coalescing_limit,
+                                    verbose, mismatch_print_limit)
+        final_matched_cnt, mismatch_cnt = compare_final_values(
+            final_1, final_2, name1, name2, fd, mismatch_cnt,
+            mismatch_print_limit, compare_final_value_only)
+        if compare_final_value_only:
+            matched_cnt = final_matched_cnt
+    if mismatch_cnt == 0:
+        compare_result = "[PASSED]: {} matched\n".format(matched_cnt)
+    else:
+        compare_result = "[FAILED]: {} matched, {} mismatch\n".format(
+            matched_cnt, mismatch_cnt)
+    fd.write(compare_result + "\n")
+    if log:
+        fd.close()
+    return compare_result
+
+
+def gpr_updates(instr_trace):
+    """Generate the (gpr, value, trace entry) updates of a trace
+
+    The first write of each GPR is an update, the next ones are updates if
+    they change the value of the GPR.
+    """
+    prev_val = {}
+    for trace in instr_trace:
+        for update in trace.gpr:
+            if update == "":
+                continue
+            item = update.split(":")
+            if len(item) != 2:
+                sys.exit("Illegal GPR update format:" + update)
+            rd = item[0]
+            rd_val = item[1]
+            if prev_val.get(rd) != rd_val:
+                yield rd, rd_val, trace
+            prev_val[rd] = rd_val
+
+
+def final_gpr_values(instr_trace):
+    """Return the last (value, trace entry) update of each GPR of a trace"""
+    final = {}
+    for rd, rd_val, trace in gpr_updates(instr_trace):
+        final[rd] = (rd_val, trace)
+    return final
+
+
+def compare_gpr_updates(instr_trace_1, instr_trace_2, name1, name2, fd,
+                        coalescing_limit, verbose, mismatch_print_limit):
+    """Compare the sequence of updates of each GPR in two traces
+
+    The traces are read in lockstep. The updates of each GPR wait in a queue
+    per trace until the other trace has an update of that GPR to compare
+    with, so the memory only depends on how far the traces drift apart.
+    Up to coalescing_limit consecutive updates of trace 1 can be skipped, as
+    the core of trace 2 can merge them into one.
+
+    Return the matched count, the mismatch count and the last update of
+    each GPR of each trace.
+    """
+    matched_cnt = 0
+    mismatch_cnt = 0
+    queue_1 = collections.defaultdict(collections.deque)
+    queue_2 = collections.defaultdict(collections.deque)
+    count_1 = collections.Counter()
+    count_2 = collections.Counter()
+    final_1 = {}
+    final_2 = {}
+    coalesced_updates = collections.Counter()
+    for update_1, update_2 in itertools.zip_longest(
+            gpr_updates(instr_trace_1), gpr_updates(instr_trace_2)):
+        updated = set()
+        for update, queue, count, final in (
+                (update_1, queue_1, count_1, final_1),
+                (update_2, queue_2, count_2, final_2)):
+            if update is None:
+                continue
+            rd, rd_val, trace = update
+            queue[rd].append((count[rd], rd_val, trace))
+            count[rd] += 1
+            final[rd] = (rd_val, trace)
+            updated.add(rd)
+        for gpr in updated:
+            gpr_queue_1 = queue_1[gpr]
+            gpr_queue_2 = queue_2[gpr]
+            while gpr_queue_1 and gpr_queue_2:
+                trace_1_index, rd_val_1, trace_1 = gpr_queue_1[0]
+                trace_2_index, rd_val_2, trace_2 = gpr_queue_2[0]
+                if int(rd_val_1, 16) == int(rd_val_2, 16):
+                    coalesced_updates[gpr] = 0
+                    matched_cnt += 1
+                    if verbose:
+                        fd.write("Matched [{}]: {} : {}\n".format(
+                            trace_1_index, name1, trace_1.get_trace_string()))
+                    gpr_queue_1.popleft()
+                    gpr_queue_2.popleft()
+                elif coalesced_updates[gpr] >= coalescing_limit:
+                    coalesced_updates[gpr] = 0
                     mismatch_cnt += 1
-                    # print first few mismatches
                     if mismatch_cnt <= mismatch_print_limit:
-                        fd.write("Mismatch[{}]:\n{}[{}] : {}\n".format(
-                          mismatch_cnt, name1, trace_2_index - 1,
-                          trace.get_trace_string()))
+                        fd.write("Mismatch:\n")
                         fd.write("{}[{}] : {}\n".format(
-                          name2, trace_2_index - 1,
-                          instr_trace_2[
-                            trace_2_index - 1].get_trace_string()))
+                            name1, trace_1_index, trace_1.get_trace_string()))
+                        fd.write("{}[{}] : {}\n".format(
+                            name2, trace_2_index, trace_2.get_trace_string()))
+                    gpr_queue_1.popleft()
+                    gpr_queue_2.popleft()
                 else:
-                    found_mismatch = 0
-                    for i in range(len(trace.gpr)):
-                        if trace.gpr[i] != instr_trace_2[trace_2_index - 1].gpr[i]:
-                            mismatch_cnt += 1
-                            found_mismatch = 1
-                            # print first few mismatches
-                            if mismatch_cnt <= mismatch_print_limit:
-                                fd.write("Mismatch[{}]:\n{}[{}] : {}\n".format(
-                                    mismatch_cnt, name1, trace_2_index - 1,
-                                    trace.get_trace_string()))
-                                fd.write("{}[{}] : {}\n".format(
-                                    name2, trace_2_index - 1,
-                                    instr_trace_2[
-                                        trace_2_index - 1].get_trace_string()))
-                            break
-                    if not found_mismatch:
-                        matched_cnt += 1
-                # Break the loop if it reaches the end of trace 2
-                if trace_2_index == len(instr_trace_2):
-                    break
-            # Check if there's remaining instruction that change architectural state
-            if trace_2_index != len(instr_trace_2):
-                while trace_2_index < len(instr_trace_2):
-                    gpr_state_change_2 = check_update_gpr(
-                        instr_trace_2[trace_2_index].gpr,
-                        gpr_val_2)
-                    if gpr_state_change_2 == 1:
-                        fd.write("Mismatch[{}]:\n[{}] {} : {}\n".format(
-                            mismatch_cnt, trace_1_index, name1,trace.get_trace_string()))
-                        fd.write("{} instructions left in trace {}\n".format(
-                          len(instr_trace_2) - trace_2_index, name2))
-                        mismatch_cnt += len(instr_trace_2) - trace_2_index
-                        break
-                    trace_2_index += 1
+                    if verbose:
+                        fd.write("Skipping {}[{}] : {}\n".format(
+                            name1, trace_1_index, trace_1.get_trace_string()))
+                    coalesced_updates[gpr] += 1
+                    gpr_queue_1.popleft()
+    if len(count_1) != len(count_2):
+        fd.write("Mismatch: affected GPR count mismatch {}:{} VS {}:{}\n".format(
+            name1, len(count_1), name2, len(count_2)))
+        mismatch_cnt += 1
+    if coalescing_limit == 0:
+        for gpr in count_1:
+            if count_1[gpr] != count_2[gpr]:
+                fd.write("Mismatch: GPR[{}] trace count mismatch {}:{} VS {}:{}\n"
+                         .format(gpr, name1, count_1[gpr], name2, count_2[gpr]))
+                mismatch_cnt += 1
+    return matched_cnt, mismatch_cnt, final_1, final_2
+
+
+def compare_final_values(final_1, final_2, name1, name2, fd, mismatch_cnt,
+                         mismatch_print_limit, compare_final_value_only):
+    """Compare the final value of the GPRs written by trace 1
+
+    With compare_final_value_only, a GPR never written by trace 2 is 0.
+    Otherwise it is a mismatch. Return the matched count and the updated
+    mismatch count.
+    """
+    matched_cnt = 0
+    for gpr, (rd_val_1, trace_1) in final_1.items():
+        if gpr in final_2:
+            rd_val_2, trace_2 = final_2[gpr]
+        elif compare_final_value_only:
+            rd_val_2, trace_2 = "0", RiscvInstructionTraceEntry()
         else:
-            pass
-            # TODO: Enable out of order comparison
-          #      # For processors which can commit multiple instructions in one cycle, the
-          #      # ordering between different GPR update on that cycle could be
-          #      # non-deterministic. If multiple instructions try to update the same GPR on
-          #      # the same cycle, these updates could be coalesced to one update.
-          #      gpr_trace_1 = {}
-          #      gpr_trace_2 = {}
-          #      parse_gpr_update_from_trace(instr_trace_1, gpr_trace_1)
-          #      parse_gpr_update_from_trace(instr_trace_2, gpr_trace_2)
-          #      if not compare_final_value_only:
-          #        if len(gpr_trace_1) != len(gpr_trace_2):
-          #          fd.write("Mismatch: affected GPR count mismtach %s:%d VS %s:%d\n" %
-          #                   (name1, len(gpr_trace_1), name2, len(gpr_trace_2)))
-          #          mismatch_cnt += 1
-          #        for gpr in gpr_trace_1:
-          #          coalesced_updates = 0
-          #          if (len(gpr_trace_1[gpr]) != len(gpr_trace_2[gpr]) and
-          #              coalescing_limit == 0):
-          #            fd.write("Mismatch: GPR[%s] trace count mismtach %s:%d VS %s:%d\n" %
-          #                     (gpr, name1, len(gpr_trace_1[gpr]),
-          #                     name2, len(gpr_trace_2[gpr])))
-          #            mismatch_cnt += 1
-          #          trace_2_index = 0
-          #          coalesced_updates = 0
-          #          for trace_1_index in range(0, len(gpr_trace_1[gpr])-1):
-          #            if (trace_2_index == len(gpr_trace_2[gpr])):
-          #              break
-          #            if int(gpr_trace_1[gpr][trace_1_index].rd_val, 16) != \
-          #               int(gpr_trace_2[gpr][trace_2_index].rd_val, 16):
-          #              if coalesced_updates >= coalescing_limit:
-          #                coalesced_updates = 0
-          #                mismatch_cnt += 1
-          #                if mismatch_cnt <= mismatch_print_limit:
-          #                  fd.write("Mismatch:\n")
-          #                  fd.write("%s[%d] : %s\n" % (name1, trace_1_index,
-          #                           gpr_trace_1[gpr][trace_1_index].get_trace_string()))
-          #                  fd.write("%s[%d] : %s\n" % (name2, trace_2_index,
-          #                           gpr_trace_2[gpr][trace_2_index].get_trace_string()))
-          #                trace_2_index += 1
-          #              else:
-          #                if verbose:
-          #                  fd.write("Skipping %s[%d] : %s\n" %
-          #                           (name1, trace_1_index,
-          #                           gpr_trace_1[gpr][trace_1_index].get_trace_string()))
-          #                coalesced_updates += 1
-          #            else:
-          #              coalesced_updates = 0
-          #              matched_cnt += 1
-          #              if verbose:
-          #                fd.write("Matched [%0d]: %s : %s\n" %
-          #                         (trace_1_index, name1,
-          #                         gpr_trace_1[gpr][trace_1_index].get_trace_string()))
-          #              trace_2_index += 1
-          #      # Check the final value match between the two traces
-          #      for gpr in gpr_trace_1:
-          #        if not compare_final_value_only:
-          #          if (len(gpr_trace_1[gpr]) == 0 or len(gpr_trace_2[gpr]) == 0):
-          #            mismatch_cnt += 1
-          #            fd.write("Zero GPR[%s] updates observed: %s:%d, %s:%d\n" % (gpr,
-          #                     name1, len(gpr_trace_1[gpr]), name2, len(gpr_trace_2[gpr])))
-          #        else:
-          #          if not gpr_trace_2.get(gpr):
-          #            trace = RiscvInstructionTraceEntry()
-          #            trace.rd_val = "0"
-          #            trace.rd = gpr
-          #            trace.instr_str = ""
-          #            trace.binary = ""
-          #            trace.addr = ""
-          #            gpr_trace_2[gpr] = [trace]
-          #        if int(gpr_trace_1[gpr][-1].rd_val, 16) != \
-          #           int(gpr_trace_2[gpr][-1].rd_val, 16):
-          #          mismatch_cnt += 1
-          #          if mismatch_cnt <= mismatch_print_limit:
-          #            fd.write("Mismatch final value:\n")
-          #            fd.write("%s : %s\n" % (name1, gpr_trace_1[gpr][-1].get_trace_string()))
-          #            fd.write("%s : %s\n" % (name2, gpr_trace_2[gpr][-1].get_trace_string()))
-        if mismatch_cnt == 0:
-            compare_result = "[PASSED]: {} matched\n".format(matched_cnt)
+            mismatch_cnt += 1
+            fd.write("Zero GPR[{}] updates observed in {}\n".format(
+                gpr, name2))
+            continue
+        if int(rd_val_1, 16) != int(rd_val_2, 16):
+            mismatch_cnt += 1
+            if mismatch_cnt <= mismatch_print_limit:
+                fd.write("Mismatch final value:\n")
+                fd.write("{} : {}\n".format(name1, trace_1.get_trace_string()))
+                fd.write("{} : {}\n".format(name2, trace_2.get_trace_string()))
         else:
-            compare_result = "[FAILED]: {} matched, {} mismatch\n".format(
-                matched_cnt, mismatch_cnt)
-        fd.write(compare_result + "\n")
-        if log:
-            fd.close()
-        return compare_result
-
-
-# def parse_gpr_update_from_trace(trace_csv, gpr_trace):
-#  prev_val = {}
-#  for trace in trace_csv:
-#    if trace.rd != "":
-#      if not (trace.rd in prev_val):
-#        gpr_trace[trace.rd] = []
-#        gpr_trace[trace.rd].append(trace)
-#      elif prev_val[trace.rd] != trace.rd_val:
-#        gpr_trace[trace.rd].append(trace)
-#      prev_val[trace.rd] = trace.rd_val
+            matched_cnt += 1
+    return matched_cnt, mismatch_cnt
+
+
+def count_entries(trace):
+    """Consume the rest of a trace iterator, return the number of entries"""
+    return sum(1 for _ in trace)
 
 
 def check_update_gpr(gpr_update, gpr):
@@ -59,17 +59,14 @@ def is_csr(r):
         return False
 
 
-def process_ovpsim_sim_log(ovpsim_log, csv,
-                           stop_on_first_error=0,
-                           dont_truncate_after_first_ecall=0,
-                           full_trace=True):
-    """Process OVPsim simulation log.
+def read_ovpsim_trace(ovpsim_log,
+                      stop_on_first_error=0,
+                      dont_truncate_after_first_ecall=0):
+    """Read an OVPsim simulation log, yielding executed instructions
 
-    Extract instruction and affected register information from ovpsim simulation
-    log and save to a list.
+    The log is truncated in place first. This function yields (entry, illegal)
+    tuples, illegal is always false.
     """
-    logging.info("Processing ovpsim log : {}".format(ovpsim_log))
-
     # Remove the header part of ovpsim log
     cmd = ("sed -i '/Info 1:/,$!d' {}".format(ovpsim_log))
     os.system(cmd)
@@ -82,16 +79,14 @@ def process_ovpsim_sim_log(ovpsim_log, csv,
     os.system(cmd)
 
     instr_cnt = 0
-    with open(ovpsim_log, "r") as f, open(csv, "w") as csv_fd:
-        trace_csv = RiscvInstructionTraceCsv(csv_fd)
-        trace_csv.start_new_trace()
+    with open(ovpsim_log, "r") as f:
         prev_trace = 0
         for line in f:
             # Extract instruction infromation
             m = INSTR_RE.search(line)
             if m:
                 if prev_trace:  # write out the previous one when find next one
-                    trace_csv.write_trace_entry(prev_trace)
+                    yield prev_trace, False
                     instr_cnt += 1
                     prev_trace = 0
                 prev_trace = RiscvInstructionTraceEntry()
@@ -99,12 +94,6 @@ def process_ovpsim_sim_log(ovpsim_log, csv,
                 prev_trace.pc = m.group("addr")
                 prev_trace.mode = convert_mode(m.group("mode"), line)
                 prev_trace.binary = m.group("bin")
-                if full_trace:
-                    prev_trace.instr = prev_trace.instr_str.split(" ")[0]
-                    prev_trace.operand = prev_trace.instr_str[
-                                         len(prev_trace.instr):]
-                    prev_trace.operand = prev_trace.operand.replace(" ", "")
-                    process_trace(prev_trace)
                 continue
             # Extract register change value information
             c = RD_RE.search(line)
@@ -113,23 +102,31 @@ def process_ovpsim_sim_log(ovpsim_log, csv,
                     prev_trace.csr.append(c.group("r") + ":" + c.group("val"))
                 else:
                     prev_trace.gpr.append(c.group("r") + ":" + c.group("val"))
-    logging.info("Processed instruction count : {} ".format(instr_cnt))
     if instr_cnt == 0:
         logging.error("No Instructions in logfile: {}".format(ovpsim_log))
         sys.exit(RET_FATAL)
-    logging.info("CSV saved to : {}".format(csv))
 
 
 def process_trace(trace):
     """ Process instruction operands """
+    process_trace_operands(trace)
+    trace.instr, trace.operand = convert_pseudo_instr(
+        trace.instr, trace.operand, trace.binary)
+    process_base_operand(trace)
+
+
+def process_trace_operands(trace):
+    """ Process instruction operands before converting pseudo instructions """
     process_compressed_instr(trace)
     process_imm(trace)
     if trace.instr == "jalr":
         process_jalr(trace)
-    trace.instr, trace.operand = convert_pseudo_instr(
-        trace.instr, trace.operand, trace.binary)
-    # process any instruction of the form:
-    # <instr> <reg> <imm>(<reg>)
+
+
+def process_base_operand(trace):
+    """ Process the operands of an instruction of the form:
+    <instr> <reg> <imm>(<reg>)
+    """
     m = BASE_RE.search(trace.operand)
     if m:
         trace.operand = "{},{},{}".format(
@@ -196,6 +193,37 @@ def process_compressed_instr(trace):
             trace.operand = o[1]
 
 
+OVPSIM_LOG_FORMAT = TraceLogFormat(
+    "ovpsim", read_ovpsim_trace,
+    fix_instr=(process_trace_operands, process_base_operand), pc_operands=True)
+
+
+def ovpsim_sim_log_entries(ovpsim_log,
+                           stop_on_first_error=0,
+                           dont_truncate_after_first_ecall=0,
+                           full_trace=True):
+    """Generate the entries of an OVPsim simulation log which go to its CSV
+
+    The log is truncated in place first.
+    """
+    return sim_log_entries(
+        OVPSIM_LOG_FORMAT, ovpsim_log, full_trace,
+        (stop_on_first_error, dont_truncate_after_first_ecall))
+
+
+def process_ovpsim_sim_log(ovpsim_log, csv,
+                           stop_on_first_error=0,
+                           dont_truncate_after_first_ecall=0,
+                           full_trace=True):
+    """Process OVPsim simulation log.
+
+    Extract instruction and affected register information from ovpsim simulation
+    log and write the results to a CSV file at csv.
+    """
+    process_sim_log(OVPSIM_LOG_FORMAT, ovpsim_log, csv, full_trace,
+                    (stop_on_first_error, dont_truncate_after_first_ecall))
+
+
 def main():
     """ if used standalone set up for testing """
     # Parse input arguments
@@ -54,9 +54,10 @@ GPR_NAMES = [
 # =============================================================================
 
 
-def process_renode_sim_log(log_name, csv_name):
+def read_renode_trace(log_name):
     """
-    Converts a Renode trace log to CSV format
+    Reads a Renode trace log, yielding (entry, illegal) tuples for the
+    instructions which change a GPR, illegal is always false
     """
 
     # Build lookups
@@ -69,7 +70,6 @@ def process_renode_sim_log(log_name, csv_name):
 
     # FIXME: Assume initial state of all GPR set to 0
     state   = {m[0].upper(): "0" for m in GPR_NAMES}
-    trace   = []
 
     with open(log_name, "r") as fp:
         for line in fp:
@@ -115,25 +115,35 @@ def process_renode_sim_log(log_name, csv_name):
 
             # Add only if there is a GPR/CSR change
             if entry.gpr or entry.csr:
-                trace.append(entry)
+                yield entry, False
 
             prev_pc = state["PC"]
 
-    return trace
+
+RENODE_LOG_FORMAT = TraceLogFormat("renode", read_renode_trace)
+
+
+def process_renode_sim_log(log_name, csv_name):
+    """
+    Reads a Renode trace log, returns the list of its trace entries. The CSV
+    is written by write_csv, csv_name is unused.
+    """
+    return list(sim_log_entries(RENODE_LOG_FORMAT, log_name))
 
 
 def write_csv(file_name, data):
     """
     Writes the trace to CSV
     """
+    return write_trace_csv(file_name, data)
 
-    with open(file_name, "w") as fp:
-
-        writer = RiscvInstructionTraceCsv(fp)
-        writer.start_new_trace()
 
-        for entry in data:
-            writer.write_trace_entry(entry)
+def convert_renode_sim_log(log_name, csv_name):
+    """
+    Converts a Renode trace log to CSV format without keeping the whole trace
+    in memory, returns the number of entries written
+    """
+    return process_sim_log(RENODE_LOG_FORMAT, log_name, csv_name)
 
 # ============================================================================
 
@@ -150,10 +160,8 @@ def main():
     args = parser.parse_args()
     setup_logging(args.verbose)
 
-    # Process Renode log
-    trace = process_renode_sim_log(args.log, args.csv)
-    # Write CSV
-    write_csv(args.csv, trace)
+    # Process Renode log and write CSV
+    convert_renode_sim_log(args.log, args.csv)
 
 
 if __name__ == "__main__":
@@ -17,11 +17,30 @@ Class for RISC-V instruction trace CSV
 """
 
 import csv
+import functools
+import io
 import re
 import logging
+import mmap
+import multiprocessing
+import os
+import queue
 import sys
+import traceback
 from lib import *
 
+# Trace entries are sent from a parsing process in batches of this size
+STREAM_BATCH_SIZE = 4096
+# Maximum number of batches waiting to be compared
+STREAM_QUEUE_DEPTH = 16
+# Approximate size of the chunks of a log parsed by convert_log_chunks
+LOG_CHUNK_SIZE = 32 << 20
+# Number of distinct instructions whose decoding is kept by decode_instr
+DECODE_CACHE_SIZE = 1 << 16
+
+TRACE_CSV_FIELDS = ["pc", "instr", "gpr", "csr", "binary", "mode", "instr_str",
+                    "operand", "pad"]
+
 
 class RiscvInstructionTraceEntry(object):
     """RISC-V instruction trace entry"""
@@ -51,15 +70,19 @@ class RiscvInstructionTraceCsv(object):
     def __init__(self, csv_fd):
         self.csv_fd = csv_fd
 
-    def start_new_trace(self):
+    def start_new_trace(self, header=True):
         """Create a CSV file handle for a new trace"""
-        fields = ["pc", "instr", "gpr", "csr", "binary", "mode", "instr_str",
-                  "operand", "pad"]
-        self.csv_writer = csv.DictWriter(self.csv_fd, fieldnames=fields)
-        self.csv_writer.writeheader()
+        self.csv_writer = csv.writer(self.csv_fd)
+        if header:
+            self.csv_writer.writerow(TRACE_CSV_FIELDS)
 
     def read_trace(self, trace):
         """Read instruction trace from CSV file"""
+        for new_trace in self.iter_trace():
+            trace.append(new_trace)
+
+    def iter_trace(self):
+        """Generate the instruction trace entries of the CSV file one by one"""
         csv_reader = csv.DictReader(self.csv_fd)
         for row in csv_reader:
             new_trace = RiscvInstructionTraceEntry()
@@ -71,20 +94,452 @@ class RiscvInstructionTraceCsv(object):
             new_trace.instr_str = row['instr_str']
             new_trace.instr = row['instr']
             new_trace.mode = row['mode']
-            trace.append(new_trace)
+            yield new_trace
 
     # TODO: Convert pseudo instruction to regular instruction
 
     def write_trace_entry(self, entry):
         """Write a new trace entry to CSV"""
-        self.csv_writer.writerow({'instr_str': entry.instr_str,
-                                  'gpr'      : ";".join(entry.gpr),
-                                  'csr'      : ";".join(entry.csr),
-                                  'operand'  : entry.operand,
-                                  'pc'       : entry.pc,
-                                  'binary'   : entry.binary,
-                                  'instr'    : entry.instr,
-                                  'mode'     : entry.mode})
+        # Same order as TRACE_CSV_FIELDS, a list is much faster to write than
+        # a dict
+        self.csv_writer.writerow([entry.pc,
+                                  entry.instr,
+                                  ";".join(entry.gpr),
+                                  ";".join(entry.csr),
+                                  entry.binary,
+                                  entry.mode,
+                                  entry.instr_str,
+                                  entry.operand,
+                                  ""])
+
+
+def write_trace_csv(csv_path, entries):
+    """Write trace entries to a new CSV file, return the number of entries"""
+    count = 0
+    with open(csv_path, "w") as csv_fd:
+        trace_csv = RiscvInstructionTraceCsv(csv_fd)
+        trace_csv.start_new_trace()
+        for entry in entries:
+            trace_csv.write_trace_entry(entry)
+            count += 1
+    return count
+
+
+def _stream_trace_worker(entry_queue, read_trace, args, csv_path, batch_size):
+    """Parse a trace in a worker process, see stream_trace"""
+    try:
+        entries = read_trace(*args)
+        if csv_path:
+            csv_fd = open(csv_path, "w")
+            trace_csv = RiscvInstructionTraceCsv(csv_fd)
+            trace_csv.start_new_trace()
+        batch = []
+        for entry in entries:
+            if csv_path:
+                trace_csv.write_trace_entry(entry)
+            # Plain dicts are much faster to send than the entries
+            batch.append(entry.__dict__)
+            if len(batch) == batch_size:
+                entry_queue.put(batch)
+                batch = []
+        if csv_path:
+            csv_fd.close()
+            logging.info("CSV saved to : {}".format(csv_path))
+        entry_queue.put(batch)
+        entry_queue.put(None)
+    except SystemExit as e:
+        entry_queue.put(("exit", e.code))
+    except Exception:
+        entry_queue.put(("error", traceback.format_exc()))
+
+
+def _next_batch(entry_queue, worker):
+    """Get the next item sent by a stream_trace worker"""
+    while True:
+        try:
+            return entry_queue.get(timeout=1)
+        except queue.Empty:
+            if not worker.is_alive():
+                return ("error", "Trace parsing process died: {}"
+                        .format(worker.exitcode))
+
+
+def stream_trace(read_trace, args=(), csv_path=None,
+                 batch_size=STREAM_BATCH_SIZE):
+    """Parse the trace entries of read_trace(*args) in another process
+
+    read_trace is a generator function of RiscvInstructionTraceEntry, such as
+    the <iss>_sim_log_entries functions of the log converters. The entries are
+    also written to csv_path, unless it is None. The parsing starts at once,
+    and at most STREAM_QUEUE_DEPTH batches are parsed ahead of the consumer.
+
+    Return a generator of the entries. If the consumer stops early, the worker
+    is stopped, or left to finish the CSV file if there is one.
+    """
+    entry_queue = multiprocessing.Queue(STREAM_QUEUE_DEPTH)
+    worker = multiprocessing.Process(
+        target=_stream_trace_worker,
+        args=(entry_queue, read_trace, args, csv_path, batch_size))
+    worker.daemon = True
+    worker.start()
+    return _stream_trace_entries(entry_queue, worker, csv_path)
+
+
+def _stream_trace_entries(entry_queue, worker, csv_path):
+    """Generate the entries sent by a stream_trace worker"""
+    item = []
+    try:
+        while True:
+            item = _next_batch(entry_queue, worker)
+            if not isinstance(item, list):
+                break
+            for fields in item:
+                entry = RiscvInstructionTraceEntry.__new__(
+                    RiscvInstructionTraceEntry)
+                entry.__dict__ = fields
+                yield entry
+        if item is not None:
+            kind, value = item
+            if kind == "exit":
+                sys.exit(value)
+            raise RuntimeError("Trace parsing failed:\n" + value)
+    finally:
+        if isinstance(item, list):
+            # The consumer stopped early
+            if csv_path:
+                while isinstance(item, list):
+                    item = _next_batch(entry_queue, worker)
+            else:
+                worker.terminate()
+        worker.join()
+
+
+def _line_start(log, pos):
+    """Offset of the start of the line of a log at pos"""
+    return log.rfind(b"\n", 0, pos) + 1
+
+
+def _line_end(log, pos):
+    """Offset following the end of the line of a log at pos"""
+    end = log.find(b"\n", pos)
+    return len(log) if end < 0 else end + 1
+
+
+def _split_log(log, size):
+    """Split a log into ranges of about size bytes, at line starts"""
+    ranges = []
+    start = 0
+    while start < len(log):
+        end = _line_end(log, min(start + size, len(log)) - 1)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+def _find_log_markers(task):
+    """Find the marker lines starting in a range of a log, in a pool worker
+
+    Return a sorted list of (offset, marker index).
+    """
+    path, start, end, patterns = task
+    found = []
+    with open(path, "rb") as log_fd, \
+            mmap.mmap(log_fd.fileno(), 0, access=mmap.ACCESS_READ) as log:
+        for index, pattern in enumerate(patterns):
+            # Searching for the marker anywhere is much faster than at every
+            # line start, the matches which are not at a line start are
+            # dropped
+            marker_re = re.compile(pattern.encode())
+            for m in marker_re.finditer(log, start, _line_end(log, end - 1)):
+                if m.start() < end and _line_start(log, m.start()) == m.start():
+                    found.append((m.start(), index))
+    return sorted(found)
+
+
+def _skipped_ranges(log, markers, regions):
+    """Ranges of a log in which a parser skips the lines
+
+    markers are the (offset, marker index) of the region markers, the start
+    marker of region i has index 2 * i and its end marker 2 * i + 1. A region
+    is entered at its start marker if it is not already, and left after its
+    end marker.
+    """
+    ranges = []
+    inside = [False] * len(regions)
+    start = None
+    for pos, index in markers:
+        region, is_end = divmod(index, 2)
+        if inside[region] == bool(is_end):
+            inside[region] = not is_end
+            if any(inside) and start is None:
+                start = pos
+            elif not any(inside):
+                ranges.append((start, _line_end(log, pos)))
+                start = None
+    if start is not None:
+        ranges.append((start, len(log)))
+    return ranges
+
+
+def _next_chunk_start(log, pos, instr_re, skipped):
+    """Offset of the first instruction line at or after pos outside skipped
+
+    A parser of the log can start there with no state from the previous
+    lines. Return the length of the log if there is none.
+    """
+    pos = _line_start(log, pos) if pos < len(log) else len(log)
+    for skip_start, skip_end in skipped:
+        if skip_end <= pos:
+            continue
+        # Lines before the skipped range
+        while pos < skip_start:
+            end = _line_end(log, pos)
+            if instr_re.match(log[pos:end].decode()):
+                return pos
+            pos = end
+        pos = max(pos, skip_end)
+    while pos < len(log):
+        end = _line_end(log, pos)
+        if instr_re.match(log[pos:end].decode()):
+            return pos
+        pos = end
+    return len(log)
+
+
+def _convert_log_chunk(task):
+    """Convert a chunk of a log to CSV rows, in a pool worker
+
+    Return (CSV text, number of instructions read, number of entries, whether
+    the parser stopped).
+    """
+    path, start, end, read_chunk, args, stop_instr = task
+    with open(path, "rb") as log_fd, \
+            mmap.mmap(log_fd.fileno(), 0, access=mmap.ACCESS_READ) as log:
+        # Lines as read from a file in text mode
+        lines = io.StringIO(log[start:end].decode(), newline=None)
+    csv_fd = io.StringIO()
+    trace_csv = RiscvInstructionTraceCsv(csv_fd)
+    trace_csv.start_new_trace(header=False)
+    entries = read_chunk(lines, start == 0, *args)
+    entry = None
+    instrs_out = 0
+    while True:
+        try:
+            entry = next(entries)
+        except StopIteration as stop:
+            instrs_in = stop.value
+            break
+        trace_csv.write_trace_entry(entry)
+        instrs_out += 1
+    stopped = entry is not None and entry.instr_str == stop_instr
+    return csv_fd.getvalue(), instrs_in, instrs_out, stopped
+
+
+def convert_log_chunks(log_path, csv_path, read_chunk, instr_re, args=(),
+                       jobs=None, preamble_re=None, regions=(),
+                       stop_instr="ecall", chunk_size=LOG_CHUNK_SIZE):
+    """Convert a simulation log to a trace CSV with a pool of processes
+
+    The log is memory-mapped and split into chunks of about chunk_size bytes,
+    at lines matching instr_re, which are parsed by jobs processes (one per
+    CPU if None). read_chunk(lines, first, *args) is a generator function of
+    the entries of a chunk which go to the CSV, and returns the number of
+    instructions it read. first is true for the chunk which starts the log,
+    the parser of the other chunks starts after the preamble and outside the
+    regions.
+
+    The parser must follow these rules, so that it can start at any chunk:
+    - it skips the lines up to the first one matching preamble_re, if any
+    - regions is a list of (start_re, end_re): after the preamble, it skips
+      the lines from one matching start_re to one matching end_re
+    - it stops at the first instruction stop_instr, which is its last entry
+
+    Return (number of instructions read, number of entries written).
+    """
+    if os.path.getsize(log_path) == 0:
+        # An empty file cannot be memory-mapped
+        write_trace_csv(csv_path, [])
+        return 0, 0
+    with open(log_path, "rb") as log_fd, \
+            mmap.mmap(log_fd.fileno(), 0, access=mmap.ACCESS_READ) as log, \
+            multiprocessing.Pool(jobs or None) as pool:
+        begin = 0
+        if preamble_re:
+            # The other chunks start after the end of the preamble
+            begin = len(log)
+            for m in re.compile(preamble_re.pattern.encode()).finditer(log):
+                if _line_start(log, m.start()) == m.start():
+                    begin = _line_end(log, m.start())
+                    break
+        skipped = []
+        if regions:
+            patterns = [r.pattern for region in regions for r in region]
+            markers = pool.map(_find_log_markers, [
+                (log_path, start, end, patterns)
+                for start, end in _split_log(log, chunk_size)])
+            markers = [m for found in markers for m in found if m[0] >= begin]
+            skipped = _skipped_ranges(log, markers, regions)
+        starts = [0]
+        for pos in range(begin + chunk_size, len(log), chunk_size):
+            start = _next_chunk_start(log, max(pos, _line_end(log, starts[-1])),
+                                      instr_re, skipped)
+            if start < len(log):
+                starts.append(start)
+        bounds = list(zip(starts, starts[1:] + [len(log)]))
+        logging.info("Parsing {} chunks of {}".format(len(bounds), log_path))
+        instrs_in = 0
+        instrs_out = 0
+        with open(csv_path, "w") as csv_fd:
+            RiscvInstructionTraceCsv(csv_fd).start_new_trace()
+            # The chunks are written in order, as soon as they are parsed
+            for rows, chunk_in, chunk_out, stopped in pool.imap(
+                    _convert_log_chunk,
+                    [(log_path, start, end, read_chunk, args, stop_instr)
+                     for start, end in bounds]):
+                csv_fd.write(rows)
+                instrs_in += chunk_in
+                instrs_out += chunk_out
+                if stopped:
+                    # The following chunks are ignored
+                    break
+    return instrs_in, instrs_out
+
+
+class TraceLogFormat(object):
+    """Simulation log format of an ISS
+
+    The log converter (sim_log_entries, process_sim_log) reads a log with the
+    tokenizer of its format, decodes its instructions with decode_instr and
+    writes them with write_trace_csv.
+
+    - tokenize(path, *options) generates (entry, illegal) tuples from a log,
+      illegal being true if the instruction caused an illegal instruction
+      trap. It sets the pc, binary, instr_str, mode, gpr and csr of the
+      entries.
+    - fix_instr is None if the instructions are not decoded. Otherwise it is
+      a (before, after) pair of functions, either of which may be None, which
+      adapt the instr and operand of an entry before and after
+      convert_pseudo_instr, see decode_instr.
+    - pc_operands is true if the decoded operands depend on the pc.
+    - update_only is true if the instructions which cause no architectural
+      update are skipped, unless the trace is full.
+    - read_lines(lines, in_preamble) tokenizes the lines of a chunk of a log,
+      and chunk_options are the options of convert_log_chunks, if the log can
+      be parsed in chunks.
+    """
+
+    def __init__(self, name, tokenize, fix_instr=None, pc_operands=False,
+                 update_only=False, read_lines=None, chunk_options=None):
+        self.name = name
+        self.tokenize = tokenize
+        self.fix_instr = fix_instr
+        self.pc_operands = pc_operands
+        self.update_only = update_only
+        self.read_lines = read_lines
+        self.chunk_options = chunk_options
+
+
+@functools.lru_cache(maxsize=DECODE_CACHE_SIZE)
+def decode_instr(instr_str, binary, pc, fix_before=None, fix_after=None):
+    """Decode the name and the operands of a disassembled instruction
+
+    Pseudo instructions are converted by convert_pseudo_instr, fix_before and
+    fix_after adapt the instr and operand of an entry to the log format. The
+    decoding only depends on the arguments, and traces go through the same
+    instructions again and again, so it is cached.
+
+    Return (instr, operand).
+    """
+    entry = RiscvInstructionTraceEntry()
+    entry.instr_str = instr_str
+    entry.binary = binary
+    entry.pc = pc
+    entry.instr = instr_str.split(" ")[0]
+    entry.operand = instr_str[len(entry.instr):].replace(" ", "")
+    if fix_before:
+        fix_before(entry)
+    entry.instr, entry.operand = convert_pseudo_instr(
+        entry.instr, entry.operand, binary)
+    if fix_after:
+        fix_after(entry)
+    return entry.instr, entry.operand
+
+
+def decode_entry(log_format, entry):
+    """Set the instr and operand of an entry of a log_format log
+
+    The log format must decode its instructions, see TraceLogFormat. Return
+    the entry.
+    """
+    entry.instr, entry.operand = decode_instr(
+        entry.instr_str, entry.binary,
+        entry.pc if log_format.pc_operands else "", *log_format.fix_instr)
+    return entry
+
+
+def trace_log_entries(log_format, trace, full_trace=0):
+    """Generate the entries of a tokenized log which go to its CSV
+
+    trace generates the (entry, illegal) tuples of the tokenizer of
+    log_format. The instructions are decoded if full_trace is true. Return the
+    number of instructions read.
+    """
+    decode = full_trace and log_format.fix_instr is not None
+    instrs_in = 0
+    for (entry, illegal) in trace:
+        instrs_in += 1
+        if illegal and full_trace:
+            logging.debug("Illegal instruction: {}, opcode:{}"
+                          .format(entry.instr_str, entry.binary))
+        # We say that an instruction caused an architectural update if either
+        # we saw a commit line (in which case, entry.gpr will contain a single
+        # entry) or the instruction was 'wfi' or 'ecall'.
+        if log_format.update_only and not (
+                full_trace or entry.gpr or entry.instr_str in ['wfi', 'ecall']):
+            continue
+        if decode:
+            decode_entry(log_format, entry)
+        yield entry
+    return instrs_in
+
+
+def sim_log_entries(log_format, log, full_trace=0, options=()):
+    """Generate the entries of a simulation log which go to its CSV
+
+    The log is tokenized by log_format.tokenize(log, *options).
+    """
+    logging.info("Processing {} log : {}".format(log_format.name, log))
+    instrs_in = yield from trace_log_entries(
+        log_format, log_format.tokenize(log, *options), full_trace)
+    logging.info("Processed instruction count : {}".format(instrs_in))
+
+
+def _read_log_chunk(lines, first, log_format, full_trace):
+    """Generate the entries of a chunk of a log, see process_sim_log"""
+    in_preamble = first and "preamble_re" in log_format.chunk_options
+    return trace_log_entries(
+        log_format, log_format.read_lines(lines, in_preamble), full_trace)
+
+
+def process_sim_log(log_format, log, csv_path, full_trace=0, options=(),
+                    jobs=1):
+    """Convert a simulation log to a trace CSV file
+
+    If jobs is not 1 and the log format allows it, the log is split into
+    chunks which are parsed by jobs processes, or one per CPU if jobs is 0.
+    Return the number of instructions written.
+    """
+    if jobs == 1 or log_format.read_lines is None:
+        instrs_out = write_trace_csv(
+            csv_path, sim_log_entries(log_format, log, full_trace, options))
+    else:
+        logging.info("Processing {} log : {}".format(log_format.name, log))
+        instrs_in, instrs_out = convert_log_chunks(
+            log, csv_path, _read_log_chunk, args=(log_format, full_trace),
+            jobs=jobs, **log_format.chunk_options)
+        logging.info("Processed instruction count : {}".format(instrs_in))
+    logging.info("CSV saved to : {}".format(csv_path))
+    return instrs_out
 
 
 def get_imm_hex_val(imm):
@@ -33,20 +33,14 @@ INSTR_RE = re.compile(r"\[[0-9].*\] \[(?P<pri>.)\]: 0x(?P<addr>[A-F0-9]+?)"
 RD_RE = re.compile(r"x(?P<reg>[0-9]+?) <- 0x(?P<val>[A-F0-9]*)")
 
 
-def process_sail_sim_log(sail_log, csv):
-    """Process SAIL RISCV simulation log.
+def read_sail_trace(sail_log):
+    """Read a SAIL RISCV simulation log, yielding executed instructions
 
-    Extract instruction and affected register information from sail simulation
-    log and save to a list.
+    This function yields (entry, illegal) tuples, illegal is always false.
     """
-    logging.info("Processing sail log : {}".format(sail_log))
-    instr_cnt = 0
-
-    with open(sail_log, "r") as f, open(csv, "w") as csv_fd:
+    with open(sail_log, "r") as f:
         search_start = 0
         instr_start = 0
-        trace_csv = RiscvInstructionTraceCsv(csv_fd)
-        trace_csv.start_new_trace()
         instr = None
         for line in f:
             # Extract instruction infromation
@@ -70,7 +64,6 @@ def process_sail_sim_log(sail_log, csv):
                     m = RD_RE.search(line)
                     if m:
                         # Write the extracted instruction to a csvcol buffer file
-                        instr_cnt += 1
                         rv_instr_trace = RiscvInstructionTraceEntry()
                         rv_instr_trace.gpr.append(
                             gpr_to_abi("x{}".format(m.group("reg"))) + ":" + m.group(
@@ -79,9 +72,25 @@ def process_sail_sim_log(sail_log, csv):
                         rv_instr_trace.pc = addr
                         rv_instr_trace.binary = binary
                         rv_instr_trace.instr_str = instr_str
-                        trace_csv.write_trace_entry(rv_instr_trace)
+                        yield rv_instr_trace, False
                         instr_start = 0
-    logging.info("Processed instruction count : {}".format(instr_cnt))
+
+
+SAIL_LOG_FORMAT = TraceLogFormat("sail", read_sail_trace)
+
+
+def sail_sim_log_entries(sail_log):
+    """Generate the entries of a SAIL RISCV simulation log which go to its CSV"""
+    return sim_log_entries(SAIL_LOG_FORMAT, sail_log)
+
+
+def process_sail_sim_log(sail_log, csv):
+    """Process SAIL RISCV simulation log.
+
+    Extract instruction and affected register information from sail simulation
+    log and write the results to a CSV file at csv.
+    """
+    process_sim_log(SAIL_LOG_FORMAT, sail_log, csv)
 
 
 def main():
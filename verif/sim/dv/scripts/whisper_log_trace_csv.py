@@ -35,19 +35,14 @@ INSTR_RE = re.compile(
 LOGGER = logging.getLogger()
 
 
-def process_whisper_sim_log(whisper_log, csv, full_trace=0):
-    """Process SPIKE simulation log.
+def read_whisper_trace(whisper_log):
+    """Read a whisper simulation log, yielding executed instructions
 
-    Extract instruction and affected register information from whisper simulation
-    log and save to a list.
+    This function yields (entry, illegal) tuples, illegal is always false.
     """
-    logging.info("Processing whisper log : {}".format(whisper_log))
-    instr_cnt = 0
     whisper_instr = ""
 
-    with open(whisper_log, "r") as f, open(csv, "w") as csv_fd:
-        trace_csv = RiscvInstructionTraceCsv(csv_fd)
-        trace_csv.start_new_trace()
+    with open(whisper_log, "r") as f:
         for line in f:
             # Extract instruction infromation
             m = INSTR_RE.search(line)
@@ -66,10 +61,24 @@ def process_whisper_sim_log(whisper_log, csv, full_trace=0):
                     reg = "x" + str(int(m.group("reg"), 16))
                     rv_instr_trace.gpr.append(
                         gpr_to_abi(reg) + ":" + m.group("val"))
-                    trace_csv.write_trace_entry(rv_instr_trace)
-            instr_cnt += 1
-    logging.info("Processed instruction count : {}".format(instr_cnt))
-    logging.info("CSV saved to : {}".format(csv))
+                    yield rv_instr_trace, False
+
+
+WHISPER_LOG_FORMAT = TraceLogFormat("whisper", read_whisper_trace)
+
+
+def whisper_sim_log_entries(whisper_log, full_trace=0):
+    """Generate the entries of a whisper simulation log which go to its CSV"""
+    return sim_log_entries(WHISPER_LOG_FORMAT, whisper_log, full_trace)
+
+
+def process_whisper_sim_log(whisper_log, csv, full_trace=0):
+    """Process SPIKE simulation log.
+
+    Extract instruction and affected register information from whisper simulation
+    log and write the results to a CSV file at csv.
+    """
+    process_sim_log(WHISPER_LOG_FORMAT, whisper_log, csv, full_trace)
 
 
 def main():
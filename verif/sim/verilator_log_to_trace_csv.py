@@ -32,6 +32,9 @@ RD_RE    = re.compile(r"(?P<pri>\d) 0x(?P<addr>[a-f0-9]+?) " \
                       "\((?P<bin>.*?)\) (?P<reg>[xf]\s*\d*?) 0x(?P<val>[a-f0-9]+)")
 CORE_RE  = re.compile(r"core.*0x(?P<addr>[a-f0-9]+?) \(0x(?P<bin>.*?)\) (?P<instr>.*?)$")
 ILLE_RE  = re.compile(r"trap_illegal_instruction")
+END_TRAMPOLINE_RE = re.compile(r'core.*: 0x0000000080000000 ')
+START_DEBUG_IT_RE = re.compile(r'core.*: 0x0000000000000800 ')
+STOP_DEBUG_IT_RE  = re.compile(r'core.*: 0x0000000000000890 ')
 
 LOGGER = logging.getLogger()
 
@@ -50,7 +53,7 @@ def process_instr(trace):
   trace.operand = trace.operand.replace(")", "")
 
 
-def read_verilator_instr(match, full_trace):
+def read_verilator_instr(match, full_trace=0):
   '''Unpack a regex match for CORE_RE to a RiscvInstructionTraceEntry
 
   If full_trace is true, extract operand data from the disassembled
@@ -71,17 +74,12 @@ def read_verilator_instr(match, full_trace):
   instr.binary = match.group('bin')
 
   if full_trace:
-    opcode = disasm.split(' ')[0]
-    operand = disasm[len(opcode):].replace(' ', '')
-    instr.instr, instr.operand = \
-      convert_pseudo_instr(opcode, operand, instr.binary)
-
-    process_instr(instr)
+    decode_entry(VERILATOR_LOG_FORMAT, instr)
 
   return instr
 
 
-def read_verilator_trace(path, full_trace):
+def read_verilator_trace(path, full_trace=0):
   '''Read a Spike simulation log at <path>, yielding executed instructions.
 
   This assumes that the log was generated with the -l and --log-commits options
@@ -99,6 +97,17 @@ def read_verilator_trace(path, full_trace):
   (entry, illegal). entry is a RiscvInstructionTraceEntry. illegal is a
   boolean, which is true if the instruction caused an illegal instruction trap.
 
+  '''
+  with open(path, 'r') as handle:
+    yield from read_verilator_lines(handle, full_trace=full_trace)
+
+
+def read_verilator_lines(lines, in_trampoline=True, full_trace=0):
+  '''Parse the lines of a Verilator simulation log, see read_verilator_trace
+
+  in_trampoline is false if the lines follow the end of the trampoline, and
+  are not in the debug region.
+
   '''
 
   # This loop is a simple FSM with states TRAMPOLINE, INSTR, EFFECT. The idea
@@ -114,120 +123,105 @@ def read_verilator_trace(path, full_trace):
   # true. Otherwise, we are in state EFFECT if instr is not None, otherwise we
   # are in state INSTR.
 
-  end_trampoline_re = re.compile(r'core.*: 0x0000000080000000 ')
-  start_debug_it_re = re.compile(r'core.*: 0x0000000000000800 ')
-  stop_debug_it_re  = re.compile(r'core.*: 0x0000000000000890 ')
-
-  in_trampoline = True
   in_debug = False
   instr = None
 
-  with open(path, 'r') as handle:
-    for line in handle:
-      if in_trampoline:
-        # The TRAMPOLINE state
-        if end_trampoline_re.match(line):
-          in_trampoline = False
-        else :
-          continue
-
-      if not in_trampoline:
-        if in_debug:
-          if stop_debug_it_re.match(line):
-            in_debug = False
-          continue
-        else:
-          if start_debug_it_re.match(line):
-            in_debug = True
-            continue
-
-      if instr is None:
-        # The INSTR state. We expect to see a line matching CORE_RE. We'll
-        # discard any other lines.
-        instr_match = CORE_RE.match(line)
-        if not instr_match:
-          continue
-
-        instr = read_verilator_instr(instr_match, full_trace)
-
-        # If instr.instr_str is 'ecall', we should stop.
-        if instr.instr_str == 'ecall':
-          break
+  for line in lines:
+    if in_trampoline:
+      # The TRAMPOLINE state
+      if END_TRAMPOLINE_RE.match(line):
+        in_trampoline = False
+      else :
+        continue
 
+    if not in_trampoline:
+      if in_debug:
+        if STOP_DEBUG_IT_RE.match(line):
+          in_debug = False
         continue
+      else:
+        if START_DEBUG_IT_RE.match(line):
+          in_debug = True
+          continue
 
-      # The EFFECT state. If the line matches CORE_RE, we should have been in
-      # state INSTR, so we yield the instruction we had, read the new
-      # instruction and continue. As above, if the new instruction is 'ecall',
-      # we need to stop immediately.
+    if instr is None:
+      # The INSTR state. We expect to see a line matching CORE_RE. We'll
+      # discard any other lines.
       instr_match = CORE_RE.match(line)
-      if instr_match:
-        yield (instr, False)
-        instr = read_verilator_instr(instr_match, full_trace)
-        if instr.instr_str == 'ecall':
-          break
+      if not instr_match:
         continue
 
-      # The line doesn't match CORE_RE, so we are definitely on a follow-on
-      # line in the log. First, check for illegal instructions
-      if 'trap_illegal_instruction' in line:
-        yield (instr, True)
-        instr = None
-        continue
+      instr = read_verilator_instr(instr_match, full_trace)
 
-      # The instruction seems to have been fine. Do we have commit data (from
-      # the --log-commits Spike option)?
-      commit_match = RD_RE.match(line)
-      if commit_match:
-        instr.gpr.append(gpr_to_abi(commit_match.group('reg')
-                                    .replace(' ', '')) +
-                         ':' + commit_match.group('val'))
-        instr.mode = commit_match.group('pri')
-
-    # At EOF, we might have an instruction in hand. Yield it if so.
-    if instr is not None:
+      # If instr.instr_str is 'ecall', we should stop.
+      if instr.instr_str == 'ecall':
+        break
+
+      continue
+
+    # The EFFECT state. If the line matches CORE_RE, we should have been in
+    # state INSTR, so we yield the instruction we had, read the new
+    # instruction and continue. As above, if the new instruction is 'ecall',
+    # we need to stop immediately.
+    instr_match = CORE_RE.match(line)
+    if instr_match:
       yield (instr, False)
+      instr = read_verilator_instr(instr_match, full_trace)
+      if instr.instr_str == 'ecall':
+        break
+      continue
 
+    # The line doesn't match CORE_RE, so we are definitely on a follow-on
+    # line in the log. First, check for illegal instructions
+    if 'trap_illegal_instruction' in line:
+      yield (instr, True)
+      instr = None
+      continue
 
-def process_verilator_sim_log(verilator_log, csv, full_trace = 0):
-  """Process VERILATOR simulation log.
+    # The instruction seems to have been fine. Do we have commit data (from
+    # the --log-commits Spike option)?
+    commit_match = RD_RE.match(line)
+    if commit_match:
+      instr.gpr.append(gpr_to_abi(commit_match.group('reg')
+                                  .replace(' ', '')) +
+                       ':' + commit_match.group('val'))
+      instr.mode = commit_match.group('pri')
 
-  Extract instruction and affected register information from verilator simulation
-  log and write the results to a CSV file at csv. Returns the number of
-  instructions written.
+  # At EOF, we might have an instruction in hand. Yield it if so.
+  if instr is not None:
+    yield (instr, False)
 
-  """
-  logging.info("Processing verilator log : %s" % verilator_log)
 
-  instrs_in = 0
-  instrs_out = 0
+VERILATOR_LOG_FORMAT = TraceLogFormat(
+    "verilator", read_verilator_trace, fix_instr=(None, process_instr),
+    update_only=True, read_lines=read_verilator_lines,
+    chunk_options=dict(instr_re=CORE_RE, preamble_re=END_TRAMPOLINE_RE,
+                       regions=[(START_DEBUG_IT_RE, STOP_DEBUG_IT_RE)]))
 
-  with open(csv, "w") as csv_fd:
-    trace_csv = RiscvInstructionTraceCsv(csv_fd)
-    trace_csv.start_new_trace()
 
-    for (entry, illegal) in read_verilator_trace(verilator_log, full_trace):
-      instrs_in += 1
+def verilator_sim_log_entries(verilator_log, full_trace=0):
+  """Generate the entries of a Verilator simulation log which go to its CSV
 
-      if illegal and full_trace:
-        logging.debug("Illegal instruction: {}, opcode:{}"
-                      .format(entry.instr_str, entry.binary))
+  Instructions that cause no architectural update are skipped if full_trace
+  is false.
 
-      # Instructions that cause no architectural update (which includes illegal
-      # instructions) are ignored if full_trace is false.
-      #
-      # We say that an instruction caused an architectural update if either we
-      # saw a commit line (in which case, entry.gpr will contain a single
-      # entry) or the instruction was 'wfi' or 'ecall'.
-      if not (full_trace or entry.gpr or entry.instr_str in ['wfi', 'ecall']):
-        continue
+  """
+  return sim_log_entries(VERILATOR_LOG_FORMAT, verilator_log, full_trace)
 
-      trace_csv.write_trace_entry(entry)
-      instrs_out += 1
 
-  logging.info("Processed instruction count : %d" % instrs_in)
-  logging.info("CSV saved to : %s" % csv)
-  return instrs_out
+def process_verilator_sim_log(verilator_log, csv, full_trace = 0, jobs = 1):
+  """Process VERILATOR simulation log.
+
+  Extract instruction and affected register information from verilator simulation
+  log and write the results to a CSV file at csv. Returns the number of
+  instructions written.
+
+  If jobs is not 1, the log is split into chunks which are parsed by jobs
+  processes, or one per CPU if jobs is 0.
+
+  """
+  return process_sim_log(VERILATOR_LOG_FORMAT, verilator_log, csv, full_trace,
+                         jobs=jobs)
 
 
 def main():
@@ -237,6 +231,9 @@ def main():
   parser.add_argument("--csv", type=str, help="Output trace csv_buf file")
   parser.add_argument("-f", "--full_trace", dest="full_trace", action="store_true",
                                          help="Generate the full trace")
+  parser.add_argument("-j", "--jobs", type=int, default=1,
+                      help="Number of processes parsing the log in chunks, "
+                           "0 for one per CPU")
   parser.add_argument("-v", "--verbose", dest="verbose", action="store_true",
                                          help="Verbose logging")
   parser.set_defaults(full_trace=False)
@@ -244,7 +241,8 @@ def main():
   args = parser.parse_args()
   setup_logging(args.verbose)
   # Process verilator log
-  process_verilator_sim_log(args.log, args.csv, args.full_trace)
+  process_verilator_sim_log(args.log, args.csv, args.full_trace,
+                            args.jobs)
 
 
 if __name__ == "__main__":